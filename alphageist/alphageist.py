@@ -12,6 +12,7 @@ from langchain.callbacks.base import BaseCallbackHandler
 
 from alphageist import state as s
 from alphageist.vectorstore import VectorStore
+from alphageist.custom_retriever import KEYWORD
 from alphageist import constant
 from alphageist import query
 from alphageist import errors
@@ -23,6 +24,9 @@ logger = logging.getLogger(constant.LOGGER_NAME)
 
 STATE_SUBSCRIPTION_SIGNATURE = Callable[[s.State, s.State], None]
 
+# Changing these moves the index, so it can not be rebuilt next to the current one
+STORAGE_CONFIG_KEYS = (cfg.VECTORDB_DIR, cfg.LOCAL_INDEX_BACKEND)
+
 def get_config()->cfg.Config:
     return cfg.load_config(constant.CONFIG_PATH, cfg.get_default_config())
 
@@ -30,11 +34,14 @@ class Alphageist(util.StateSubscriptionMixin):
     vectorstore: VectorStore
     exception: Optional[Exception]
     config: cfg.Config
+    _query_ctx: Optional[util.QueryContext] # Of the running query
 
     def __init__(self):
         super().__init__()
         self._state = s.NEW
+        self._state_lock = threading.RLock()
         self.exception = None
+        self._query_ctx = None
         self.vectorstore = VectorStore()
         self.vectorstore.subscribe_to_statechange(self.on_vectorstor_state_change)
 
@@ -66,8 +73,14 @@ class Alphageist(util.StateSubscriptionMixin):
                 log_lvl = self.config[cfg.LOG_LEVEL]
                 logger.info(f"Setting loglevel to {log_lvl}")
                 util.set_logging_level(log_lvl)
+            self._start_loading_tokenizer()
             self.state = s.CONFIGURED
 
+    def _start_loading_tokenizer(self)->None:
+        # Tokens are estimated until it is loaded. Keyword mode makes no network calls.
+        if self.config.get(cfg.RETRIEVAL_MODE) != KEYWORD:
+            util.start_loading_tokenizer()
+
     @util.allowed_states({s.CONFIGURED})        
     def start_init_vectorstore(self)->Optional[util.LoadingContext]:
         self.vectorstore.start_init_vectorstore(self.config)
@@ -78,30 +91,88 @@ class Alphageist(util.StateSubscriptionMixin):
         self.state = s.STANDBY
 
     @util.allowed_states({s.STANDBY})
-    def start_search(self, query_string:str, callbacks: list[BaseCallbackHandler] = [])->None:
+    def start_update_vectorstore(self)->Optional[util.LoadingContext]:
+        """Indexes files added or modified since the vectorstore was last updated"""
+        self.vectorstore.start_update_vectorstore(self.config)
+        return self.vectorstore.loading_ctx
+
+    @util.allowed_states({s.STANDBY})
+    def start_rebuild_vectorstore(self)->Optional[util.LoadingContext]:
+        """Indexes everything from scratch in the background. The current index
+        stays searchable until the new one replaces it."""
+        self.vectorstore.start_rebuild_vectorstore(self.config)
+        return self.vectorstore.loading_ctx
+
+    def get_indexing_ctx(self)->Optional[util.LoadingContext]:
+        """Returns the loading context while the vectorstore is being created, otherwise None"""
+        if self.vectorstore.state is not s.LOADING:
+            return None
+        return self.vectorstore.loading_ctx
+
+    @util.allowed_states({s.STANDBY, s.LOADING_VECTORSTORE, s.QUERYING})
+    def start_search(self, query_string:str, callbacks: list[BaseCallbackHandler] = [])->util.QueryContext:
+        """Starts answering query_string in the background and returns its 
+        handle. A running query is cancelled and replaced by the new one."""
         if not query_string:
             raise ValueError("Search string cannot be empty")
+        self.cancel_search()
+        if self.state is s.LOADING_VECTORSTORE:
+            if not self.config.get(cfg.SEARCH_WHILE_INDEXING, False):
+                raise errors.InvalidStateError(self.state, {s.STANDBY})
+            if not self.vectorstore.is_searchable():
+                raise errors.IndexNotReadyError
+
+        query_ctx = util.QueryContext(query_string)
 
         def on_llm_finish(response, **kwargs):
-            self.state = s.STANDBY
+            with self._state_lock:
+                if query_ctx is not self._query_ctx:
+                    return # Cancelled or replaced, the state has already moved on
+                self._query_ctx = None
+                self.state = self._get_idle_state()
 
         cbh = callbackhandler.CustomStreamHandler(
             on_llm_new_token=lambda *args, **kwargs:None,
             on_llm_end=on_llm_finish,
         )
-        callbacks.append(cbh)
 
-        query_thread = threading.Thread(
-            target=self.vectorstore.query, 
-            args=(self.config, query_string),
-            kwargs={'callbacks':callbacks},
-            daemon=True)
         logger.info(f"starting search for: {query_string}")
-        query_thread.start()
-        self.state = s.QUERYING
-
-    @util.allowed_states({s.NEW, s.CONFIGURED, s.STANDBY, s.ERROR, s.LOADING_VECTORSTORE})
+        with self._state_lock:
+            self._query_ctx = query_ctx
+            self.state = s.QUERYING # Before starting, a fast query could otherwise finish first
+        # Runs on the event loop shared by all queries
+        self.vectorstore.start_query(self.config, query_string, callbacks=[*callbacks, cbh], query_ctx=query_ctx)
+        return query_ctx
+
+    def cancel_search(self)->None:
+        """Cancels the running query, if any, and goes back to standby right 
+        away. Its task is cancelled, which aborts retrieval and closes the LLM 
+        stream."""
+        with self._state_lock:
+            if self._query_ctx is None:
+                return
+            logger.info(f"cancelling search for: {self._query_ctx.query}")
+            self._query_ctx.cancel()
+            self._query_ctx = None
+            if self.state is s.QUERYING:
+                self.state = self._get_idle_state()
+
+    def _get_idle_state(self)->s.State:
+        # Go back to loading if the vectorstore is still being created
+        return s.LOADING_VECTORSTORE if self.vectorstore.state is s.LOADING else s.STANDBY
+
+    def search_files(self, query_string: str, limit: int = 10)->list[str]:
+        """Paths of files whose path contains the words of query_string. Runs 
+        in a few ms without the LLM, so it can be called on every keystroke and 
+        in any state, also while indexing or querying."""
+        return self.vectorstore.paths.search(query_string, limit)
+
+    @util.allowed_states({s.NEW, s.CONFIGURED, s.STANDBY, s.ERROR, s.LOADING_VECTORSTORE, s.QUERYING})
     def reset(self):
+        with self._state_lock:
+            if self._query_ctx is not None:
+                self._query_ctx.cancel()
+                self._query_ctx = None
         self.exception = None
         self.vectorstore.reset()
         self.state = s.NEW
@@ -113,10 +184,29 @@ class Alphageist(util.StateSubscriptionMixin):
         elif new_state is s.LOADING:
             self.state = s.LOADING_VECTORSTORE
         elif new_state is s.LOADED and old_state is s.LOADING:
-            self.finish_init_vectorstore()
+            with self._state_lock:
+                # If a search is running it will move on to standby when finished
+                if self.state is s.LOADING_VECTORSTORE:
+                    self.finish_init_vectorstore()
 
     def on_config_changed(self):
-        self.reset() 
+        # Without a working index, or when it moves, start over from the new config
+        if self.state is not s.STANDBY:
+            self.reset()
+            return
+        try:
+            config = get_config()
+            config.check()
+        except Exception:
+            self.reset()
+            return
+        if any(config.get(key) != self.config.get(key) for key in STORAGE_CONFIG_KEYS):
+            self.reset()
+            return
+        old_config, self.config = self.config, config
+        util.set_logging_level(self.config[cfg.LOG_LEVEL])
+        self._start_loading_tokenizer()
+        self.vectorstore.reconfigure(old_config, self.config)
 
 
 
@@ -0,0 +1,216 @@
+import json
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+from collections.abc import Iterable
+
+import numpy as np
+
+from alphageist.embedding_cache import normalize_text
+from alphageist import constant
+
+logger = logging.getLogger(constant.LOGGER_NAME)
+
+_SQLITE_MAX_VARIABLES = 500
+_EVICT_TO = 0.9 # Evict down to this fraction of max entries to avoid evicting on every put
+
+def get_query_key(query: str) -> str:
+    """Queries only differing in case and whitespace share the same key"""
+    return hashlib.sha256(normalize_text(query).lower().encode()).hexdigest()
+
+class CachedAnswer:
+    answer: str
+    sources: str
+    source_files: list[str] # Files of the chunks the answer was based on
+
+    def __init__(self, answer: str, sources: str, source_files: list[str]):
+        self.answer = answer
+        self.sources = sources
+        self.source_files = source_files
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, CachedAnswer) and vars(self) == vars(other)
+
+    def __repr__(self) -> str:
+        return f"CachedAnswer(answer={self.answer!r}, sources={self.sources!r})"
+
+class AnswerCache:
+    """Persistent cache of query answers backed by SQLite.
+
+    Answers are stored per scope, which identifies the index version and the
+    query settings they were produced with. An answer is found by its query
+    or, given the query vector, by the most similar cached query. Answers are
+    removed when a file they were based on changes, once they are older than
+    max_age_s and, least recently used first, beyond max_entries.
+
+    The database is opened on first use."""
+    db_path: Path
+    max_entries: int
+    max_age_s: float # 0 = no limit
+    _conn: Optional[sqlite3.Connection]
+    _vectors: dict[str, tuple[np.ndarray, np.ndarray]] # Scope -> answer ids, normalized query vectors
+
+    def __init__(self, db_path: Path, max_entries: int, max_age_s: float = 0):
+        self.db_path = Path(db_path)
+        self.max_entries = max_entries
+        self.max_age_s = max_age_s
+        self._lock = threading.Lock()
+        self._conn = None
+        self._vectors = {}
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.executescript("""
+                PRAGMA journal_mode=WAL;
+                CREATE TABLE IF NOT EXISTS answers (
+                    id INTEGER PRIMARY KEY,
+                    scope TEXT NOT NULL,
+                    query_key TEXT NOT NULL,
+                    vector BLOB,
+                    answer TEXT NOT NULL,
+                    sources TEXT NOT NULL,
+                    source_files TEXT NOT NULL,
+                    created REAL NOT NULL,
+                    last_used REAL NOT NULL,
+                    UNIQUE (scope, query_key)
+                );
+                CREATE INDEX IF NOT EXISTS answers_last_used ON answers(last_used);
+                CREATE TABLE IF NOT EXISTS answer_sources (
+                    source TEXT NOT NULL,
+                    answer_id INTEGER NOT NULL,
+                    PRIMARY KEY (source, answer_id)
+                );
+            """)
+        return self._conn
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connect().execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+
+    def _min_created(self) -> float:
+        return time.time() - self.max_age_s if self.max_age_s > 0 else 0.0
+
+    def get(self, scope: str, query: str,
+            vector: Optional[list[float]] = None,
+            min_similarity: float = 1.0) -> Optional[CachedAnswer]:
+        """The answer cached for query, otherwise, if vector is given, the one
+        cached for the most similar query if its cosine similarity is at least
+        min_similarity"""
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute("SELECT id FROM answers WHERE scope = ? AND query_key = ? AND created >= ?",
+                               (scope, get_query_key(query), self._min_created())).fetchone()
+            if row is None and vector is not None and min_similarity < 1.0:
+                row = self._most_similar(conn, scope, vector, min_similarity)
+            if row is None:
+                return None
+            answer_id = row[0]
+            # The vectors of similar queries are loaded once, so they may include expired answers
+            row = conn.execute("SELECT answer, sources, source_files FROM answers WHERE id = ? AND created >= ?",
+                               (answer_id, self._min_created())).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE answers SET last_used = ? WHERE id = ?", (time.time(), answer_id))
+            conn.commit()
+        answer, sources, source_files = row
+        return CachedAnswer(answer, sources, json.loads(source_files))
+
+    def _most_similar(self, conn: sqlite3.Connection, scope: str,
+                      vector: list[float], min_similarity: float) -> Optional[tuple[int]]:
+        if scope not in self._vectors:
+            rows = conn.execute("SELECT id, vector FROM answers WHERE scope = ? AND vector IS NOT NULL AND created >= ?",
+                                (scope, self._min_created())).fetchall()
+            ids = np.array([answer_id for answer_id, _ in rows], dtype=np.int64)
+            vectors = np.array([np.frombuffer(blob, dtype=np.float32) for _, blob in rows], dtype=np.float32)
+            self._vectors[scope] = (ids, _normalize(vectors) if len(rows) else vectors)
+        ids, vectors = self._vectors[scope]
+        query = _normalize(np.asarray(vector, dtype=np.float32))
+        if not len(ids) or vectors.shape[1] != query.shape[0]:
+            return None
+        similarities = vectors @ query
+        best = int(np.argmax(similarities))
+        if similarities[best] < min_similarity:
+            return None
+        logger.debug(f"Similar cached query found, similarity {similarities[best]:.3f}")
+        return (int(ids[best]),)
+
+    def put(self, scope: str, query: str, vector: Optional[list[float]], answer: CachedAnswer) -> None:
+        now = time.time()
+        blob = None if vector is None else np.asarray(vector, dtype=np.float32).tobytes()
+        with self._lock:
+            conn = self._connect()
+            key = get_query_key(query)
+            self._delete(conn, [row[0] for row in conn.execute(
+                "SELECT id FROM answers WHERE scope = ? AND query_key = ?", (scope, key))])
+            answer_id = conn.execute(
+                """INSERT INTO answers (scope, query_key, vector, answer, sources, source_files, created, last_used)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                (scope, key, blob, answer.answer, answer.sources, json.dumps(answer.source_files), now, now)).lastrowid
+            conn.executemany("INSERT OR IGNORE INTO answer_sources (source, answer_id) VALUES (?, ?)",
+                             ((source, answer_id) for source in set(answer.source_files)))
+            self._vectors.pop(scope, None)
+            self._evict(conn)
+            conn.commit()
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        expired = [row[0] for row in conn.execute(
+            "SELECT id FROM answers WHERE created < ?", (self._min_created(),))]
+        n_over = conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0] - len(expired) - self.max_entries
+        if n_over > 0:
+            n_keep = int(self.max_entries * _EVICT_TO)
+            expired += [row[0] for row in conn.execute(
+                "SELECT id FROM answers WHERE created >= ? ORDER BY last_used DESC LIMIT -1 OFFSET ?",
+                (self._min_created(), n_keep))]
+        if expired:
+            self._delete(conn, expired)
+            logger.debug(f"Evicted {len(expired)} answers from cache")
+
+    def _delete(self, conn: sqlite3.Connection, answer_ids: list[int]) -> None:
+        for i in range(0, len(answer_ids), _SQLITE_MAX_VARIABLES):
+            chunk = answer_ids[i:i + _SQLITE_MAX_VARIABLES]
+            placeholders = ",".join("?" * len(chunk))
+            conn.execute(f"DELETE FROM answers WHERE id IN ({placeholders})", chunk)
+            conn.execute(f"DELETE FROM answer_sources WHERE answer_id IN ({placeholders})", chunk)
+        if answer_ids:
+            self._vectors.clear()
+
+    def invalidate(self, file_paths: Iterable[str]) -> int:
+        """Removes the answers based on any of file_paths and returns how many"""
+        file_paths = list(file_paths)
+        with self._lock:
+            conn = self._connect()
+            answer_ids: set[int] = set()
+            for i in range(0, len(file_paths), _SQLITE_MAX_VARIABLES):
+                chunk = file_paths[i:i + _SQLITE_MAX_VARIABLES]
+                answer_ids.update(row[0] for row in conn.execute(
+                    f"SELECT answer_id FROM answer_sources WHERE source IN ({','.join('?' * len(chunk))})", chunk))
+            self._delete(conn, list(answer_ids))
+            conn.commit()
+        if answer_ids:
+            logger.info(f"Removed {len(answer_ids)} cached answers based on changed files")
+        return len(answer_ids)
+
+    def clear(self) -> None:
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM answers")
+            conn.execute("DELETE FROM answer_sources")
+            conn.commit()
+            self._vectors.clear()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+            self._vectors.clear()
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
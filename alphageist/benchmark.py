@@ -0,0 +1,203 @@
+"""Measurements used to choose settings. Run with
+
+    python -m alphageist.benchmark quantization [--index <numpy index dir>]
+    python -m alphageist.benchmark prompt [--files <file> ...] [--ttft]
+"""
+import os
+import argparse
+import tempfile
+import time
+from typing import Optional
+
+import numpy as np
+
+from langchain.docstore.document import Document
+from langchain.chains.qa_with_sources import stuff_prompt
+from langchain.schema.language_model import BaseLanguageModel
+
+from alphageist.local_index import (
+    CODECS,
+    NO_QUANTIZATION,
+    NumpyIndex,
+    QUANTIZATIONS,
+)
+from alphageist.prompt import (
+    PROMPT_TEMPLATES,
+    get_prompt,
+)
+from alphageist.util import count_tokens, load_tokenizer
+
+class QuantizationResult:
+    quantization: str
+    bytes_per_vector: int
+    recall: float
+    ms_per_query: float
+
+    def __init__(self, quantization: str, bytes_per_vector: int, recall: float, ms_per_query: float):
+        self.quantization = quantization
+        self.bytes_per_vector = bytes_per_vector
+        self.recall = recall
+        self.ms_per_query = ms_per_query
+
+def synthetic_vectors(n: int, dim: int, n_clusters: int = 100, seed: int = 0) -> np.ndarray:
+    """Clustered vectors, which is closer to real embeddings than uniform noise"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(n_clusters, dim))
+    vectors = centers[rng.integers(n_clusters, size=n)] + rng.normal(scale=0.8, size=(n, dim))
+    return vectors.astype(np.float32)
+
+def synthetic_queries(vectors: np.ndarray, n: int, seed: int = 1) -> np.ndarray:
+    """Queries close to, but not equal to, indexed vectors"""
+    rng = np.random.default_rng(seed)
+    picked = vectors[rng.integers(len(vectors), size=n)]
+    return (picked + rng.normal(scale=0.8, size=picked.shape)).astype(np.float32)
+
+def quantization_report(vectors: np.ndarray,
+                        queries: np.ndarray,
+                        k: int = 4,
+                        quantizations: tuple[str, ...] = QUANTIZATIONS) -> list[QuantizationResult]:
+    """Indexes vectors once per quantization and measures the recall@k
+    compared to the exact search and the mean latency of a single query"""
+    dim = vectors.shape[1]
+    ids = [str(i) for i in range(len(vectors))]
+    docs = [Document(page_content="", metadata={}) for _ in ids]
+    exact: Optional[list[set[str]]] = None
+    results = []
+    for quantization in (NO_QUANTIZATION, *(q for q in quantizations if q != NO_QUANTIZATION)):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            index = NumpyIndex(tmp_dir, None, quantization) # type: ignore
+            index.create(dim)
+            index.upsert(ids, vectors, docs) # type: ignore
+            index.search(queries[:1].tolist(), k) # Warm up the page cache
+            found = []
+            start = time.perf_counter()
+            for query in queries:
+                found.append({i for i, _, _ in index.search([query.tolist()], k)[0]})
+            ms_per_query = (time.perf_counter() - start) * 1000 / len(queries)
+            index.close()
+        if exact is None:
+            exact = found
+        recall = float(np.mean([len(f & e) / len(e) for f, e in zip(found, exact)]))
+        codec = CODECS.get(quantization)
+        bytes_per_vector = dim * 4 if codec is None else codec.width(dim) * np.dtype(codec.dtype).itemsize
+        if quantization in quantizations:
+            results.append(QuantizationResult(quantization, bytes_per_vector, recall, ms_per_query))
+    return results
+
+def format_quantization_report(results: list[QuantizationResult]) -> str:
+    lines = [f"{'quantization':<14}{'bytes/vector':>14}{'recall':>10}{'ms/query':>10}"]
+    for r in results:
+        lines.append(f"{r.quantization:<14}{r.bytes_per_vector:>14}{r.recall:>10.3f}{r.ms_per_query:>10.2f}")
+    return "\n".join(lines)
+
+class PromptResult:
+    template: str
+    prompt_tokens: int
+    ttft_s: Optional[float] # Median seconds to the first streamed token, None if not measured
+
+    def __init__(self, template: str, prompt_tokens: int, ttft_s: Optional[float]):
+        self.template = template
+        self.prompt_tokens = prompt_tokens
+        self.ttft_s = ttft_s
+
+def synthetic_docs(n: int = 4, n_chars: int = 1000, seed: int = 0) -> list[Document]:
+    """Chunks the size of those from the splitters in doc_generator"""
+    rng = np.random.default_rng(seed)
+    words = ["gearbox", "efficiency", "quarter", "result", "employee", "patent", "the", "of", "and", "is", "in", "2009"]
+    docs = []
+    for i in range(n):
+        text = ""
+        while len(text) < n_chars:
+            text += f"{words[rng.integers(len(words))]} "
+        docs.append(Document(page_content=text.strip(), metadata={"source": f"document_{i}.txt"}))
+    return docs
+
+def format_prompt(template: str, docs: list[Document], question: str) -> str:
+    """The prompt the stuff chain sends for question and docs"""
+    summaries = "\n\n".join(stuff_prompt.EXAMPLE_PROMPT.format(page_content=doc.page_content, source=doc.metadata["source"])
+                            for doc in docs)
+    return get_prompt(template).format(summaries=summaries, question=question)
+
+def measure_ttft(llm: BaseLanguageModel, prompt: str, runs: int) -> float:
+    """Median seconds from sending prompt until the first token with content is streamed"""
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        for chunk in llm.stream(prompt):
+            if getattr(chunk, "content", chunk):
+                break
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+def prompt_report(docs: list[Document],
+                  question: str,
+                  templates: tuple[str, ...] = PROMPT_TEMPLATES,
+                  llm: Optional[BaseLanguageModel] = None,
+                  runs: int = 5) -> list[PromptResult]:
+    """Prompt tokens of each template and, given an llm, the time to its first token"""
+    results = []
+    for template in templates:
+        prompt = format_prompt(template, docs, question)
+        ttft_s = None if llm is None else measure_ttft(llm, prompt, runs)
+        results.append(PromptResult(template, count_tokens(prompt), ttft_s))
+    return results
+
+def format_prompt_report(results: list[PromptResult]) -> str:
+    lines = [f"{'template':<14}{'prompt tokens':>14}{'ttft s':>10}"]
+    for r in results:
+        ttft = "-" if r.ttft_s is None else f"{r.ttft_s:.2f}"
+        lines.append(f"{r.template:<14}{r.prompt_tokens:>14}{ttft:>10}")
+    return "\n".join(lines)
+
+def _load_docs(file_paths: list[str], n: int) -> list[Document]:
+    from alphageist.doc_generator import get_docs_from_file
+    docs = [doc for file_path in file_paths for doc in get_docs_from_file(file_path)][:n]
+    if not docs:
+        raise SystemExit(f"No chunks in {', '.join(file_paths)}")
+    return docs
+
+def _load_index_vectors(index_dir: str) -> np.ndarray:
+    index = NumpyIndex(index_dir, None) # type: ignore
+    if index._vectors is None:
+        raise SystemExit(f"No vectors in {index_dir}")
+    vectors = np.array(index._vectors[index._alive])
+    index.close()
+    return vectors
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m alphageist.benchmark")
+    sub = parser.add_subparsers(dest="benchmark", required=True)
+    q = sub.add_parser("quantization", help="recall and latency of the local index quantizations")
+    q.add_argument("--index", help="numpy index directory to take the vectors from, synthetic vectors are used otherwise")
+    q.add_argument("-n", type=int, default=50000, help="number of synthetic vectors")
+    q.add_argument("--dim", type=int, default=1536, help="dimension of synthetic vectors")
+    q.add_argument("--queries", type=int, default=100)
+    q.add_argument("-k", type=int, default=4)
+    p = sub.add_parser("prompt", help="prompt tokens and time to first token of the prompt templates")
+    p.add_argument("--files", nargs="+", help="files to take the chunks from, synthetic chunks are used otherwise")
+    p.add_argument("-k", type=int, default=4, help="number of chunks in the prompt")
+    p.add_argument("--question", default="What is the efficiency of our GXB5 gearbox?")
+    p.add_argument("--ttft", action="store_true", help="also measure the time to first token, using OPENAI_API_KEY")
+    p.add_argument("--model", default="gpt-4")
+    p.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    if args.benchmark == "quantization":
+        vectors = _load_index_vectors(args.index) if args.index else synthetic_vectors(args.n, args.dim)
+        queries = synthetic_queries(vectors, args.queries)
+        print(f"{len(vectors)} vectors of dimension {vectors.shape[1]}, {len(queries)} queries, k={args.k}")
+        print(format_quantization_report(quantization_report(vectors, queries, args.k)))
+    elif args.benchmark == "prompt":
+        docs = _load_docs(args.files, args.k) if args.files else synthetic_docs(args.k)
+        llm = None
+        if args.ttft:
+            from langchain_openai import ChatOpenAI
+            llm = ChatOpenAI(model_name=args.model, temperature=0, streaming=True, 
+                             openai_api_key=os.environ["OPENAI_API_KEY"]) # type: ignore
+        if not load_tokenizer():
+            print("Token counts are estimated")
+        print(f"{len(docs)} chunks, question: {args.question}")
+        print(format_prompt_report(prompt_report(docs, args.question, llm=llm, runs=args.runs)))
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,9 @@
 from collections.abc import Callable    
 from langchain.callbacks.streaming_stdout import StreamingStdOutCallbackHandler
 from langchain.schema import LLMResult
+from langchain.callbacks.base import BaseCallbackHandler
+
+from alphageist.util import QueryContext
 
 class CustomStreamHandler(StreamingStdOutCallbackHandler):
     
@@ -17,3 +20,32 @@ class CustomStreamHandler(StreamingStdOutCallbackHandler):
         """Run when LLM ends running."""
         self._on_llm_end(response, **kwargs)
 
+
+class CancelQueryHandler(BaseCallbackHandler):
+    """Stops the query of ctx once it is cancelled by raising QueryCancelled
+    from the callbacks. Has to come first among the callbacks so that the
+    others receive nothing from a cancelled query."""
+    raise_error = True # Otherwise LangChain logs the exception and goes on
+    run_inline = True # Async callback managers run it before the others instead of concurrently
+
+    def __init__(self, ctx: QueryContext):
+        super().__init__()
+        self.ctx = ctx
+
+    def on_chain_start(self, *args, **kwargs) -> None:
+        self.ctx.raise_if_cancelled()
+
+    def on_retriever_start(self, *args, **kwargs) -> None:
+        self.ctx.raise_if_cancelled()
+
+    def on_retriever_end(self, *args, **kwargs) -> None:
+        self.ctx.raise_if_cancelled()
+
+    def on_llm_start(self, *args, **kwargs) -> None:
+        self.ctx.raise_if_cancelled()
+
+    def on_llm_new_token(self, token: str, **kwargs) -> None:
+        self.ctx.raise_if_cancelled()
+
+    def on_llm_end(self, response: LLMResult, **kwargs) -> None:
+        self.ctx.raise_if_cancelled()
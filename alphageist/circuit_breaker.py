@@ -0,0 +1,122 @@
+import time
+import logging
+import threading
+from typing import (
+    Callable,
+    Optional,
+)
+
+from alphageist import constant
+
+logger = logging.getLogger(constant.LOGGER_NAME)
+
+# Circuit states
+CLOSED = "closed" # Calls go through
+OPEN = "open" # Calls are refused until open_s has passed
+HALF_OPEN = "half_open" # The health probe, or a single trial call, decides whether to close again
+
+DEFAULT_FAILURE_THRESHOLD = 3
+DEFAULT_OPEN_S = 30.0
+
+class CircuitBreaker:
+    """Stops calling a service that keeps failing or answering slower than
+    latency_budget_s, so that callers do not wait on it.
+
+    After failure_threshold failures in a row the circuit opens and allow()
+    returns False. Once open_s has passed the circuit is half open: the probe,
+    if given, is run in the background and closes the circuit if it succeeds,
+    without a caller waiting on it. Without a probe the next call is let
+    through as a trial. A failed probe or trial opens the circuit again."""
+    name: str
+    latency_budget_s: Optional[float]
+    failure_threshold: int
+    open_s: float
+    probe: Optional[Callable[[], object]]
+    failures: int
+    _state: str
+    _opened_at: float
+    _probing: bool
+
+    def __init__(self,
+                 name: str,
+                 latency_budget_s: Optional[float] = None,
+                 failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+                 open_s: float = DEFAULT_OPEN_S,
+                 probe: Optional[Callable[[], object]] = None):
+        self.name = name
+        self.latency_budget_s = latency_budget_s
+        self.failure_threshold = failure_threshold
+        self.open_s = open_s
+        self.probe = probe
+        self.failures = 0
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state
+
+    def allow(self) -> bool:
+        """True if the service should be called now"""
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN:
+                if time.monotonic() - self._opened_at < self.open_s:
+                    return False
+                logger.info(f"Circuit of {self.name} half open")
+                self._state = HALF_OPEN
+                if self.probe is None:
+                    return True # The trial call
+                self._start_probe()
+            return False
+
+    def _start_probe(self) -> None:
+        if self._probing:
+            return
+        self._probing = True
+        threading.Thread(target=self._run_probe, daemon=True).start()
+
+    def _run_probe(self) -> None:
+        start = time.monotonic()
+        try:
+            self.probe() # type: ignore
+        except Exception as e:
+            logger.info(f"Health probe of {self.name} failed: {e!r}")
+            self.record_failure()
+        else:
+            self.record_success(time.monotonic() - start)
+        finally:
+            with self._lock:
+                self._probing = False
+
+    def record_success(self, latency_s: float) -> None:
+        """Records a completed call, which counts as a failure if it took longer than the latency budget"""
+        if self.latency_budget_s is not None and latency_s > self.latency_budget_s:
+            self.record_failure()
+            return
+        with self._lock:
+            if self._state != CLOSED:
+                logger.info(f"Circuit of {self.name} closed")
+            self._state = CLOSED
+            self.failures = 0
+
+    def record_cancelled(self) -> None:
+        """Records a call abandoned by the caller, which says nothing about 
+        the service. If it was the trial call the next call is let through 
+        as the trial instead."""
+        with self._lock:
+            if self._state == HALF_OPEN and self.probe is None:
+                self._state = OPEN # open_s has passed, so allow() goes straight back to half open
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self._state == HALF_OPEN or (self._state == CLOSED and self.failures >= self.failure_threshold):
+                logger.warning(f"Circuit of {self.name} opened after {self.failures} failures, "
+                               f"skipping it for {self.open_s}s")
+                self._state = OPEN
+                self._opened_at = time.monotonic()
@@ -12,6 +12,7 @@ from alphageist import (
     errors,
     constant,
     util,
+    prompt,
 )
 
 logger = logging.getLogger(constant.LOGGER_NAME)
@@ -23,6 +24,27 @@ API_KEY_OPEN_AI = "API_KEY_OPEN_AI"
 VECTORDB_DIR = "VECTOR_DB_PATH" # The directory in which the DB is stored
 SEARCH_DIRS = "SEARCH_DIRS"
 LOG_LEVEL = "LOG_LEVEL"
+LOADING_WORKERS = "LOADING_WORKERS" # Number of processes used to parse files, 0 = one per CPU
+INDEXING_BATCH_SIZE = "INDEXING_BATCH_SIZE" # Max number of chunks embedded and upserted at a time
+EMBEDDING_BATCH_TOKENS = "EMBEDDING_BATCH_TOKENS" # Max (estimated) tokens sent in one embedding request
+EMBEDDING_CONCURRENCY = "EMBEDDING_CONCURRENCY" # Max number of embedding requests in flight, lowered when rate limited
+EMBEDDING_CACHE_SIZE_MB = "EMBEDDING_CACHE_SIZE_MB" # Max size of the on disk embedding cache, 0 = disabled
+ANSWER_CACHE_SIZE = "ANSWER_CACHE_SIZE" # Max number of cached answers, 0 = disabled
+ANSWER_CACHE_MAX_AGE_H = "ANSWER_CACHE_MAX_AGE_H" # Older cached answers are not used, 0 = no limit
+ANSWER_CACHE_SIMILARITY = "ANSWER_CACHE_SIMILARITY" # Min cosine similarity for a query to reuse the answer to another, 1 = same query only. Lower values risk answering a different question, e.g. about another year, as such queries embed almost identically
+EXCLUDE_PATTERNS = "EXCLUDE_PATTERNS" # gitignore style globs for files and dirs that are not indexed
+INCLUDE_PATTERNS = "INCLUDE_PATTERNS" # If not empty, only files matching one of these globs are indexed
+MAX_FILE_SIZE_MB = "MAX_FILE_SIZE_MB" # Larger files are not indexed, 0 = no limit
+MAX_DEPTH = "MAX_DEPTH" # Directory levels below the search dir that are walked, 0 = no limit
+SEARCH_WHILE_INDEXING = "SEARCH_WHILE_INDEXING" # Allow queries against a partially created vectorstore
+RETRIEVAL_TIMEOUT_S = "RETRIEVAL_TIMEOUT_S" # Stores slower than this are left out of the answer, 0 = no timeout
+REMOTE_STORE_ENABLED = "REMOTE_STORE_ENABLED" # Also search the shared remote collection
+REMOTE_STORE_LATENCY_BUDGET_S = "REMOTE_STORE_LATENCY_BUDGET_S" # Slower remote searches count as failures of its circuit breaker, 0 = no budget
+CONTEXT_TOKENS = "CONTEXT_TOKENS" # Max tokens of retrieved text in the prompt, filled best first, 0 = 4 chunks whatever their size
+PROMPT_TEMPLATE = "PROMPT_TEMPLATE" # "lean", "langchain" (with few-shot examples) or a template using {summaries} and {question}
+RETRIEVAL_MODE = "RETRIEVAL_MODE" # "hybrid" fuses vector and keyword search, "dense" or "keyword" uses only one
+LOCAL_INDEX_BACKEND = "LOCAL_INDEX_BACKEND" # How the local collection is stored, "numpy" or "qdrant"
+VECTOR_QUANTIZATION = "VECTOR_QUANTIZATION" # Compact vectors scanned by the numpy backend, see alphageist.benchmark
 
 REQUIRED_KEYS = {API_KEY_OPEN_AI, SEARCH_DIRS, VECTORDB_DIR}
 class Config(dict[str, Any]):
@@ -54,6 +76,44 @@ class Config(dict[str, Any]):
                 allowed_values = ",".join({"DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"})
                 if not self[key] in allowed_values:
                     raise errors.ConfigValueError(key, self[key], allowed_values)
+            elif key == LOCAL_INDEX_BACKEND:
+                allowed_values = "numpy,qdrant"
+                if not self[key] in allowed_values.split(","):
+                    raise errors.ConfigValueError(key, self[key], allowed_values)
+            elif key == RETRIEVAL_MODE:
+                allowed_values = "hybrid,dense,keyword"
+                if not self[key] in allowed_values.split(","):
+                    raise errors.ConfigValueError(key, self[key], allowed_values)
+            elif key == PROMPT_TEMPLATE:
+                try:
+                    is_valid = isinstance(self[key], str) and prompt.get_prompt(self[key]) is not None
+                except ValueError:
+                    is_valid = False
+                if not is_valid:
+                    allowed_values = ",".join(prompt.PROMPT_TEMPLATES)
+                    raise errors.ConfigValueError(key, self[key], allowed_values + " or a template using only {summaries} and {question}")
+            elif key == VECTOR_QUANTIZATION:
+                allowed_values = "none,float16,int8,binary"
+                if not self[key] in allowed_values.split(","):
+                    raise errors.ConfigValueError(key, self[key], allowed_values)
+            elif key == LOADING_WORKERS:
+                if not isinstance(self[key], int) or self[key] < 0:
+                    raise errors.ConfigValueError(key, self[key], "integers >= 0")
+            elif key in (INDEXING_BATCH_SIZE, EMBEDDING_BATCH_TOKENS, EMBEDDING_CONCURRENCY):
+                if not isinstance(self[key], int) or self[key] < 1:
+                    raise errors.ConfigValueError(key, self[key], "integers >= 1")
+            elif key in (EMBEDDING_CACHE_SIZE_MB, MAX_DEPTH, ANSWER_CACHE_SIZE, CONTEXT_TOKENS):
+                if not isinstance(self[key], int) or self[key] < 0:
+                    raise errors.ConfigValueError(key, self[key], "integers >= 0")
+            elif key in (MAX_FILE_SIZE_MB, RETRIEVAL_TIMEOUT_S, ANSWER_CACHE_MAX_AGE_H, REMOTE_STORE_LATENCY_BUDGET_S):
+                if not isinstance(self[key], (int, float)) or self[key] < 0:
+                    raise errors.ConfigValueError(key, self[key], "numbers >= 0")
+            elif key == ANSWER_CACHE_SIMILARITY:
+                if not isinstance(self[key], (int, float)) or not 0 < self[key] <= 1:
+                    raise errors.ConfigValueError(key, self[key], "numbers > 0 and <= 1")
+            elif key in (EXCLUDE_PATTERNS, INCLUDE_PATTERNS):
+                if not isinstance(self[key], list) or not all(isinstance(p, str) for p in self[key]):
+                    raise errors.ConfigValueError(key, self[key], "lists of glob patterns")
 
     def check(self) -> None:
         self._assert_has_required_keys()
@@ -71,7 +131,28 @@ def get_default_config(ensure_exists: bool = True) -> Config:
         API_KEY_OPEN_AI: "",
         VECTORDB_DIR: str(constant.VECTOR_DB_DIR),
         SEARCH_DIRS: "",
-        LOG_LEVEL: "INFO"
+        LOG_LEVEL: "INFO",
+        LOADING_WORKERS: 0,
+        INDEXING_BATCH_SIZE: 256,
+        EMBEDDING_BATCH_TOKENS: 50000,
+        EMBEDDING_CONCURRENCY: 4,
+        EMBEDDING_CACHE_SIZE_MB: 1024,
+        ANSWER_CACHE_SIZE: 1000,
+        ANSWER_CACHE_MAX_AGE_H: 168,
+        ANSWER_CACHE_SIMILARITY: 1.0,
+        EXCLUDE_PATTERNS: [".git/", ".svn/", "node_modules/", "__pycache__/", ".venv/", "venv/"],
+        INCLUDE_PATTERNS: [],
+        MAX_FILE_SIZE_MB: 0,
+        MAX_DEPTH: 0,
+        SEARCH_WHILE_INDEXING: True,
+        RETRIEVAL_TIMEOUT_S: 5.0,
+        RETRIEVAL_MODE: "hybrid",
+        CONTEXT_TOKENS: 1000,
+        PROMPT_TEMPLATE: "lean",
+        REMOTE_STORE_ENABLED: True,
+        REMOTE_STORE_LATENCY_BUDGET_S: 2.0,
+        LOCAL_INDEX_BACKEND: "numpy",
+        VECTOR_QUANTIZATION: "none",
     })
     return DEFAULT_CONFIG
 
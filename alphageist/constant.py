@@ -21,6 +21,8 @@ APP_DATA_DIR = pathlib.Path(user_data_dir(APP_NAME, AUTHOR, ensure_exists=True))
 CONFIG_PATH = APP_DATA_DIR / "config.json"
 LOG_PATH = APP_DATA_DIR / "logfile.log"
 VECTOR_DB_DIR = APP_DATA_DIR / "vectorDatabase"
+EMBEDDING_CACHE_PATH = APP_DATA_DIR / "embedding_cache.sqlite"
+ANSWER_CACHE_PATH = APP_DATA_DIR / "answer_cache.sqlite"
 
 UPDATE_CACHE_DIR = APP_DATA_DIR / 'update_cache' 
 METADATA_DIR = UPDATE_CACHE_DIR / 'metadata'
@@ -0,0 +1,93 @@
+import re
+from typing import (
+    Callable,
+    Optional,
+)
+
+from langchain.docstore.document import Document
+
+from alphageist import util
+
+NEAR_DUPLICATE_SIMILARITY = 0.9 # Chunks sharing this fraction of their words with a packed chunk are dropped
+MERGE_MAX_GAP_CHARS = 50 # Chunks of the same file at most this far apart are merged into one
+DOC_OVERHEAD_TOKENS = 6 # "Content: " and "Source: " around each chunk in the prompt, besides the source itself
+
+_SPACES = re.compile(r"[ \t\u00a0]+")
+_BLANK_LINES = re.compile(r"\n{3,}")
+_WORD = re.compile(r"\w+")
+
+def clean_text(text: str) -> str:
+    """Collapses runs of spaces and blank lines, as left by e.g. PDF
+    extraction, keeping the indentation of each line"""
+    lines = []
+    for line in text.splitlines():
+        content = line.lstrip(" \t")
+        lines.append(line[:len(line) - len(content)] + _SPACES.sub(" ", content).rstrip())
+    return _BLANK_LINES.sub("\n\n", "\n".join(lines)).strip("\n")
+
+def _similarity(a: frozenset[str], b: frozenset[str]) -> float:
+    if not a or not b:
+        return float(a == b)
+    return len(a & b) / len(a | b)
+
+class _Chunk:
+    doc: Document
+    rank: int
+    text: str
+    words: frozenset[str]
+    start: Optional[int] # Position in the source file, if known
+    end: Optional[int]
+
+    def __init__(self, doc: Document, rank: int, text: str):
+        self.doc = doc
+        self.rank = rank
+        self.text = text
+        self.words = frozenset(_WORD.findall(text.lower()))
+        self.start = doc.metadata.get("start_index")
+        # start_index is counted in the text as split, before doc_generator.escape_unicode
+        self.end = None if self.start is None else self.start + len(util.raw_string_to_string(doc.page_content))
+
+    @property
+    def location(self) -> tuple:
+        return (self.doc.metadata.get("source"), self.doc.metadata.get("page"))
+
+    def precedes(self, other: "_Chunk") -> bool:
+        """True if other continues this chunk in the same file"""
+        if self.end is None or other.start is None or self.location != other.location:
+            return False
+        return 0 <= other.start - self.end <= MERGE_MAX_GAP_CHARS
+
+def pack_context(docs: list[Document],
+                 max_tokens: int,
+                 count_tokens: Callable[[str], int] = util.count_tokens) -> list[Document]:
+    """Packs the chunks of docs, best first, into at most max_tokens prompt tokens.
+
+    Whitespace noise is removed, near-duplicates of packed chunks are dropped
+    and a chunk that does not fit is skipped in favour of smaller ones that do.
+    Chunks continuing each other in the same file are merged, which saves the
+    overhead of one chunk in the prompt."""
+    packed: list[_Chunk] = []
+    n_tokens = 0
+    for rank, doc in enumerate(docs):
+        chunk = _Chunk(doc, rank, clean_text(doc.page_content))
+        if not chunk.text or any(_similarity(chunk.words, c.words) >= NEAR_DUPLICATE_SIMILARITY for c in packed):
+            continue
+        cost = count_tokens(chunk.text)
+        if not any(c.precedes(chunk) or chunk.precedes(c) for c in packed):
+            cost += count_tokens(str(doc.metadata.get("source", ""))) + DOC_OVERHEAD_TOKENS
+        if n_tokens + cost > max_tokens:
+            continue
+        packed.append(chunk)
+        n_tokens += cost
+    return _merge_adjacent(packed)
+
+def _merge_adjacent(chunks: list[_Chunk]) -> list[Document]:
+    """Merges runs of chunks continuing each other, keeping the order of the best chunk of each run"""
+    runs: list[list[_Chunk]] = []
+    for chunk in sorted(chunks, key=lambda c: (str(c.location), c.start if c.start is not None else -1, c.rank)):
+        if runs and runs[-1][-1].precedes(chunk):
+            runs[-1].append(chunk)
+        else:
+            runs.append([chunk])
+    runs.sort(key=lambda run: min(c.rank for c in run))
+    return [Document(page_content="\n".join(c.text for c in run), metadata=run[0].doc.metadata) for run in runs]
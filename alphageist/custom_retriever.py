@@ -1,13 +1,59 @@
+import time
+import asyncio
+import logging
+from typing import (
+    Optional,
+    Union,
+)
+from concurrent.futures import ThreadPoolExecutor, wait
+
 from langchain.docstore.document import Document
+from langchain.embeddings.base import Embeddings
 from langchain.vectorstores.base import VectorStoreRetriever, VectorStore 
 from langchain.schema.retriever import BaseRetriever
-from langchain.callbacks.manager import CallbackManagerForRetrieverRun
+from langchain.callbacks.manager import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+)
 
 from langchain.pydantic_v1 import Field, root_validator
+from langchain_core.runnables.config import run_in_executor
+
+from alphageist.keyword_index import KeywordIndex
+from alphageist.circuit_breaker import CircuitBreaker
+from alphageist.context_packing import pack_context
+from alphageist.util import LRUCache
+from alphageist import constant
+from alphageist import errors
+
+logger = logging.getLogger(constant.LOGGER_NAME)
+
+QUERY_VECTOR_CACHE_SIZE = 128
+RRF_K = 60 # Damps the weight of the top ranks in reciprocal rank fusion
+
+# Retrieval modes
+DENSE = "dense" # Vector search only
+HYBRID = "hybrid" # Vector and keyword search, fused by rank
+KEYWORD = "keyword" # Keyword search only, without network calls
+
+_ScoredDocs = list[tuple[Document, float]]
+
+def reciprocal_rank_fusion(rankings: list[list[Document]], k: int) -> list[Document]:
+    """Merges rankings whose scores are not comparable by summing 1/(RRF_K + rank)
+    of each document over the rankings it appears in"""
+    scores: dict[tuple, float] = {}
+    docs: dict[tuple, Document] = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking):
+            key = (doc.page_content, doc.metadata.get("source"))
+            docs.setdefault(key, doc)
+            scores[key] = scores.get(key, 0.0) + 1 / (RRF_K + rank + 1)
+    return [docs[key] for key in sorted(scores, key=scores.__getitem__, reverse=True)][:k]
 
 class MultiStoreRetreiver(BaseRetriever):
     """Merges the result from multiple vector stores and re-ranks 
-    them by relevance score"""
+    them by relevance score. With a keyword index the result is fused
+    with a keyword search, see retrieval_mode."""
 
     vectorstores: list[VectorStore]
     """The vectorstores that will be queried"""
@@ -15,19 +61,201 @@ class MultiStoreRetreiver(BaseRetriever):
     """Number of results to return. The vectorstores that are queried should return minimum this amount"""
     search_kwargs: dict = Field(default_factory=dict)
     """Keyword arguments to pass to the search functions."""
-    def _get_relevant_documents(
-            self, query: str, *, run_manager: CallbackManagerForRetrieverRun
-        ) -> list[Document]:
-        # Merge results from all stores
+    embeddings: Optional[Embeddings] = None
+    """If set, the query is embedded once with these embeddings and all vectorstores
+    are searched by vector. They must have been created with the same embedding model."""
+    query_vector_cache: LRUCache = Field(default_factory=lambda: LRUCache(QUERY_VECTOR_CACHE_SIZE))
+    """Query vectors by query string. Can be shared between retrievers."""
+    store_timeout: Optional[float] = None
+    """Seconds to wait for each vectorstore. The vectorstores are queried concurrently and
+    the ones that are slower or fail are left out of the result."""
+    keyword_index: Optional[KeywordIndex] = None
+    """Searched by keyword in the hybrid and keyword retrieval modes"""
+    retrieval_mode: str = HYBRID
+    """DENSE, HYBRID or KEYWORD. Without a keyword index only the vectorstores are searched."""
+    circuit_breakers: list[Optional[CircuitBreaker]] = Field(default_factory=list)
+    """Per vectorstore, in the same order. A store whose circuit is open is not searched,
+    and it is waited for at most the latency budget of its circuit breaker."""
+    max_context_tokens: Optional[int] = None
+    """If set, the k best documents are packed into at most this many tokens, 
+    see context_packing.pack_context. k is then the number of candidates."""
+
+    def get_query_vector(self, query: str) -> list[float]:
+        vector = self.query_vector_cache.get(query)
+        if vector is None:
+            vector = self.embeddings.embed_query(query) # type: ignore
+            self.query_vector_cache.put(query, vector)
+        return vector
+
+    async def aget_query_vector(self, query: str) -> list[float]:
+        vector = self.query_vector_cache.get(query)
+        if vector is None:
+            vector = await self.embeddings.aembed_query(query) # type: ignore
+            self.query_vector_cache.put(query, vector)
+        return vector
+
+    def _search(self, vs: VectorStore, query: str, query_vector: Optional[list[float]]) -> _ScoredDocs:
+        # Qdrant scores are already relevance scores, higher is more similar
+        if query_vector is not None and hasattr(vs, "similarity_search_with_score_by_vector"):
+            return vs.similarity_search_with_score_by_vector(query_vector, k=self.k, **self.search_kwargs) # type: ignore
+        return vs.similarity_search_with_relevance_scores(query, k=self.k, **self.search_kwargs)
+
+    def _timed_search(self, vs: VectorStore, query: str, query_vector: Optional[list[float]]) -> tuple[_ScoredDocs, float]:
+        start = time.monotonic()
+        res = self._search(vs, query, query_vector)
+        return res, time.monotonic() - start
+
+    async def _asearch(self, i: int, query: str, query_vector: Optional[list[float]]) -> _ScoredDocs:
+        vs = self.vectorstores[i]
+        breaker = self._get_circuit_breaker(i)
+        if breaker is not None and not breaker.allow():
+            raise errors.CircuitOpenError(breaker.name)
+        if query_vector is not None and hasattr(vs, "asimilarity_search_with_score_by_vector"):
+            coro = vs.asimilarity_search_with_score_by_vector(query_vector, k=self.k, **self.search_kwargs) # type: ignore
+        else:
+            coro = vs.asimilarity_search_with_relevance_scores(query, k=self.k, **self.search_kwargs)
+        start = time.monotonic()
+        try:
+            res = await asyncio.wait_for(coro, self._get_store_timeout(i))
+        except asyncio.CancelledError:
+            # E.g. the query was cancelled, which is not the store's fault
+            if breaker is not None:
+                breaker.record_cancelled()
+            raise
+        except Exception:
+            if breaker is not None:
+                breaker.record_failure()
+            raise
+        if breaker is not None:
+            breaker.record_success(time.monotonic() - start)
+        return res
+
+    def _get_circuit_breaker(self, i: int) -> Optional[CircuitBreaker]:
+        return self.circuit_breakers[i] if i < len(self.circuit_breakers) else None
+
+    def _get_store_timeout(self, i: int) -> Optional[float]:
+        breaker = self._get_circuit_breaker(i)
+        timeouts = [t for t in (self.store_timeout, breaker and breaker.latency_budget_s) if t is not None]
+        return min(timeouts) if timeouts else None
+
+    def _uses_keywords(self) -> bool:
+        return self.keyword_index is not None and self.retrieval_mode in (HYBRID, KEYWORD)
+
+    def _search_keywords(self, query: str) -> list[Document]:
+        return [doc for doc, _ in self.keyword_index.search(query, self.k)] # type: ignore
+
+    def _fuse(self, dense: Union[list[Document], BaseException], keyword: list[Document]) -> list[Document]:
+        if isinstance(dense, BaseException):
+            if not keyword:
+                raise dense
+            # E.g. offline, the keyword result is better than no answer
+            logger.warning(f"Vector search failed, using the keyword search only: {dense!r}")
+            return keyword
+        if not keyword:
+            return dense
+        return reciprocal_rank_fusion([dense, keyword], self.k)
+
+    def _merge(self, results: list[Union[_ScoredDocs, BaseException]]) -> list[Document]:
+        """Merges the results of all stores, leaving out those that failed. 
+        Raises if every store failed."""
         scored_docs = [] # [(<Document>, <score_float>)]
-        for vs in self.vectorstores:
-            scored_docs.extend(vs.similarity_search_with_relevance_scores(query, k=self.k, **self.search_kwargs))
-        
+        failures = []
+        for vs, res in zip(self.vectorstores, results):
+            if isinstance(res, errors.CircuitOpenError):
+                logger.debug(f"Leaving {vs.__class__.__name__} out of the result: {res!r}")
+                failures.append(res)
+            elif isinstance(res, BaseException):
+                logger.warning(f"Leaving {vs.__class__.__name__} out of the result: {res!r}")
+                failures.append(res)
+            else:
+                scored_docs.extend(res)
+        if failures and len(failures) == len(self.vectorstores):
+            raise failures[0]
+
         # Sort the result
         scored_docs.sort(key=lambda x: x[1], reverse=True)
-        docs = [doc for doc, _ in scored_docs][:self.k]
+        return [doc for doc, _ in scored_docs][:self.k]
+
+    def _pack(self, docs: list[Document]) -> list[Document]:
+        if self.max_context_tokens is None:
+            return docs
+        return pack_context(docs, self.max_context_tokens)
+
+    def _get_relevant_documents(
+            self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+        ) -> list[Document]:
+        return self._pack(self._retrieve(query))
+
+    async def _aget_relevant_documents(
+            self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+        ) -> list[Document]:
+        # Counting tokens is CPU bound, it would hold up other queries on the event loop
+        return await run_in_executor(None, self._pack, await self._aretrieve(query))
+
+    def _retrieve(self, query: str) -> list[Document]:
+        if not self._uses_keywords():
+            return self._search_vectorstores(query)
+        if self.retrieval_mode == KEYWORD:
+            return self._search_keywords(query)
+        dense: Union[list[Document], BaseException]
+        try:
+            dense = self._search_vectorstores(query)
+        except Exception as e:
+            dense = e
+        return self._fuse(dense, self._search_keywords(query))
+
+    async def _aretrieve(self, query: str) -> list[Document]:
+        if not self._uses_keywords():
+            return await self._asearch_vectorstores(query)
+        if self.retrieval_mode == KEYWORD:
+            return await run_in_executor(None, self._search_keywords, query)
+        # The keyword index is searched while waiting for the query vector and the vectorstores
+        dense, keyword = await asyncio.gather(
+            self._asearch_vectorstores(query),
+            run_in_executor(None, self._search_keywords, query),
+            return_exceptions=True)
+        if isinstance(keyword, BaseException):
+            raise keyword
+        return self._fuse(dense, keyword)
+
+    def _search_vectorstores(self, query: str) -> list[Document]:
+        query_vector = self.get_query_vector(query) if self.embeddings is not None else None
+
+        results: list[Union[_ScoredDocs, BaseException, None]] = [None] * len(self.vectorstores)
+        breakers = [self._get_circuit_breaker(i) for i in range(len(self.vectorstores))]
+        executor = ThreadPoolExecutor(max_workers=len(self.vectorstores))
+        start = time.monotonic()
+        try:
+            futures = {}
+            for i, vs in enumerate(self.vectorstores):
+                if breakers[i] is not None and not breakers[i].allow(): # type: ignore
+                    results[i] = errors.CircuitOpenError(breakers[i].name) # type: ignore
+                else:
+                    futures[i] = executor.submit(self._timed_search, vs, query, query_vector)
+            for i, future in futures.items():
+                timeout = self._get_store_timeout(i)
+                wait([future], timeout=None if timeout is None else max(timeout - (time.monotonic() - start), 0))
+        finally:
+            # Don't wait for slow stores, their results are simply not used
+            executor.shutdown(wait=False, cancel_futures=True)
 
-        return docs
+        for i, future in futures.items():
+            if not future.done():
+                results[i] = TimeoutError(f"No response within {self._get_store_timeout(i)}s")
+            elif future.exception() is not None:
+                results[i] = future.exception()
+            else:
+                results[i], latency = future.result()
+                if breakers[i] is not None:
+                    breakers[i].record_success(latency) # type: ignore
+                continue
+            if breakers[i] is not None:
+                breakers[i].record_failure() # type: ignore
+        return self._merge(results) # type: ignore
 
-    def _aget_relevant_documents(*args, **kwargs):
-        raise NotImplementedError
+    async def _asearch_vectorstores(self, query: str) -> list[Document]:
+        query_vector = await self.aget_query_vector(query) if self.embeddings is not None else None
+        results = await asyncio.gather(
+            *(self._asearch(i, query, query_vector) for i in range(len(self.vectorstores))),
+            return_exceptions=True)
+        return self._merge(results)
@@ -2,9 +2,18 @@ import os
 import logging
 from typing import (
     Any,
+    Callable,
     Optional
 )
-from collections.abc import Iterator
+from collections import deque
+from collections.abc import Iterator, Iterable
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
 
 from pathlib import Path
 
@@ -24,18 +33,103 @@ from alphageist.custom_loaders import PPTXLoader
 from alphageist.util import (
     is_temp_file,
     string_to_raw_string,
+    wait_result,
+    CANCEL_POLL_S,
     LoadingContext
 )
 from alphageist import constant
 from alphageist.errors import LoadingCancelled
+from alphageist.manifest import hash_file
+from alphageist.scan_rules import ScanRules
 
 logger = logging.getLogger(constant.LOGGER_NAME)
 
-def _get_file_paths(path:Path)->Iterator[str]:
-    for root, dirs, files in os.walk(path):
-        for file in files:
-            file_path = os.path.join(root, file)
-            yield file_path
+SCAN_WORKERS = 8 # Directories listed concurrently, mostly waiting on network round-trips
+
+def _scan_dir(dir_path:str, rel_dir:str, depth:int, rules:Optional[ScanRules])->tuple[list[str], list[tuple[str, str]]]:
+    """Lists a single directory and returns its files and the (path, relative path) 
+    of its subdirectories. The entry types come with the listing so no extra stat 
+    call is needed unless rules limit the file size. Entries excluded by rules
+    are dropped here so that excluded directories are never listed."""
+    files, subdirs = [], []
+    try:
+        with os.scandir(dir_path) as it:
+            for entry in it:
+                rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if rules is None or rules.walk_dir(rel_path, depth + 1):
+                            subdirs.append((entry.path, rel_path))
+                    elif entry.is_file():
+                        if rules is not None:
+                            size = entry.stat().st_size if rules.max_file_size is not None else None
+                            if not rules.include_file(rel_path, size):
+                                continue
+                        files.append(entry.path)
+                except OSError:
+                    continue
+    except OSError as e:
+        logger.warning(f"Unable to scan {dir_path}: {e}")
+    files.sort()
+    subdirs.sort()
+    return files, subdirs
+
+def scan_files(path:Path, 
+               ctx:Optional[LoadingContext]=None, 
+               file_filter:Optional[Callable[[str], bool]]=None, 
+               workers:int=SCAN_WORKERS,
+               rules:Optional[ScanRules]=None)->Iterator[str]:
+    """Walks the tree under path once and yields file paths as they are found.
+
+    Up to workers directories are listed concurrently, but files are yielded in 
+    the same order as a sorted top-down os.walk: the files of a directory, then 
+    those of each subdirectory in name order. If ctx is given, its total_files
+    is None while scanning, files_found is updated as files are found and 
+    total_files is set once the whole tree has been scanned. Only files 
+    accepted by file_filter and rules are yielded and counted."""
+    if ctx is not None:
+        ctx.total_files = None
+        ctx.files_found = 0
+    n_found = 0
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        root = executor.submit(_scan_dir, str(path), "", 0, rules)
+        pending = {root}
+        depth_by_future = {root: 0}
+        # Listed directories not yet yielded, with the futures of their subdirectories
+        listed: dict[Future, tuple[list[str], list[Future]]] = {}
+        to_yield = [root] # Stack of directories in the order they are yielded
+        while to_yield:
+            # Subdirectories are listed as soon as their parent is, not when it is yielded
+            while to_yield[-1] not in listed:
+                done, pending = wait(pending, timeout=CANCEL_POLL_S, return_when=FIRST_COMPLETED)
+                if ctx is not None and ctx.is_cancelled():
+                    raise LoadingCancelled
+                for future in done:
+                    depth = depth_by_future.pop(future)
+                    files, subdirs = future.result()
+                    children = []
+                    for subdir, rel_subdir in subdirs:
+                        f = executor.submit(_scan_dir, subdir, rel_subdir, depth + 1, rules)
+                        depth_by_future[f] = depth + 1
+                        pending.add(f)
+                        children.append(f)
+                    listed[future] = (files, children)
+            files, children = listed.pop(to_yield.pop())
+            to_yield.extend(reversed(children))
+            for file_path in files:
+                if file_filter is not None and not file_filter(file_path):
+                    continue
+                if ctx is not None:
+                    if ctx.is_cancelled():
+                        raise LoadingCancelled
+                    ctx.files_found += 1
+                n_found += 1
+                yield file_path
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    if ctx is not None:
+        ctx.total_files = n_found
 
 def _get_file_extension(file_name: str) -> str:
     file_root, file_extension = os.path.splitext(file_name)
@@ -53,23 +147,30 @@ _loader_by_filetype:dict[str,Any] = {
     ".xls": UnstructuredExcelLoader,
 }
 _docu_splitter_by_filetype = {
-    ".txt": lambda: RecursiveCharacterTextSplitter(chunk_size = 1000, chunk_overlap =0),
-    ".pdf": lambda: RecursiveCharacterTextSplitter(chunk_size = 1000, chunk_overlap =0),
-    ".csv": lambda: RecursiveCharacterTextSplitter(chunk_size = 1000, chunk_overlap =0),
-    ".py": lambda: PythonCodeTextSplitter(chunk_size = 1000, chunk_overlap =0),
-    ".go": lambda: RecursiveCharacterTextSplitter(chunk_size = 1000, chunk_overlap =0),
-    ".pptx": lambda: RecursiveCharacterTextSplitter(chunk_size = 1000, chunk_overlap =0),
-    ".docx": lambda: RecursiveCharacterTextSplitter(chunk_size = 1000, chunk_overlap =0),
-    ".xlsx": lambda: RecursiveCharacterTextSplitter(chunk_size = 1000, chunk_overlap =0),
-    ".xls": lambda: RecursiveCharacterTextSplitter(chunk_size = 1000, chunk_overlap =0),
+    ".txt": lambda: RecursiveCharacterTextSplitter(chunk_size = 1000, chunk_overlap =0, add_start_index=True),
+    ".pdf": lambda: RecursiveCharacterTextSplitter(chunk_size = 1000, chunk_overlap =0, add_start_index=True),
+    ".csv": lambda: RecursiveCharacterTextSplitter(chunk_size = 1000, chunk_overlap =0, add_start_index=True),
+    ".py": lambda: PythonCodeTextSplitter(chunk_size = 1000, chunk_overlap =0, add_start_index=True),
+    ".go": lambda: RecursiveCharacterTextSplitter(chunk_size = 1000, chunk_overlap =0, add_start_index=True),
+    ".pptx": lambda: RecursiveCharacterTextSplitter(chunk_size = 1000, chunk_overlap =0, add_start_index=True),
+    ".docx": lambda: RecursiveCharacterTextSplitter(chunk_size = 1000, chunk_overlap =0, add_start_index=True),
+    ".xlsx": lambda: RecursiveCharacterTextSplitter(chunk_size = 1000, chunk_overlap =0, add_start_index=True),
+    ".xls": lambda: RecursiveCharacterTextSplitter(chunk_size = 1000, chunk_overlap =0, add_start_index=True),
 }
 
+def is_supported_file(file_path:str)->bool:
+    """Temporary files and files without a loader are not supported"""
+    return not is_temp_file(file_path) and _get_file_extension(file_path) in _loader_by_filetype
+
+def get_supported_file_paths(path:Path, 
+                             ctx:Optional[LoadingContext]=None, 
+                             rules:Optional[ScanRules]=None)->Iterator[str]:
+    return scan_files(path, ctx, file_filter=is_supported_file, rules=rules)
+
 def get_docs_from_file(file_path:str)->list[Document]:
     file_ext = _get_file_extension(file_path)
-    if is_temp_file(file_path):
-        return [] # Skip temporary files
-    if not file_ext in _loader_by_filetype:
-        return [] # Unsupported file
+    if not is_supported_file(file_path):
+        return [] # Skip temporary and unsupported files
     logger.info(f"Loading {file_path}")
     try:
         docs = _loader_by_filetype[file_ext](file_path).load()
@@ -79,22 +180,69 @@ def get_docs_from_file(file_path:str)->list[Document]:
     subdocs = _docu_splitter_by_filetype[file_ext]().split_documents(docs)
     return subdocs
 
-def get_docs_from_path(path, ctx:Optional[LoadingContext])->list[Document]:
-    docs = []
-    if ctx is not None:
-        ctx.total_files = sum(1 for _ in _get_file_paths(path))
-    files_loaded = -1
+def _load_file(file_path:str)->tuple[list[Document], Optional[str]]:
+    """The documents of file_path and the hash of its content, which the 
+    manifest needs, or None if it could not be read. Hashing here reads the 
+    file in the parse workers rather than once more after indexing."""
+    docs = get_docs_from_file(file_path)
+    try:
+        content_hash = hash_file(file_path)
+    except OSError:
+        content_hash = None
+    return docs, content_hash
 
-    for file_path in _get_file_paths(path):
+def get_workers(n_workers: int) -> int:
+    """Resolves a configured worker count where 0 means one per CPU"""
+    if n_workers <= 0:
+        return os.cpu_count() or 1
+    return n_workers
+
+def _iter_docs_serial(file_paths:Iterable[str], ctx:Optional[LoadingContext])->Iterator[tuple[str, list[Document], Optional[str]]]:
+    for file_path in file_paths:
         if ctx is not None:
             if ctx.is_cancelled():
                 raise LoadingCancelled
             ctx.current_file = file_path
             ctx.files_loaded += 1
-        docs.extend(get_docs_from_file(file_path))
-    return _escape_unicode(docs)
+        yield file_path, *_load_file(file_path)
+
+def _iter_docs_parallel(file_paths:Iterable[str], ctx:Optional[LoadingContext], workers:int)->Iterator[tuple[str, list[Document], Optional[str]]]:
+    """Parses files in a process pool and yields the result of each file in
+    the same order as file_paths. At most 2*workers files are in flight so 
+    that a slow consumer does not make the pool buffer the whole corpus."""
+    executor = ProcessPoolExecutor(max_workers=workers)
+    in_flight: deque[tuple[str, Future]] = deque()
+    paths = iter(file_paths)
+    try:
+        while True:
+            while len(in_flight) < workers * 2:
+                file_path = next(paths, None)
+                if file_path is None:
+                    break
+                in_flight.append((file_path, executor.submit(_load_file, file_path)))
+            if not in_flight:
+                break
+            file_path, future = in_flight.popleft()
+            if ctx is not None:
+                if ctx.is_cancelled():
+                    raise LoadingCancelled
+                ctx.current_file = file_path
+            docs, content_hash = wait_result(future, ctx)
+            if ctx is not None:
+                ctx.files_loaded += 1
+            yield file_path, docs, content_hash
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def iter_docs_from_files(file_paths:Iterable[str], ctx:Optional[LoadingContext], workers:int = 1)->Iterator[tuple[str, list[Document], Optional[str]]]:
+    """Yields each file path in file_paths together with its split documents and
+    content hash, see manifest.hash_file. Files are parsed in a process pool if 
+    workers > 1, otherwise in the calling thread."""
+    if workers > 1:
+        return _iter_docs_parallel(file_paths, ctx, workers)
+    return _iter_docs_serial(file_paths, ctx)
 
-def _escape_unicode(docs:list[Document])->list[Document]:
+def escape_unicode(docs:list[Document])->list[Document]:
     docs = docs[:]
     for doc in docs:
         doc.page_content = string_to_raw_string(doc.page_content)
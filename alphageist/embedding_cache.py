@@ -0,0 +1,188 @@
+import array
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+import unicodedata
+from pathlib import Path
+from typing import Optional
+
+from langchain.embeddings.base import Embeddings
+
+from alphageist import constant
+
+logger = logging.getLogger(constant.LOGGER_NAME)
+
+_SQLITE_MAX_VARIABLES = 500 # Keep well below SQLITE_MAX_VARIABLE_NUMBER (999 in old versions)
+_EVICT_TO = 0.9 # Evict down to this fraction of max size to avoid evicting on every put
+
+def normalize_text(text: str) -> str:
+    """Normalizes unicode and whitespace so that chunks only differing in
+    formatting share the same cache entry"""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+def get_model_name(emb: Embeddings) -> str:
+    return getattr(emb, "model", None) or emb.__class__.__name__
+
+def get_cache_key(model_name: str, text: str) -> str:
+    return hashlib.sha256(f"{model_name}\0{normalize_text(text)}".encode()).hexdigest()
+
+def _to_blob(vector: list[float]) -> bytes:
+    return array.array('f', vector).tobytes()
+
+def _from_blob(blob: bytes) -> list[float]:
+    a = array.array('f')
+    a.frombytes(blob)
+    return a.tolist()
+
+class EmbeddingCache:
+    """Persistent key -> vector store backed by SQLite with least recently
+    used eviction once the stored vectors exceed max_size_mb.
+
+    The database is opened on first use."""
+    db_path: Path
+    max_size: int
+    _conn: Optional[sqlite3.Connection]
+    _total_size: Optional[int]
+
+    def __init__(self, db_path: Path, max_size_mb: int):
+        self.db_path = Path(db_path)
+        self.max_size = max_size_mb * 1024 * 1024
+        self._lock = threading.Lock()
+        self._conn = None
+        self._total_size = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.executescript("""
+                PRAGMA journal_mode=WAL;
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    key TEXT PRIMARY KEY,
+                    vector BLOB NOT NULL,
+                    last_used REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings(last_used);
+            """)
+            self._total_size = self._conn.execute(
+                "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+        return self._conn
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connect().execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    @property
+    def total_size(self) -> int:
+        """Total size of the stored vectors in bytes"""
+        with self._lock:
+            self._connect()
+            return self._total_size # type: ignore
+
+    def get_many(self, keys: list[str]) -> dict[str, list[float]]:
+        found: dict[str, list[float]] = {}
+        with self._lock:
+            conn = self._connect()
+            for i in range(0, len(keys), _SQLITE_MAX_VARIABLES):
+                chunk = keys[i:i + _SQLITE_MAX_VARIABLES]
+                placeholders = ",".join("?" * len(chunk))
+                rows = conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk).fetchall()
+                found.update((key, _from_blob(blob)) for key, blob in rows)
+            if found:
+                now = time.time()
+                conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?",
+                                 ((now, key) for key in found))
+                conn.commit()
+        return found
+
+    def put_many(self, vectors: dict[str, list[float]]) -> None:
+        with self._lock:
+            conn = self._connect()
+            now = time.time()
+            blobs = {key: _to_blob(vector) for key, vector in vectors.items()}
+            existing = self._existing_sizes(conn, list(blobs))
+            conn.executemany("INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                             ((key, blob, now) for key, blob in blobs.items()))
+            self._total_size += sum(len(blob) for blob in blobs.values()) - sum(existing.values()) # type: ignore
+            if self._total_size > self.max_size: # type: ignore
+                self._evict(conn)
+            conn.commit()
+
+    def _existing_sizes(self, conn: sqlite3.Connection, keys: list[str]) -> dict[str, int]:
+        sizes: dict[str, int] = {}
+        for i in range(0, len(keys), _SQLITE_MAX_VARIABLES):
+            chunk = keys[i:i + _SQLITE_MAX_VARIABLES]
+            placeholders = ",".join("?" * len(chunk))
+            sizes.update(conn.execute(
+                f"SELECT key, LENGTH(vector) FROM embeddings WHERE key IN ({placeholders})", chunk).fetchall())
+        return sizes
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        target = int(self.max_size * _EVICT_TO)
+        to_free = self._total_size - target # type: ignore
+        cutoff = None
+        freed = 0
+        for last_used, size in conn.execute(
+                "SELECT last_used, LENGTH(vector) FROM embeddings ORDER BY last_used ASC"):
+            freed += size
+            cutoff = last_used
+            if freed >= to_free:
+                break
+        if cutoff is None:
+            return
+        n = conn.execute("DELETE FROM embeddings WHERE last_used <= ?", (cutoff,)).rowcount
+        self._total_size = conn.execute(
+            "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+        logger.debug(f"Evicted {n} embeddings from cache")
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+class CachedEmbeddings(Embeddings):
+    """Wraps an Embeddings instance and only sends texts that are not
+    already in the cache to it"""
+    embeddings: Embeddings
+    cache: EmbeddingCache
+    model_name: str
+
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingCache):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model_name = get_model_name(embeddings)
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        keys = [get_cache_key(self.model_name, text) for text in texts]
+        try:
+            vectors = self.cache.get_many(keys)
+        except sqlite3.Error:
+            logger.exception("Unable to read from embedding cache")
+            vectors = {}
+
+        missing: dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors:
+                missing.setdefault(key, text)
+        logger.debug(f"Embedding cache hits: {len(texts) - len(missing)}/{len(texts)}")
+
+        if missing:
+            # Vectors are stored as float32, round them the same way so cache hits and misses are identical
+            new_vectors = {key: _from_blob(_to_blob(vector)) for key, vector in 
+                           zip(missing, self.embeddings.embed_documents(list(missing.values())))}
+            try:
+                self.cache.put_many(new_vectors)
+            except sqlite3.Error:
+                logger.exception("Unable to write to embedding cache")
+            vectors.update(new_vectors)
+        return [vectors[key] for key in keys]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embeddings.embed_query(text)
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return await self.embeddings.aembed_query(text)
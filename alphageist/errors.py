@@ -22,6 +22,10 @@ class MissingConfigError(Exception):
 class MissingVectorstoreError(Exception):
     pass
 
+class IndexNotReadyError(Exception):
+    """Raised when searching while indexing before anything has been indexed"""
+    pass
+
 class ConfigValueError(Exception):
     key: str
     value: str
@@ -47,3 +51,13 @@ class InvalidStateError(Exception):
 
 class LoadingCancelled(Exception):
     pass
+
+class QueryCancelled(Exception):
+    """Raised from the callbacks of a query that has been cancelled or replaced by a new one"""
+    pass
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a service that has recently been failing"""
+    def __init__(self, name: str):
+        super().__init__(f"{name} is skipped after repeated failures or slow responses")
+        self.name = name
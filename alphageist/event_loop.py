@@ -0,0 +1,67 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future
+from typing import (
+    Any,
+    Coroutine,
+    Optional,
+)
+
+from alphageist import constant
+
+logger = logging.getLogger(constant.LOGGER_NAME)
+
+class EventLoopThread:
+    """Runs an asyncio event loop in a daemon thread, to which coroutines
+    are submitted from any thread.
+
+    Clients bound to the loop they are first used on, like the async OpenAI
+    and Qdrant clients, can be reused as long as everything runs on the same
+    loop, so one loop is kept for the lifetime of the application."""
+    loop: asyncio.AbstractEventLoop
+    _thread: threading.Thread
+
+    def __init__(self, name: str = "alphageist-event-loop"):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.close()
+
+    def in_loop(self) -> bool:
+        """True if called from a coroutine or callback running on the loop"""
+        return threading.current_thread() is self._thread
+
+    def submit(self, coro: Coroutine) -> Future:
+        """Schedules coro on the loop. Cancelling the returned future cancels it."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro: Coroutine) -> Any:
+        """Runs coro on the loop and waits for its result"""
+        if self.in_loop():
+            coro.close()
+            raise RuntimeError("Waiting on the event loop from the loop itself would block it forever")
+        return self.submit(coro).result()
+
+    def stop(self) -> None:
+        if self._thread.is_alive():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join()
+
+_event_loop: Optional[EventLoopThread] = None
+_event_loop_lock = threading.Lock()
+
+def get_event_loop() -> EventLoopThread:
+    """The event loop shared by all queries, started on first use"""
+    global _event_loop
+    with _event_loop_lock:
+        if _event_loop is None:
+            logger.debug("Starting event loop thread")
+            _event_loop = EventLoopThread()
+        return _event_loop
@@ -0,0 +1,323 @@
+import logging
+import queue
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    Any,
+    Optional,
+)
+from collections.abc import Iterable, Iterator
+
+from langchain.docstore.document import Document
+from langchain.embeddings.base import Embeddings
+
+from alphageist.doc_generator import (
+    iter_docs_from_files,
+    escape_unicode,
+)
+from alphageist.local_index import LocalIndex
+from alphageist.manifest import Checkpoint
+from alphageist.util import (
+    CANCEL_POLL_S,
+    LoadingContext,
+    estimate_tokens,
+    wait_result,
+)
+from alphageist.errors import LoadingCancelled
+from alphageist import constant
+
+logger = logging.getLogger(constant.LOGGER_NAME)
+
+DEFAULT_BATCH_SIZE = 256
+DEFAULT_BATCH_TOKENS = 50000
+DEFAULT_CONCURRENCY = 4
+QUEUE_SIZE = 2 # Number of items buffered between two stages
+MAX_RETRIES = 8 # Rate limited requests are retried this many times before giving up
+MIN_BATCH_TOKENS = 1000
+BACKOFF_BASE_S = 1.0
+BACKOFF_MAX_S = 60.0
+
+_DONE = object()
+
+class _Failure:
+    def __init__(self, exception: BaseException):
+        self.exception = exception
+
+def _put(q: queue.Queue, item: Any, stop: threading.Event) -> bool:
+    """Blocking put that gives up if stop is set. Returns True if the item was put"""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+        except queue.Full:
+            continue
+        return True
+    return False
+
+def threaded(iterable: Iterable, maxsize: int = QUEUE_SIZE, ctx: Optional[LoadingContext] = None) -> Iterator:
+    """Consumes iterable in a background thread and yields its items through
+    a queue holding at most maxsize items. Exceptions raised by the iterable
+    are re-raised in the consuming thread. If ctx is cancelled while waiting
+    for an item LoadingCancelled is raised without waiting for the iterable."""
+    q: queue.Queue = queue.Queue(maxsize)
+    stop = threading.Event()
+
+    def produce():
+        it = iter(iterable)
+        try:
+            for item in it:
+                if not _put(q, item, stop):
+                    return
+        except BaseException as e:
+            _put(q, _Failure(e), stop)
+        else:
+            _put(q, _DONE, stop)
+        finally:
+            close = getattr(it, "close", None)
+            if close is not None:
+                close()
+
+    t = threading.Thread(target=produce, daemon=True)
+    t.start()
+    try:
+        while True:
+            try:
+                item = q.get(timeout=CANCEL_POLL_S)
+            except queue.Empty:
+                if ctx is not None and ctx.is_cancelled():
+                    raise LoadingCancelled
+                continue
+            if item is _DONE:
+                return
+            if isinstance(item, _Failure):
+                raise item.exception
+            yield item
+    finally:
+        stop.set()
+
+def batched(items: Iterable[Any], batch_size: int) -> Iterator[list[Any]]:
+    batch: list[Any] = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+_Chunk = tuple[str, Document, bool] # (file path, document, is last chunk of the file)
+
+def is_rate_limit_error(e: BaseException) -> bool:
+    return getattr(e, "status_code", None) == 429 or e.__class__.__name__ == "RateLimitError"
+
+def get_retry_after(e: BaseException) -> Optional[float]:
+    """Seconds the server asked us to wait, if any"""
+    response = getattr(e, "response", None)
+    try:
+        return float(response.headers["retry-after"]) # type: ignore
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return None
+
+class AdaptiveLimit:
+    """Additive increase, multiplicative decrease of the number of concurrent
+    embedding requests and of the tokens per request. Both are halved when
+    rate limited and grow again while requests succeed."""
+    max_concurrency: int
+    max_batch_tokens: int
+    concurrency: int
+    batch_tokens: int
+
+    def __init__(self, max_concurrency: int, max_batch_tokens: int):
+        self._lock = threading.Lock()
+        self.max_concurrency = max_concurrency
+        self.max_batch_tokens = max_batch_tokens
+        self.concurrency = max_concurrency
+        self.batch_tokens = max_batch_tokens
+
+    def on_success(self) -> None:
+        with self._lock:
+            self.concurrency = min(self.concurrency + 1, self.max_concurrency)
+            self.batch_tokens = min(self.batch_tokens + self.max_batch_tokens // 10, self.max_batch_tokens)
+
+    def on_rate_limited(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Returns the number of seconds to wait before retrying"""
+        with self._lock:
+            self.concurrency = max(self.concurrency // 2, 1)
+            self.batch_tokens = max(self.batch_tokens // 2, min(MIN_BATCH_TOKENS, self.max_batch_tokens))
+            logger.info(f"Rate limited, embedding with {self.concurrency} concurrent requests of {self.batch_tokens} tokens")
+        if retry_after is not None:
+            return retry_after
+        # Exponential backoff with full jitter
+        return random.uniform(0, min(BACKOFF_MAX_S, BACKOFF_BASE_S * 2 ** attempt))
+
+class _TokenBatcher:
+    """Takes batches from an iterator of chunks that stay within a token budget"""
+    def __init__(self, chunks: Iterable[_Chunk]):
+        self._chunks = iter(chunks)
+        self._next: Optional[tuple[_Chunk, int]] = None
+
+    def take(self, max_tokens: int, max_size: int) -> list[_Chunk]:
+        batch: list[_Chunk] = []
+        tokens = 0
+        while len(batch) < max_size:
+            if self._next is None:
+                chunk = next(self._chunks, None)
+                if chunk is None:
+                    break
+                self._next = (chunk, estimate_tokens(chunk[1].page_content))
+            chunk, n = self._next
+            # A chunk larger than the budget is sent on its own
+            if batch and tokens + n > max_tokens:
+                break
+            batch.append(chunk)
+            tokens += n
+            self._next = None
+        return batch
+
+def _wait(seconds: float, ctx: Optional[LoadingContext]) -> None:
+    """Sleeps, but returns early if ctx is cancelled"""
+    if ctx is None:
+        time.sleep(seconds)
+    else:
+        ctx.cancel_event.wait(seconds)
+
+def _embed_with_retry(emb: Embeddings, batch: list[_Chunk], limit: AdaptiveLimit, ctx: Optional[LoadingContext]) -> list[list[float]]:
+    texts = [doc.page_content for _, doc, _ in batch]
+    attempt = 0
+    while True:
+        if ctx is not None and ctx.is_cancelled():
+            raise LoadingCancelled
+        try:
+            vectors = emb.embed_documents(texts)
+        except Exception as e:
+            if not is_rate_limit_error(e) or attempt >= MAX_RETRIES:
+                raise
+            _wait(limit.on_rate_limited(attempt, get_retry_after(e)), ctx)
+            attempt += 1
+            continue
+        limit.on_success()
+        if ctx is not None:
+            ctx.add_embedded(len(texts), sum(estimate_tokens(text) for text in texts))
+        return vectors
+
+def _embed_batches(chunks: Iterable[_Chunk],
+                   emb: Embeddings,
+                   ctx: Optional[LoadingContext],
+                   batch_size: int,
+                   max_batch_tokens: int,
+                   concurrency: int) -> Iterator[tuple[list[_Chunk], list[list[float]]]]:
+    """Embeds chunks in batches of at most batch_size chunks and max_batch_tokens
+    tokens, with up to concurrency requests in flight. The batches are yielded
+    in order, the limits adapt when the embedding API rate limits us."""
+    limit = AdaptiveLimit(concurrency, max_batch_tokens)
+    batcher = _TokenBatcher(chunks)
+    pending: deque = deque()
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    try:
+        while True:
+            while len(pending) < limit.concurrency:
+                batch = batcher.take(limit.batch_tokens, batch_size)
+                if not batch:
+                    break
+                pending.append((batch, executor.submit(_embed_with_retry, emb, batch, limit, ctx)))
+            if not pending:
+                return
+            batch, future = pending.popleft()
+            yield batch, wait_result(future, ctx)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
+
+def index_files(file_paths: Iterable[str],
+                index: LocalIndex,
+                emb: Embeddings,
+                ctx: Optional[LoadingContext] = None,
+                workers: int = 1,
+                batch_size: int = DEFAULT_BATCH_SIZE,
+                max_batch_tokens: int = DEFAULT_BATCH_TOKENS,
+                concurrency: int = 1,
+                recreate: bool = True,
+                checkpoint: Optional[Checkpoint] = None,
+                upserted_ids: Optional[list[str]] = None,
+                content_hashes: Optional[dict[str, str]] = None) -> dict[str, list[str]]:
+    """Streams file_paths through load -> split -> embed -> upsert and returns
+    the ids of the chunks written to index for each file. Files
+    that did not result in any chunks map to an empty list.
+
+    Each stage runs in its own thread connected by bounded queues, so at most a
+    few batches of chunks are held in memory regardless of the corpus size.
+    Embedding runs up to concurrency requests at a time, see _embed_batches. The
+    collection is created when the first batch has been embedded, replacing any
+    existing collection if recreate is True. Every batch is searchable as soon
+    as it is upserted and ctx.files_indexed counts the files that are complete.
+    If a checkpoint is given the chunk ids are logged to it before they are
+    upserted and every complete file is recorded in it. If upserted_ids is 
+    given the ids are also appended to it before they are upserted, so that 
+    the caller can delete them if indexing fails part-way. The content hash 
+    of each file, computed when it is parsed, is added to content_hashes if
+    given, for the caller to record the files in a manifest."""
+    ids_by_file: dict[str, list[str]] = {}
+    content_hashes = {} if content_hashes is None else content_hashes
+    # Files without chunks are complete as soon as they are parsed, but they
+    # are recorded by the consuming thread like the others. The checkpoint may
+    # be saved while recording, which must not race with another record.
+    empty_files: deque[str] = deque()
+
+    def chunks() -> Iterator[_Chunk]:
+        for file_path, file_docs, content_hash in iter_docs_from_files(file_paths, ctx, workers):
+            if ctx is not None and ctx.is_cancelled():
+                raise LoadingCancelled
+            ids_by_file.setdefault(file_path, [])
+            if content_hash is not None:
+                content_hashes[file_path] = content_hash
+            if not file_docs:
+                empty_files.append(file_path)
+            file_docs = escape_unicode(file_docs)
+            for n, doc in enumerate(file_docs, 1):
+                yield file_path, doc, n == len(file_docs)
+
+    def record_empty_files() -> None:
+        while empty_files:
+            file_path = empty_files.popleft()
+            if checkpoint is not None:
+                checkpoint.record(file_path, [], content_hashes.get(file_path))
+            if ctx is not None:
+                ctx.add_files_indexed()
+
+    n_chunks = 0
+    embedded = threaded(_embed_batches(threaded(chunks(), maxsize=batch_size, ctx=ctx),
+                                       emb, ctx, batch_size, max_batch_tokens, concurrency), ctx=ctx)
+    try:
+        for batch, vectors in embedded:
+            if ctx is not None and ctx.is_cancelled():
+                raise LoadingCancelled
+            record_empty_files()
+            if n_chunks == 0:
+                index.create(len(vectors[0]), recreate)
+            ids = [uuid.uuid4().hex for _ in batch]
+            if checkpoint is not None:
+                checkpoint.log_ids(ids)
+            if upserted_ids is not None:
+                upserted_ids.extend(ids)
+            index.upsert(ids, vectors, [doc for _, doc, _ in batch])
+            for (file_path, _, is_last), i in zip(batch, ids):
+                ids_by_file[file_path].append(i)
+                if not is_last:
+                    continue
+                if checkpoint is not None:
+                    checkpoint.record(file_path, ids_by_file[file_path], content_hashes.get(file_path))
+                if ctx is not None:
+                    ctx.add_files_indexed()
+            n_chunks += len(ids)
+            logger.debug(f"Upserted {n_chunks} chunks")
+        record_empty_files()
+    finally:
+        embedded.close()
+    if ctx is not None and ctx.chunks_embedded:
+        logger.info(f"Embedded {ctx.chunks_embedded} chunks at {ctx.chunks_per_sec:.1f} chunks/s, {ctx.tokens_per_sec:.0f} tokens/s")
+    return ids_by_file
@@ -0,0 +1,128 @@
+import re
+import json
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+from typing import Optional
+from collections.abc import Iterable
+
+from langchain.docstore.document import Document
+
+from alphageist import constant
+from alphageist.util import raw_string_to_string
+
+logger = logging.getLogger(constant.LOGGER_NAME)
+
+KEYWORD_INDEX_FILE_NAME = "keywords.sqlite"
+
+_SQLITE_MAX_VARIABLES = 500
+
+def to_match_query(query: str) -> Optional[str]:
+    """FTS5 query matching chunks that contain any of the words in query.
+    Every word is quoted so that no character in query has a meaning to FTS5."""
+    words = dict.fromkeys(w.lower() for w in re.findall(r"\w+", query))
+    if not words:
+        return None
+    return " OR ".join(f'"{w}"' for w in words)
+
+def _indexed_text(content: str) -> str:
+    """content with its unicode escapes decoded, except lone surrogates (e.g.
+    from broken PDF text), which SQLite cannot store"""
+    return raw_string_to_string(content).encode("utf-8", "replace").decode("utf-8")
+
+class KeywordIndex:
+    """BM25 ranked full text search over the same chunks as a LocalIndex,
+    using an SQLite FTS5 inverted index. Searching needs no embedding, so it
+    finds exact tokens such as part numbers and names without network calls.
+
+    Chunks are indexed with their unicode escapes (see doc_generator.escape_unicode)
+    decoded, so that words like "bostadsköer" are tokenized as written."""
+    path: Path
+    _conn: Optional[sqlite3.Connection]
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        # The chunks table holds the content, chunks_fts only the inverted index of it
+        self._conn.executescript("""
+            PRAGMA journal_mode=WAL;
+            CREATE TABLE IF NOT EXISTS chunks (
+                rowid INTEGER PRIMARY KEY,
+                id TEXT UNIQUE NOT NULL,
+                content TEXT NOT NULL, -- As given, returned by search
+                text TEXT NOT NULL, -- content unescaped, the indexed text
+                metadata TEXT NOT NULL
+            );
+            CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(
+                text, content='chunks', content_rowid='rowid', tokenize='unicode61 remove_diacritics 2'
+            );
+            CREATE TRIGGER IF NOT EXISTS chunks_insert AFTER INSERT ON chunks BEGIN
+                INSERT INTO chunks_fts (rowid, text) VALUES (new.rowid, new.text);
+            END;
+            CREATE TRIGGER IF NOT EXISTS chunks_delete AFTER DELETE ON chunks BEGIN
+                INSERT INTO chunks_fts (chunks_fts, rowid, text) VALUES ('delete', old.rowid, old.text);
+            END;
+        """)
+
+    def count(self) -> int:
+        with self._lock:
+            if self._conn is None:
+                return 0
+            return self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def upsert(self, ids: list[str], docs: list[Document]) -> None:
+        with self._lock:
+            self._delete(ids)
+            self._conn.executemany( # type: ignore
+                "INSERT INTO chunks (id, content, text, metadata) VALUES (?, ?, ?, ?)",
+                ((i, doc.page_content, _indexed_text(doc.page_content), json.dumps(doc.metadata)) 
+                 for i, doc in zip(ids, docs)))
+            self._conn.commit() # type: ignore
+
+    def _delete(self, ids: Iterable[str]) -> None:
+        ids = list(ids)
+        for start in range(0, len(ids), _SQLITE_MAX_VARIABLES):
+            chunk = ids[start:start + _SQLITE_MAX_VARIABLES]
+            self._conn.execute(f"DELETE FROM chunks WHERE id IN ({','.join('?' * len(chunk))})", chunk) # type: ignore
+
+    def delete(self, ids: list[str]) -> None:
+        with self._lock:
+            self._delete(ids)
+            self._conn.commit() # type: ignore
+
+    def search(self, query: str, k: int = 4) -> list[tuple[Document, float]]:
+        """The k chunks with the highest BM25 score for any of the words in query.
+        Nothing is found once closed, like when a query still uses a replaced index."""
+        match = to_match_query(query)
+        if match is None:
+            return []
+        with self._lock:
+            if self._conn is None:
+                return []
+            rows = self._conn.execute("""
+                SELECT chunks.content, chunks.metadata, bm25(chunks_fts) AS score
+                FROM chunks_fts JOIN chunks ON chunks.rowid = chunks_fts.rowid
+                WHERE chunks_fts MATCH ? ORDER BY score LIMIT ?
+            """, (match, k)).fetchall() # type: ignore
+        # FTS5 negates BM25 so that the best match sorts first
+        return [(Document(page_content=content, metadata=json.loads(metadata)), -score)
+                for content, metadata, score in rows]
+
+    def drop(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM chunks") # type: ignore
+            self._conn.commit() # type: ignore
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def destroy(self) -> None:
+        self.close()
+        for suffix in ("", "-wal", "-shm"):
+            self.path.with_name(self.path.name + suffix).unlink(missing_ok=True)
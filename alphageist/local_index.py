@@ -0,0 +1,758 @@
+from __future__ import annotations
+import os
+import re
+import json
+import shutil
+import logging
+import sqlite3
+import threading
+import uuid
+from functools import partial
+from pathlib import Path
+from typing import (
+    Any,
+    Optional,
+)
+from collections.abc import Callable, Iterable, Iterator
+
+import numpy as np
+
+from langchain.docstore.document import Document
+from langchain.embeddings.base import Embeddings
+from langchain.vectorstores.base import VectorStore as LangchainVectorstore
+from langchain_core.runnables.config import run_in_executor
+from langchain_community.vectorstores import Qdrant
+
+from qdrant_client import QdrantClient
+from qdrant_client.http.models import (
+    Distance,
+    PointIdsList,
+    PointStruct,
+    VectorParams,
+)
+
+from alphageist.manifest import get_manifest_path
+from alphageist.keyword_index import (
+    KEYWORD_INDEX_FILE_NAME,
+    KeywordIndex,
+)
+from alphageist import constant
+
+logger = logging.getLogger(constant.LOGGER_NAME)
+
+NUMPY = "numpy"
+QDRANT = "qdrant"
+
+# Quantization of the vectors scanned by the numpy backend
+NO_QUANTIZATION = "none"
+FLOAT16 = "float16"
+INT8 = "int8"
+BINARY = "binary"
+
+COLLECTION_NAME = "alphageist"
+NUMPY_INDEX_DIR_NAME = "numpy_index"
+CURRENT_VERSION_FILE_NAME = "current_version"
+SEARCH_BLOCK_ROWS = 65536 # Rows scored at a time, bounds the memory used by a search
+COMPACT_MIN_DEAD_ROWS = 1024 # Deleted rows are only reclaimed when there are more than this
+KEYWORD_REBUILD_BATCH_SIZE = 1000
+
+_SQLITE_MAX_VARIABLES = 500
+
+def read_current_version(root: Path) -> int:
+    try:
+        return int((root / CURRENT_VERSION_FILE_NAME).read_text())
+    except (OSError, ValueError):
+        return 0
+
+def write_current_version(root: Path, version: int) -> None:
+    """Atomically makes version the one opened by create_local_index"""
+    root.mkdir(parents=True, exist_ok=True)
+    tmp_path = root / f"{CURRENT_VERSION_FILE_NAME}.tmp"
+    tmp_path.write_text(str(version))
+    os.replace(tmp_path, root / CURRENT_VERSION_FILE_NAME)
+
+class LocalIndex:
+    """The collection holding the chunks of the indexed files.
+
+    Indexing writes through this interface while queries go through
+    `store`, a langchain vectorstore over the same collection.
+
+    An index is one version among those stored under `root`. A rebuild
+    writes a new version while the current one is in use and switches
+    to it with make_current.
+
+    `keywords` is a keyword index of the same chunks, which is updated
+    together with the collection."""
+    path: Path
+    root: Path
+    version: int
+    manifest_path: Path
+    store: LangchainVectorstore
+    keywords: KeywordIndex
+
+    def new_version(self, embeddings: Embeddings, quantization: str = "none") -> LocalIndex:
+        """Returns a new, empty version next to this one"""
+        raise NotImplementedError
+
+    def versions(self) -> list[int]:
+        """All versions stored under root"""
+        raise NotImplementedError
+
+    def make_current(self) -> None:
+        write_current_version(self.root, self.version)
+
+    def destroy(self) -> None:
+        """Removes this version and its manifest"""
+        raise NotImplementedError
+
+    def destroy_other_versions(self) -> None:
+        """Removes versions left behind by interrupted or replaced rebuilds"""
+        raise NotImplementedError
+
+    def exists(self) -> bool:
+        raise NotImplementedError
+
+    def count(self) -> int:
+        raise NotImplementedError
+
+    def create(self, vector_size: int, recreate: bool = False) -> None:
+        """Creates the collection, replacing an existing one if recreate is True"""
+        raise NotImplementedError
+
+    def upsert(self, ids: list[str], vectors: list[list[float]], docs: list[Document]) -> None:
+        raise NotImplementedError
+
+    def delete_points(self, ids: list[str]) -> None:
+        raise NotImplementedError
+
+    def iter_documents(self) -> Iterator[tuple[str, Document]]:
+        """All chunks in the collection with their ids"""
+        raise NotImplementedError
+
+    def keywords_in_sync(self) -> bool:
+        return self.keywords.count() == self.count()
+
+    def rebuild_keywords(self) -> None:
+        """Fills the keyword index from the collection, which is needed for collections
+        created before keyword indexes or after an interruption between the two"""
+        logger.info(f"Rebuilding the keyword index of {self.count()} chunks")
+        self.keywords.drop()
+        ids: list[str] = []
+        docs: list[Document] = []
+        for i, doc in self.iter_documents():
+            ids.append(i)
+            docs.append(doc)
+            if len(ids) >= KEYWORD_REBUILD_BATCH_SIZE:
+                self.keywords.upsert(ids, docs)
+                ids, docs = [], []
+        if ids:
+            self.keywords.upsert(ids, docs)
+
+    def drop(self) -> None:
+        """Removes the collection and everything in it"""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        raise NotImplementedError
+
+def _qdrant_collection_name(version: int) -> str:
+    # Version 0 keeps the name used before indexes were versioned
+    return COLLECTION_NAME if version == 0 else f"{COLLECTION_NAME}_v{version}"
+
+class QdrantIndex(LocalIndex):
+    """Collection in qdrant-client's embedded (path) mode. All versions are
+    collections in the same client since only one client can open the path."""
+    client: QdrantClient
+    collection_name: str
+
+    def __init__(self, path: str, embeddings: Embeddings, version: int = 0, client: Optional[QdrantClient] = None):
+        self.path = Path(path)
+        self.root = self.path
+        self.version = version
+        self.client = QdrantClient(path=path, prefer_grpc=True) if client is None else client
+        self.collection_name = _qdrant_collection_name(version)
+        self.manifest_path = get_manifest_path(path) if version == 0 else self.path / f"manifest.v{version}.json"
+        self.store = Qdrant(client=self.client, collection_name=self.collection_name, embeddings=embeddings)
+        keywords_file_name = KEYWORD_INDEX_FILE_NAME if version == 0 else f"keywords.v{version}.sqlite"
+        self.keywords = KeywordIndex(self.path / keywords_file_name)
+
+    def versions(self) -> list[int]:
+        versions = []
+        for c in self.client.get_collections().collections:
+            m = re.fullmatch(rf"{COLLECTION_NAME}(?:_v(\d+))?", c.name)
+            if m is not None:
+                versions.append(int(m.group(1) or 0))
+        return versions
+
+    def new_version(self, embeddings: Embeddings, quantization: str = "none") -> QdrantIndex:
+        return QdrantIndex(str(self.path), embeddings, max([self.version, *self.versions()]) + 1, self.client)
+
+    def destroy(self) -> None:
+        if self.exists():
+            self.drop()
+        self.keywords.destroy()
+        self.manifest_path.unlink(missing_ok=True)
+
+    def destroy_other_versions(self) -> None:
+        for version in self.versions():
+            if version != self.version:
+                QdrantIndex(str(self.path), self.store.embeddings, version, self.client).destroy() # type: ignore
+
+    def exists(self) -> bool:
+        return self.client.collection_exists(self.collection_name)
+
+    def count(self) -> int:
+        return self.client.count(self.collection_name).count if self.exists() else 0
+
+    def create(self, vector_size: int, recreate: bool = False) -> None:
+        if self.exists():
+            if not recreate:
+                return
+            self.client.delete_collection(self.collection_name)
+        self.client.create_collection(
+            self.collection_name,
+            vectors_config=VectorParams(size=vector_size, distance=Distance.COSINE))
+
+    def upsert(self, ids: list[str], vectors: list[list[float]], docs: list[Document]) -> None:
+        points = [PointStruct(
+                    id=i,
+                    vector=vector,
+                    payload={
+                        Qdrant.CONTENT_KEY: doc.page_content,
+                        Qdrant.METADATA_KEY: doc.metadata,
+                    }) for i, vector, doc in zip(ids, vectors, docs)]
+        self.client.upsert(self.collection_name, points=points)
+        self.keywords.upsert(ids, docs)
+
+    def delete_points(self, ids: list[str]) -> None:
+        self.client.delete(self.collection_name, points_selector=PointIdsList(points=ids))
+        self.keywords.delete(ids)
+
+    def iter_documents(self) -> Iterator[tuple[str, Document]]:
+        if not self.exists():
+            return
+        offset = None
+        while True:
+            points, offset = self.client.scroll(self.collection_name, limit=KEYWORD_REBUILD_BATCH_SIZE,
+                                                offset=offset, with_payload=True, with_vectors=False)
+            for point in points:
+                payload = point.payload or {}
+                yield str(point.id), Document(page_content=payload.get(Qdrant.CONTENT_KEY, ""),
+                                              metadata=payload.get(Qdrant.METADATA_KEY) or {})
+            if offset is None:
+                return
+
+    def drop(self) -> None:
+        self.client.delete_collection(self.collection_name)
+        self.keywords.drop()
+
+    def close(self) -> None:
+        self.client.close()
+        self.keywords.close()
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+def top_k(scores: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+    """Returns the column indices and values of the k highest scores of
+    each row, unordered. argpartition is O(n) compared to O(n log n) for a sort."""
+    k = min(k, scores.shape[1])
+    idx = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    return idx, np.take_along_axis(scores, idx, axis=1)
+
+_POPCOUNT16 = np.array([bin(i).count("1") for i in range(1 << 16)], dtype=np.uint8)
+
+def popcount16(x: np.ndarray) -> np.ndarray:
+    """Number of set bits of each uint16. A 16 bit lookup table is about twice
+    as fast as an 8 bit one and still fits in the CPU cache."""
+    if hasattr(np, "bitwise_count"): # numpy >= 2.0
+        return np.bitwise_count(x)
+    return _POPCOUNT16[x]
+
+class _Codec:
+    """Compact encoding of normalized vectors that is scanned instead of the
+    float32 originals. The best `oversampling * k` candidates of a scan are
+    rescored against the originals."""
+    name: str
+    dtype: type
+    oversampling: int
+
+    def width(self, dim: int) -> int:
+        raise NotImplementedError
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+    def scores(self, codes: np.ndarray, queries: np.ndarray) -> np.ndarray:
+        """Approximate similarity of each query (rows) to each code (columns)"""
+        raise NotImplementedError
+
+class _Float16Codec(_Codec):
+    name = FLOAT16
+    dtype = np.float16
+    oversampling = 2
+
+    def width(self, dim: int) -> int:
+        return dim
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        return vectors.astype(np.float16)
+
+    def scores(self, codes: np.ndarray, queries: np.ndarray) -> np.ndarray:
+        # numpy has no fast float16 matmul, the block is widened instead
+        return queries @ codes.astype(np.float32).T
+
+class _Int8Codec(_Codec):
+    """Each row is scaled by its own max so that all 255 levels are used,
+    the float32 scale is stored in the last 4 bytes of the row"""
+    name = INT8
+    dtype = np.int8
+    oversampling = 4
+
+    def width(self, dim: int) -> int:
+        return dim + 4
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        scale = np.abs(vectors).max(axis=1, keepdims=True) / 127
+        scale[scale == 0] = 1
+        codes = np.round(vectors / scale).astype(np.int8)
+        return np.hstack([codes, scale.astype(np.float32).view(np.int8)])
+
+    def scores(self, codes: np.ndarray, queries: np.ndarray) -> np.ndarray:
+        scale = np.ascontiguousarray(codes[:, -4:]).view(np.float32)[:, 0]
+        return (queries @ codes[:, :-4].astype(np.float32).T) * scale
+
+class _BinaryCodec(_Codec):
+    """One sign bit per dimension, scored by hamming distance. Rows are
+    padded to whole uint16s for popcount16."""
+    name = BINARY
+    dtype = np.uint8
+    oversampling = 40
+
+    def width(self, dim: int) -> int:
+        return (dim + 15) // 16 * 2
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        codes = np.packbits(vectors > 0, axis=1)
+        padding = self.width(vectors.shape[1]) - codes.shape[1]
+        return np.pad(codes, ((0, 0), (0, padding))) if padding else codes
+
+    def scores(self, codes: np.ndarray, queries: np.ndarray) -> np.ndarray:
+        codes16 = np.ascontiguousarray(codes).view(np.uint16)
+        query_codes = self.encode(queries).view(np.uint16)
+        scores = np.empty((len(queries), len(codes)), dtype=np.float32)
+        for n, query_code in enumerate(query_codes):
+            scores[n] = -popcount16(np.bitwise_xor(codes16, query_code)).sum(axis=1, dtype=np.int32)
+        return scores
+
+CODECS: dict[str, _Codec] = {codec.name: codec for codec in (_Float16Codec(), _Int8Codec(), _BinaryCodec())}
+QUANTIZATIONS = (NO_QUANTIZATION, *CODECS)
+
+class NumpyIndex(LocalIndex, LangchainVectorstore):
+    """Collection stored as a memory mapped float32 matrix of normalized
+    vectors with the ids and payloads in an SQLite sidecar.
+
+    Searching is an exact cosine similarity scan in blocks of rows, scoring
+    every query of a batch at once. With quantization a compact copy of the
+    vectors is scanned instead and only the best candidates are rescored
+    against the originals. Deleted rows are masked out and only reclaimed by
+    compaction, which writes new vectors files."""
+    _dim: Optional[int]
+    _vectors: Optional[np.memmap]
+    _codec: Optional[_Codec]
+    _codes: Optional[np.memmap]
+    _alive: np.ndarray
+    _generation: int
+    _conn: Optional[sqlite3.Connection]
+
+    def __init__(self, path: str, embeddings: Embeddings, quantization: str = NO_QUANTIZATION, version: int = 0):
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization: {quantization}")
+        self.path = Path(path)
+        self.root = self.path.parent
+        self.version = version
+        self.manifest_path = get_manifest_path(path)
+        self.store = self
+        self._embeddings = embeddings
+        self._lock = threading.RLock()
+        self._conn = None
+        self._dim = None
+        self._vectors = None
+        self._codec = CODECS.get(quantization)
+        self._codes = None
+        self._alive = np.zeros(0, dtype=bool)
+        self._generation = 0
+        self._open()
+        self.keywords = KeywordIndex(self.path / KEYWORD_INDEX_FILE_NAME)
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embeddings
+
+    def versions(self) -> list[int]:
+        return [int(p.name[1:]) for p in self.root.glob("v*") if p.is_dir() and p.name[1:].isdigit()]
+
+    def new_version(self, embeddings: Embeddings, quantization: str = NO_QUANTIZATION) -> NumpyIndex:
+        version = max([self.version, *self.versions()]) + 1
+        return NumpyIndex(str(self.root / f"v{version}"), embeddings, quantization, version)
+
+    def destroy(self) -> None:
+        self.close()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def destroy_other_versions(self) -> None:
+        for version in self.versions():
+            if version != self.version:
+                shutil.rmtree(self.root / f"v{version}", ignore_errors=True)
+
+    def _vectors_path(self, generation: int) -> Path:
+        return self.path / f"vectors.{generation}.f32"
+
+    def _codes_path(self, generation: int) -> Path:
+        return self.path / f"vectors.{generation}.{self._codec.name}" # type: ignore
+
+    def _code_row_size(self) -> int:
+        return self._codec.width(self._dim) * np.dtype(self._codec.dtype).itemsize # type: ignore
+
+    def _open(self) -> None:
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self.path / "payloads.sqlite", check_same_thread=False)
+        self._conn.executescript("""
+            PRAGMA journal_mode=WAL;
+            CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+            CREATE TABLE IF NOT EXISTS points (
+                row INTEGER PRIMARY KEY,
+                id TEXT UNIQUE NOT NULL,
+                content TEXT NOT NULL,
+                metadata TEXT NOT NULL
+            );
+        """)
+        info = dict(self._conn.execute("SELECT key, value FROM info").fetchall())
+        if "dim" not in info:
+            return
+        self._dim = info["dim"]
+        self._generation = info["generation"]
+        self._remove_stale_files()
+
+        # Rows written after the last commit of the sidecar are not alive, a partially
+        # written row is truncated so that later appends stay aligned
+        vectors_path = self._vectors_path(self._generation)
+        vectors_path.touch()
+        row_size = self._dim * 4
+        n_rows = vectors_path.stat().st_size // row_size
+        if vectors_path.stat().st_size != n_rows * row_size:
+            os.truncate(vectors_path, n_rows * row_size)
+        alive = np.zeros(n_rows, dtype=bool)
+        rows = np.array([row for row, in self._conn.execute("SELECT row FROM points")], dtype=np.int64)
+        alive[rows[rows < n_rows]] = True
+        self._alive = alive
+        if self._codec is not None:
+            self._sync_codes(n_rows)
+        self._map()
+
+    def _sync_codes(self, n_rows: int) -> None:
+        """Makes the codes file cover the same rows as the vectors file. Rows that
+        are missing, after a crash or when the quantization was changed, are encoded."""
+        codes_path = self._codes_path(self._generation)
+        codes_path.touch()
+        row_size = self._code_row_size()
+        n_code_rows = min(codes_path.stat().st_size // row_size, n_rows)
+        os.truncate(codes_path, n_code_rows * row_size)
+        if n_code_rows == n_rows:
+            return
+        logger.info(f"Quantizing {n_rows - n_code_rows} vectors to {self._codec.name}") # type: ignore
+        vectors = np.memmap(self._vectors_path(self._generation), dtype=np.float32, mode='r', shape=(n_rows, self._dim))
+        with open(codes_path, 'ab') as f:
+            for start in range(n_code_rows, n_rows, SEARCH_BLOCK_ROWS):
+                f.write(self._codec.encode(np.asarray(vectors[start:start + SEARCH_BLOCK_ROWS])).tobytes()) # type: ignore
+        del vectors
+
+    def _remove_stale_files(self) -> None:
+        """Removes vectors files left behind by an interrupted compaction
+        or a previously used quantization"""
+        current = {self._vectors_path(self._generation)}
+        if self._codec is not None:
+            current.add(self._codes_path(self._generation))
+        for p in self.path.glob("vectors.*"):
+            if p not in current:
+                try:
+                    p.unlink()
+                except OSError:
+                    logger.warning(f"Unable to remove {p}")
+
+    def _map(self) -> None:
+        n_rows = len(self._alive)
+        if n_rows == 0:
+            self._vectors = None
+            self._codes = None
+            return
+        self._vectors = np.memmap(self._vectors_path(self._generation), dtype=np.float32,
+                                  mode='r', shape=(n_rows, self._dim))
+        if self._codec is not None:
+            self._codes = np.memmap(self._codes_path(self._generation), dtype=self._codec.dtype,
+                                    mode='r', shape=(n_rows, self._codec.width(self._dim))) # type: ignore
+
+    def exists(self) -> bool:
+        return self._dim is not None
+
+    def count(self) -> int:
+        with self._lock:
+            return int(self._alive.sum())
+
+    def create(self, vector_size: int, recreate: bool = False) -> None:
+        with self._lock:
+            if self.exists():
+                if not recreate:
+                    return
+                self.drop()
+            self._conn.executemany("INSERT OR REPLACE INTO info (key, value) VALUES (?, ?)", # type: ignore
+                                   (("dim", vector_size), ("generation", self._generation)))
+            self._conn.commit() # type: ignore
+            self._dim = vector_size
+            self._vectors_path(self._generation).touch()
+            if self._codec is not None:
+                self._codes_path(self._generation).touch()
+
+    def upsert(self, ids: list[str], vectors: list[list[float]], docs: list[Document]) -> None:
+        matrix = np.asarray(vectors, dtype=np.float32)
+        if matrix.ndim != 2 or matrix.shape[1] != self._dim:
+            raise ValueError(f"Expected vectors of size {self._dim}, got shape {matrix.shape}")
+        matrix = _normalize(matrix).astype(np.float32)
+        with self._lock:
+            self._delete_rows(self._get_rows(ids))
+            first_row = len(self._alive)
+            # The vectors are written before the sidecar is committed, see _open
+            with open(self._vectors_path(self._generation), 'ab') as f:
+                f.write(matrix.tobytes())
+            if self._codec is not None:
+                with open(self._codes_path(self._generation), 'ab') as f:
+                    f.write(self._codec.encode(matrix).tobytes())
+            self._conn.executemany( # type: ignore
+                "INSERT INTO points (row, id, content, metadata) VALUES (?, ?, ?, ?)",
+                ((first_row + n, i, doc.page_content, json.dumps(doc.metadata))
+                 for n, (i, doc) in enumerate(zip(ids, docs))))
+            self._conn.commit() # type: ignore
+            self._alive = np.concatenate([self._alive, np.ones(len(matrix), dtype=bool)])
+            self._map()
+        self.keywords.upsert(ids, docs)
+
+    def _get_rows(self, ids: list[str]) -> list[int]:
+        rows = []
+        for i in range(0, len(ids), _SQLITE_MAX_VARIABLES):
+            chunk = ids[i:i + _SQLITE_MAX_VARIABLES]
+            placeholders = ",".join("?" * len(chunk))
+            rows.extend(row for row, in self._conn.execute( # type: ignore
+                f"SELECT row FROM points WHERE id IN ({placeholders})", chunk))
+        return rows
+
+    def _delete_rows(self, rows: list[int]) -> None:
+        if not rows:
+            return
+        self._conn.executemany("DELETE FROM points WHERE row = ?", ((row,) for row in rows)) # type: ignore
+        self._conn.commit() # type: ignore
+        self._alive[rows] = False
+
+    def delete_points(self, ids: list[str]) -> None:
+        with self._lock:
+            self._delete_rows(self._get_rows(ids))
+            n_dead = len(self._alive) - self.count()
+            if n_dead > COMPACT_MIN_DEAD_ROWS and n_dead > self.count():
+                self.compact()
+        self.keywords.delete(ids)
+
+    def iter_documents(self) -> Iterator[tuple[str, Document]]:
+        last_row = -1
+        while True:
+            with self._lock:
+                rows = self._conn.execute( # type: ignore
+                    "SELECT row, id, content, metadata FROM points WHERE row > ? ORDER BY row LIMIT ?",
+                    (last_row, KEYWORD_REBUILD_BATCH_SIZE)).fetchall()
+            if not rows:
+                return
+            for last_row, point_id, content, metadata in rows:
+                yield point_id, Document(page_content=content, metadata=json.loads(metadata))
+
+    def delete(self, ids: Optional[list[str]] = None, **kwargs: Any) -> Optional[bool]:
+        if ids is None:
+            return False
+        self.delete_points(ids)
+        return True
+
+    def compact(self) -> None:
+        """Rewrites the vectors file without the deleted rows. The new file
+        only becomes current when the renumbered sidecar is committed, so an
+        interruption leaves the previous state intact."""
+        with self._lock:
+            if self._vectors is None:
+                return
+            old_rows = np.flatnonzero(self._alive)
+            new_generation = self._generation + 1
+            self._write_rows(self._vectors, old_rows, self._vectors_path(new_generation))
+            if self._codec is not None:
+                self._write_rows(self._codes, old_rows, self._codes_path(new_generation)) # type: ignore
+            # Ascending order never moves a row onto one that has not been moved yet
+            self._conn.executemany("UPDATE points SET row = ? WHERE row = ?", # type: ignore
+                                   ((new_row, int(old_row)) for new_row, old_row in enumerate(old_rows) if new_row != old_row))
+            self._conn.execute("UPDATE info SET value = ? WHERE key = 'generation'", (new_generation,)) # type: ignore
+            self._conn.commit() # type: ignore
+            logger.debug(f"Compacted {len(self._alive)} rows to {len(old_rows)}")
+
+            # Release the mappings so that the old files can be removed
+            self._vectors = None
+            self._codes = None
+            self._generation = new_generation
+            self._alive = np.ones(len(old_rows), dtype=bool)
+            self._remove_stale_files()
+            self._map()
+
+    @staticmethod
+    def _write_rows(matrix: np.ndarray, rows: np.ndarray, path: Path) -> None:
+        with open(path, 'wb') as f:
+            for start in range(0, len(rows), SEARCH_BLOCK_ROWS):
+                f.write(np.ascontiguousarray(matrix[rows[start:start + SEARCH_BLOCK_ROWS]]).tobytes())
+
+    def drop(self) -> None:
+        with self._lock:
+            self._conn.executescript("DELETE FROM points; DELETE FROM info;") # type: ignore
+            self._vectors = None
+            self._codes = None
+            self._alive = np.zeros(0, dtype=bool)
+            self._dim = None
+            self._generation += 1
+            self._remove_stale_files()
+        self.keywords.drop()
+
+    def close(self) -> None:
+        with self._lock:
+            self._vectors = None
+            self._codes = None
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+        self.keywords.close()
+
+    @staticmethod
+    def _scan(score_block: Callable[[int, int], np.ndarray], alive: np.ndarray,
+              n_queries: int, k: int) -> list[tuple[np.ndarray, np.ndarray]]:
+        """Scores the rows in blocks using score_block(start, stop) and returns
+        the rows and scores of the k best alive rows of each query, best first"""
+        best_rows = np.zeros((n_queries, 0), dtype=np.int64)
+        best_scores = np.zeros((n_queries, 0), dtype=np.float32)
+        for start in range(0, len(alive), SEARCH_BLOCK_ROWS):
+            stop = start + SEARCH_BLOCK_ROWS
+            scores = score_block(start, stop)
+            scores[:, ~alive[start:stop]] = -np.inf
+            idx, block_scores = top_k(scores, k)
+            rows = np.concatenate([best_rows, idx + start], axis=1)
+            scores = np.concatenate([best_scores, block_scores], axis=1)
+            idx, best_scores = top_k(scores, k)
+            best_rows = np.take_along_axis(rows, idx, axis=1)
+
+        res = []
+        for rows, scores in zip(best_rows, best_scores):
+            order = np.argsort(-scores)
+            order = order[np.isfinite(scores[order])]
+            res.append((rows[order], scores[order]))
+        return res
+
+    @staticmethod
+    def _rescore(vectors: np.ndarray, query: np.ndarray, rows: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        rows = np.sort(rows) # Reads the memory mapped file in order
+        scores = np.asarray(vectors[rows]) @ query
+        order = np.argsort(-scores)[:k]
+        return rows[order], scores[order]
+
+    def search(self, query_vectors: list[list[float]], k: int) -> list[list[tuple[str, Document, float]]]:
+        """Returns the k most similar points as (id, document, score) for each query vector"""
+        queries = _normalize(np.atleast_2d(np.asarray(query_vectors, dtype=np.float32)))
+        with self._lock:
+            if self._vectors is None or k < 1:
+                return [[] for _ in queries]
+            vectors, codes, codec, alive = self._vectors, self._codes, self._codec, self._alive
+            if codec is None:
+                res = self._scan(lambda start, stop: queries @ np.asarray(vectors[start:stop]).T,
+                                 alive, len(queries), k)
+            else:
+                candidates = self._scan(lambda start, stop: codec.scores(np.asarray(codes[start:stop]), queries), # type: ignore
+                                        alive, len(queries), k * codec.oversampling)
+                res = [self._rescore(vectors, query, rows, k) for query, (rows, _) in zip(queries, candidates)]
+            payloads = self._get_payloads({int(row) for rows, _ in res for row in rows})
+        return [[(*payloads[int(row)], float(score)) for row, score in zip(rows, scores)]
+                for rows, scores in res]
+
+    def _get_payloads(self, rows: set[int]) -> dict[int, tuple[str, Document]]:
+        payloads = {}
+        rows_list = list(rows)
+        for i in range(0, len(rows_list), _SQLITE_MAX_VARIABLES):
+            chunk = rows_list[i:i + _SQLITE_MAX_VARIABLES]
+            placeholders = ",".join("?" * len(chunk))
+            for row, point_id, content, metadata in self._conn.execute( # type: ignore
+                    f"SELECT row, id, content, metadata FROM points WHERE row IN ({placeholders})", chunk):
+                payloads[row] = (point_id, Document(page_content=content, metadata=json.loads(metadata)))
+        return payloads
+
+    # Langchain vectorstore interface
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[list[dict]] = None,
+                  ids: Optional[list[str]] = None, **kwargs: Any) -> list[str]:
+        texts = list(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [uuid.uuid4().hex for _ in texts]
+        vectors = self._embeddings.embed_documents(texts)
+        if not self.exists():
+            self.create(len(vectors[0]))
+        self.upsert(ids, vectors, [Document(page_content=t, metadata=m) for t, m in zip(texts, metadatas)])
+        return ids
+
+    @classmethod
+    def from_texts(cls, texts: list[str], embedding: Embeddings, metadatas: Optional[list[dict]] = None,
+                   path: Optional[str] = None, **kwargs: Any) -> NumpyIndex:
+        if path is None:
+            raise ValueError("path is required")
+        index = cls(path, embedding)
+        index.add_texts(texts, metadatas, **kwargs)
+        return index
+
+    def similarity_search_with_score_by_vector(self, embedding: list[float], k: int = 4,
+                                               score_threshold: Optional[float] = None,
+                                               **kwargs: Any) -> list[tuple[Document, float]]:
+        res = [(doc, score) for _, doc, score in self.search([embedding], k)[0]]
+        if score_threshold is not None:
+            res = [(doc, score) for doc, score in res if score >= score_threshold]
+        return res
+
+    async def asimilarity_search_with_score_by_vector(self, embedding: list[float], k: int = 4,
+                                                      **kwargs: Any) -> list[tuple[Document, float]]:
+        return await run_in_executor(None, partial(self.similarity_search_with_score_by_vector, embedding, k, **kwargs))
+
+    def similarity_search_by_vector(self, embedding: list[float], k: int = 4, **kwargs: Any) -> list[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k, **kwargs)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> list[tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(self._embeddings.embed_query(query), k, **kwargs)
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> list[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, **kwargs)]
+
+    def _similarity_search_with_relevance_scores(self, query: str, k: int = 4,
+                                                 **kwargs: Any) -> list[tuple[Document, float]]:
+        # Like Qdrant, the cosine similarity is used as relevance score
+        return self.similarity_search_with_score(query, k, **kwargs)
+
+def create_local_index(backend: str, vector_db_dir: str, embeddings: Embeddings,
+                       quantization: str = NO_QUANTIZATION) -> LocalIndex:
+    """Opens the current version of the index and removes any other version.
+    quantization only applies to the numpy backend."""
+    index: LocalIndex
+    if backend == QDRANT:
+        index = QdrantIndex(vector_db_dir, embeddings, read_current_version(Path(vector_db_dir)))
+    elif backend == NUMPY:
+        root = Path(vector_db_dir) / NUMPY_INDEX_DIR_NAME
+        version = read_current_version(root)
+        index = NumpyIndex(str(root / f"v{version}"), embeddings, quantization, version)
+    else:
+        raise ValueError(f"Unknown local index backend: {backend}")
+    index.destroy_other_versions()
+    return index
@@ -0,0 +1,203 @@
+from __future__ import annotations
+import os
+import json
+import time
+import hashlib
+import logging
+from pathlib import Path
+from typing import Optional
+from collections.abc import Iterable
+
+from alphageist import constant
+from alphageist.errors import LoadingCancelled
+from alphageist.util import LoadingContext
+
+logger = logging.getLogger(constant.LOGGER_NAME)
+
+MANIFEST_FILE_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+CHECKPOINT_INTERVAL_S = 10.0 # Minimum time between two checkpoints of an indexing run
+
+def get_manifest_path(vector_db_dir: str) -> Path:
+    return Path(vector_db_dir) / MANIFEST_FILE_NAME
+
+def hash_file(file_path: str) -> str:
+    h = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+class FileEntry:
+    size: int
+    mtime: float
+    content_hash: str
+    chunk_ids: list[str]
+
+    def __init__(self, size: int, mtime: float, content_hash: str, chunk_ids: list[str]):
+        self.size = size
+        self.mtime = mtime
+        self.content_hash = content_hash
+        self.chunk_ids = chunk_ids
+
+    def to_dict(self) -> dict:
+        return {
+            "size": self.size,
+            "mtime": self.mtime,
+            "content_hash": self.content_hash,
+            "chunk_ids": self.chunk_ids,
+        }
+
+    @classmethod
+    def from_dict(cls, d: dict) -> FileEntry:
+        return cls(d["size"], d["mtime"], d["content_hash"], d["chunk_ids"])
+
+class ManifestDiff:
+    added: list[str]
+    modified: list[str]
+    deleted: list[str]
+
+    def __init__(self, added: list[str], modified: list[str], deleted: list[str]):
+        self.added = added
+        self.modified = modified
+        self.deleted = deleted
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.modified or self.deleted)
+
+    def __repr__(self) -> str:
+        return f"ManifestDiff(added={len(self.added)}, modified={len(self.modified)}, deleted={len(self.deleted)})"
+
+class Manifest:
+    """Keeps track of which files are indexed in the vectorstore and
+    which chunk (point) ids each file was split into"""
+    files: dict[str, FileEntry]
+
+    def __init__(self, files: Optional[dict[str, FileEntry]] = None):
+        self.files = {} if files is None else files
+
+    def __contains__(self, file_path: str) -> bool:
+        return file_path in self.files
+
+    def __len__(self) -> int:
+        return len(self.files)
+
+    def record(self, file_path: str, chunk_ids: list[str], content_hash: Optional[str] = None) -> None:
+        """Adds or replaces the entry of file_path using its current content.
+        The file is hashed unless content_hash is given."""
+        st = os.stat(file_path)
+        if content_hash is None:
+            content_hash = hash_file(file_path)
+        self.files[file_path] = FileEntry(st.st_size, st.st_mtime, content_hash, chunk_ids)
+
+    def remove(self, file_path: str) -> list[str]:
+        """Removes file_path and returns the chunk ids it had"""
+        entry = self.files.pop(file_path, None)
+        return [] if entry is None else entry.chunk_ids
+
+    def chunk_ids(self, file_paths: Iterable[str]) -> list[str]:
+        return [i for file_path in file_paths if file_path in self.files
+                  for i in self.files[file_path].chunk_ids]
+
+    def diff(self, file_paths: Iterable[str], ctx: Optional[LoadingContext] = None) -> ManifestDiff:
+        """Compares the manifest with the files currently on disk.
+
+        Size and mtime are checked first, the content hash is only computed
+        when they differ so that touched but unchanged files are not re-indexed.
+        Raises LoadingCancelled as soon as ctx is cancelled."""
+        added, modified = [], []
+        seen = set()
+        for file_path in file_paths:
+            if ctx is not None and ctx.is_cancelled():
+                raise LoadingCancelled
+            entry = self.files.get(file_path)
+            if entry is None:
+                added.append(file_path)
+                continue
+            try:
+                st = os.stat(file_path)
+            except OSError:
+                continue # Not seen, so it is treated as deleted
+            seen.add(file_path)
+            if st.st_size == entry.size and st.st_mtime == entry.mtime:
+                continue
+            if st.st_size == entry.size and hash_file(file_path) == entry.content_hash:
+                entry.mtime = st.st_mtime
+                continue
+            modified.append(file_path)
+        deleted = [file_path for file_path in self.files if file_path not in seen]
+        return ManifestDiff(added, modified, deleted)
+
+    def save(self, manifest_path: Path) -> None:
+        """Writes the manifest atomically so that a crash never leaves a half written file"""
+        tmp_path = manifest_path.with_suffix(".tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump({
+                "version": MANIFEST_VERSION,
+                "files": {file_path: entry.to_dict() for file_path, entry in self.files.items()}
+            }, f)
+        os.replace(tmp_path, manifest_path)
+
+    @classmethod
+    def load(cls, manifest_path: Path) -> Optional[Manifest]:
+        """Returns None if there is no manifest or if it can not be used"""
+        if not manifest_path.exists():
+            return None
+        try:
+            with open(manifest_path, 'r') as f:
+                data = json.load(f)
+            if data.get("version") != MANIFEST_VERSION:
+                logger.warning(f"Ignoring manifest with unknown version {data.get('version')}")
+                return None
+            return cls({file_path: FileEntry.from_dict(d) for file_path, d in data["files"].items()})
+        except (ValueError, KeyError, TypeError):
+            logger.exception(f"Unable to read manifest {manifest_path}")
+            return None
+
+class Checkpoint:
+    """Progress of an indexing run that has not completed yet, kept next to
+    the manifest it will become.
+
+    The ids of every chunk are appended to a log before they are upserted and
+    the files whose chunks are all upserted are recorded in a manifest that is
+    saved at most every CHECKPOINT_INTERVAL_S. When resuming, the logged chunks
+    that do not belong to a recorded file are the ones to delete."""
+    manifest: Manifest
+    path: Path
+    log_path: Path
+
+    def __init__(self, manifest_path: Path):
+        self.path = manifest_path.with_name(f"{manifest_path.stem}.checkpoint.json")
+        self.log_path = manifest_path.with_name(f"{manifest_path.stem}.ids")
+        self.manifest = Manifest.load(self.path) or Manifest()
+        self._last_save = time.monotonic()
+
+    def exists(self) -> bool:
+        return self.path.exists() or self.log_path.exists()
+
+    def log_ids(self, ids: Iterable[str]) -> None:
+        with open(self.log_path, 'a') as f:
+            f.writelines(f"{i}\n" for i in ids)
+
+    def record(self, file_path: str, chunk_ids: list[str], content_hash: Optional[str] = None) -> None:
+        self.manifest.record(file_path, chunk_ids, content_hash)
+        if time.monotonic() - self._last_save >= CHECKPOINT_INTERVAL_S:
+            self.save()
+
+    def save(self) -> None:
+        self.manifest.save(self.path)
+        self._last_save = time.monotonic()
+
+    def orphan_ids(self) -> list[str]:
+        """Ids that were logged but do not belong to a recorded file"""
+        if not self.log_path.exists():
+            return []
+        recorded = set(self.manifest.chunk_ids(self.manifest.files))
+        with open(self.log_path, 'r') as f:
+            logged = {line.strip() for line in f}
+        return [i for i in logged if i and i not in recorded]
+
+    def remove(self) -> None:
+        self.path.unlink(missing_ok=True)
+        self.log_path.unlink(missing_ok=True)
+        self.manifest = Manifest()
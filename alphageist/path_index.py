@@ -0,0 +1,114 @@
+import os
+import threading
+from collections.abc import Iterable, Iterator
+
+MAX_CANDIDATES = 500 # Matches looked at per search, bounds the time of very broad queries
+
+class PathIndex:
+    """In memory index of file paths for instant filename search.
+
+    The lowercased paths, relative to root, are kept in one newline separated
+    string so that a substring is found by str.find, which scans at around
+    1 GB/s, rather than by testing each path in Python. That is a few ms for
+    100 000 files. The string is rebuilt on the first search after paths have
+    been removed, added paths are appended to it."""
+    root: str
+
+    def __init__(self, root: str = "", paths: Iterable[str] = ()):
+        self.root = root
+        self._lock = threading.Lock()
+        self._paths: dict[str, list[str]] = {} # Lowercased relative path -> paths
+        self._haystack = "\n"
+        self._pending: list[str] = []
+        self._stale = False
+        self.replace(paths)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(len(paths) for paths in self._paths.values())
+
+    def _key(self, path: str) -> str:
+        if self.root:
+            try:
+                path = os.path.relpath(path, self.root)
+            except ValueError:
+                pass # On another drive
+        return path.lower()
+
+    def add(self, path: str) -> None:
+        key = self._key(path)
+        with self._lock:
+            paths = self._paths.setdefault(key, [])
+            if path in paths:
+                return
+            paths.append(path)
+            if len(paths) == 1:
+                self._pending.append(key)
+
+    def remove(self, path: str) -> None:
+        key = self._key(path)
+        with self._lock:
+            paths = self._paths.get(key)
+            if paths is None or path not in paths:
+                return
+            paths.remove(path)
+            if not paths:
+                del self._paths[key]
+                self._stale = True
+
+    def replace(self, paths: Iterable[str]) -> None:
+        """Makes paths the only indexed paths"""
+        by_key: dict[str, list[str]] = {}
+        for path in paths:
+            same = by_key.setdefault(self._key(path), [])
+            if path not in same:
+                same.append(path)
+        with self._lock:
+            self._paths = by_key
+            self._pending = []
+            self._stale = True
+
+    def track(self, paths: Iterable[str]) -> Iterator[str]:
+        """Yields paths, adding each one to the index as it is discovered"""
+        for path in paths:
+            self.add(path)
+            yield path
+
+    def _get_haystack(self) -> str:
+        if self._stale:
+            self._haystack = "\n" + "".join(f"{key}\n" for key in self._paths)
+            self._stale = False
+            self._pending = []
+        elif self._pending:
+            self._haystack += "".join(f"{key}\n" for key in self._pending)
+            self._pending = []
+        return self._haystack
+
+    def search(self, query: str, limit: int = 10) -> list[str]:
+        """Paths containing every whitespace separated word of query, ignoring
+        case. Matches in the file name rank before matches in the directories,
+        and shorter paths before longer ones."""
+        words = query.lower().split()
+        if not words:
+            return []
+        # The longest word is usually the most selective to scan for
+        needle = max(words, key=len)
+        candidates: list[tuple[str, list[str]]] = []
+        with self._lock:
+            haystack = self._get_haystack()
+            pos = haystack.find(needle)
+            n_scanned = 0
+            while pos != -1 and n_scanned < MAX_CANDIDATES:
+                start = haystack.rfind("\n", 0, pos) + 1
+                end = haystack.find("\n", pos)
+                key = haystack[start:end]
+                if all(w in key for w in words):
+                    candidates.append((key, self._paths[key]))
+                n_scanned += 1
+                pos = haystack.find(needle, end)
+
+        def rank(key: str) -> tuple:
+            name = os.path.basename(key)
+            return (not all(w in name for w in words), not name.startswith(words[0]), len(key), key)
+        candidates.sort(key=lambda c: rank(c[0]))
+        return [path for _, paths in candidates for path in paths][:limit]
@@ -0,0 +1,43 @@
+from string import Formatter
+from typing import Optional
+
+from langchain.prompts import PromptTemplate
+from langchain.chains.qa_with_sources import stuff_prompt
+
+# Prompt templates
+LEAN = "lean" # Instructions only, see LEAN_TEMPLATE
+LANGCHAIN = "langchain" # LangChain's default, with two long few-shot examples
+PROMPT_TEMPLATES = (LEAN, LANGCHAIN)
+
+# The answer has to end with the SOURCES line parsed by query.get_sources_from_answer
+LEAN_TEMPLATE = """Answer the question using only the extracts below, in the language of the question. \
+If they do not contain the answer, say that you don't know.
+End with a line "SOURCES: " followed by the comma separated sources of the extracts you used.
+
+{summaries}
+
+QUESTION: {question}
+ANSWER:"""
+
+INPUT_VARIABLES = ("summaries", "question")
+
+def is_custom_template(template: str) -> bool:
+    """Anything but the names in PROMPT_TEMPLATES is a template, which has to use 
+    every input variable and no other placeholders"""
+    if not isinstance(template, str) or template in PROMPT_TEMPLATES:
+        return False
+    try:
+        fields = {field for _, field, _, _ in Formatter().parse(template) if field is not None}
+    except ValueError: # Unbalanced braces
+        return False
+    return fields == set(INPUT_VARIABLES)
+
+def get_prompt(template: Optional[str]) -> PromptTemplate:
+    """The prompt for LEAN, LANGCHAIN or a custom template"""
+    if template is None or template == LEAN:
+        template = LEAN_TEMPLATE
+    elif template == LANGCHAIN:
+        return stuff_prompt.PROMPT
+    elif not is_custom_template(template):
+        raise ValueError(f"Prompt template has to use {', '.join(INPUT_VARIABLES)} and no other placeholders: {template!r}")
+    return PromptTemplate(template=template, input_variables=list(INPUT_VARIABLES))
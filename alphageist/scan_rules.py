@@ -0,0 +1,113 @@
+from __future__ import annotations
+import re
+from typing import Optional
+from collections.abc import Iterable
+
+from alphageist import config as cfg
+
+def glob_to_regex(pattern: str) -> str:
+    """Translates a gitignore style glob to a regex matching a relative
+    path using '/' as separator.
+
+    '*' and '?' do not match '/', '**' matches across directories. Patterns
+    containing a '/' are anchored to the root, others match the name at any
+    depth."""
+    anchored = "/" in pattern
+    pattern = pattern.lstrip("/")
+    i, n = 0, len(pattern)
+    regex = ""
+    while i < n:
+        c = pattern[i]
+        if c == "*":
+            if pattern[i:i + 3] == "**/":
+                regex += "(?:.*/)?"
+                i += 3
+                continue
+            if pattern[i:i + 2] == "**":
+                regex += ".*"
+                i += 2
+                continue
+            regex += "[^/]*"
+        elif c == "?":
+            regex += "[^/]"
+        elif c == "[":
+            j = pattern.find("]", i + 1)
+            if j == -1:
+                regex += re.escape(c)
+            else:
+                content = pattern[i + 1:j]
+                if content.startswith("!"):
+                    content = "^" + content[1:]
+                regex += f"[{content}]"
+                i = j
+        else:
+            regex += re.escape(c)
+        i += 1
+    prefix = "" if anchored else "(?:.*/)?"
+    return f"^{prefix}{regex}$"
+
+class _Rule:
+    regex: re.Pattern
+    negate: bool
+    dir_only: bool
+
+    def __init__(self, pattern: str):
+        self.negate = pattern.startswith("!")
+        if self.negate:
+            pattern = pattern[1:]
+        self.dir_only = pattern.endswith("/")
+        self.regex = re.compile(glob_to_regex(pattern.rstrip("/")))
+
+    def matches(self, rel_path: str, is_dir: bool) -> bool:
+        if self.dir_only and not is_dir:
+            return False
+        return self.regex.match(rel_path) is not None
+
+class ScanRules:
+    """Decides which directories are walked and which files are indexed.
+
+    Exclude patterns follow gitignore semantics where the last matching
+    pattern wins and '!' re-includes. If include patterns are given, a file
+    has to match one of them. Directories are pruned as soon as they are
+    excluded or deeper than max_depth, so they are never listed."""
+    max_file_size: Optional[int]
+    max_depth: Optional[int]
+
+    def __init__(self,
+                 exclude: Iterable[str] = (),
+                 include: Iterable[str] = (),
+                 max_file_size_mb: float = 0,
+                 max_depth: int = 0):
+        self._exclude = [_Rule(p) for p in exclude if p.strip() and not p.startswith("#")]
+        self._include = [_Rule(p) for p in include if p.strip()]
+        self.max_file_size = int(max_file_size_mb * 1024 * 1024) if max_file_size_mb > 0 else None
+        self.max_depth = max_depth if max_depth > 0 else None
+
+    @classmethod
+    def from_config(cls, config: cfg.Config) -> ScanRules:
+        return cls(exclude=config.get(cfg.EXCLUDE_PATTERNS, []),
+                   include=config.get(cfg.INCLUDE_PATTERNS, []),
+                   max_file_size_mb=config.get(cfg.MAX_FILE_SIZE_MB, 0),
+                   max_depth=config.get(cfg.MAX_DEPTH, 0))
+
+    def _is_excluded(self, rel_path: str, is_dir: bool) -> bool:
+        excluded = False
+        for rule in self._exclude:
+            if rule.matches(rel_path, is_dir):
+                excluded = not rule.negate
+        return excluded
+
+    def walk_dir(self, rel_path: str, depth: int) -> bool:
+        """Whether the directory at rel_path (depth 1 = directly under the root) should be walked"""
+        if self.max_depth is not None and depth > self.max_depth:
+            return False
+        return not self._is_excluded(rel_path, is_dir=True)
+
+    def include_file(self, rel_path: str, size: Optional[int] = None) -> bool:
+        if self._is_excluded(rel_path, is_dir=False):
+            return False
+        if self._include and not any(rule.matches(rel_path, is_dir=False) for rule in self._include):
+            return False
+        if self.max_file_size is not None and size is not None and size > self.max_file_size:
+            return False
+        return True
@@ -45,6 +45,9 @@ class DESIGN:
     RESULT_WIN_HEIGHT = 300
     RESULT_WIN_TEXT_MARGIN = 10
 
+    FILE_RESULTS_MAX = 5
+    FILE_RESULT_WIN_HEIGHT = 130
+
     SEARCH_BAR_FONT_SIZE = "16px"
 
 
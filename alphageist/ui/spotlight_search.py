@@ -58,6 +58,7 @@ from alphageist import state
 from alphageist import errors
 from alphageist import constant
 from alphageist.alphageist import Alphageist
+from alphageist.util import LoadingContext
 from alphageist.ui import util
 from langchain.vectorstores.base import VectorStore
 from langchain.schema import LLMResult
@@ -89,6 +90,10 @@ def _get_image_path_by_filename(filename: str) -> str:
     _, file_extension = os.path.splitext(filename)
     return _icon_by_filetype.get(file_extension, _icon_by_filetype["default"])
 
+def _get_coverage_text(ctx: LoadingContext) -> str:
+    total = ctx.total_files if ctx.total_files is not None else f"{ctx.files_found}+"
+    return f"Indexing in progress, answer based on {ctx.files_indexed} of {total} files"
+
 class SearchBar(QLineEdit):
     def __init__(self):
         super().__init__()
@@ -276,6 +281,31 @@ class ResultWindow(QTextBrowser):
     def set_text(self, text:str)->None:
         self.setHtml(self.HTML % text)
 
+class FileResultWindow(ResultWindow):
+    """Lists the files whose path matches the search bar text while typing"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.setFixedHeight(DESIGN.FILE_RESULT_WIN_HEIGHT)
+
+    def set_files(self, file_paths: list[str])->None:
+        if not file_paths:
+            self.setVisible(False)
+            return
+        rows = ""
+        for file_path in file_paths:
+            icon_path = util.resource_path(os.path.join(
+                ASSETS_DIRECTORY, _get_image_path_by_filename(file_path)))
+            rows += f"""
+            <tr>
+                <td style='padding-right: 4px;'>
+                    <img src='{icon_path}' style='vertical-align: middle;' />
+                </td>
+                <td>
+                    <a href='{file_path}'>{os.path.basename(file_path)}</a>
+                </td>
+            </tr>"""
+        self.set_text(f"<table>{rows}</table>")
+        self.setVisible(True)
     
 class SpotlightSearch(QWidget):
 
@@ -311,8 +341,10 @@ class SpotlightSearch(QWidget):
         # Set up the user interface
         layout = QVBoxLayout()
         self.bar_container = BarContainer()
+        self.create_file_result_window()
         self.create_result_window()
         layout.addWidget(self.bar_container)
+        layout.addWidget(self.file_result_window)
         layout.addWidget(self.result_window)
         layout.addStretch()
         self.setLayout(layout)
@@ -330,13 +362,21 @@ class SpotlightSearch(QWidget):
         # Options button drop down menu
         settings_action = QAction("Settings", self)
         settings_action.triggered.connect(self.show_settings)
+        refresh_action = QAction("Refresh index", self)
+        refresh_action.triggered.connect(self.refresh_index)
+        rebuild_action = QAction("Rebuild index", self)
+        rebuild_action.triggered.connect(self.rebuild_index)
         close_action = QAction("Exit", self)
         close_action.triggered.connect(self.close)
         self.bar_container.search_bar_container.optn_btn.context_menu.addAction(settings_action)
+        self.bar_container.search_bar_container.optn_btn.context_menu.addAction(refresh_action)
+        self.bar_container.search_bar_container.optn_btn.context_menu.addAction(rebuild_action)
         self.bar_container.search_bar_container.optn_btn.context_menu.addAction(close_action)
 
         # Hotkey for start search
         self.bar_container.search_bar_container.search_bar.returnPressed.connect(self.start_search)
+        # Matching file names are shown while typing, before any answer
+        self.bar_container.search_bar_container.search_bar.textChanged.connect(self.update_file_results)
 
     def init_callback(self):
         self.raw_response = []
@@ -381,14 +421,18 @@ class SpotlightSearch(QWidget):
             self.set_search_bar_disabled()
             self.alphageist.start_init_vectorstore()
         if new_state is state.LOADING_VECTORSTORE:
-            self.set_search_bar_disabled()
-            self.bar_container.search_bar_container.search_bar.setText("")
-            self.bar_container.search_bar_container.search_bar.set_alternating_placeholder_text(
-                ["Loading.", "Loading..", "Loading..."], 300)
+            if self.alphageist.config.get(cfg.SEARCH_WHILE_INDEXING, False):
+                self.set_search_bar_indexing()
+            else:
+                self.set_search_bar_disabled()
+            if old_state is not state.QUERYING:
+                self.bar_container.search_bar_container.search_bar.setText("")
+                self.bar_container.search_bar_container.search_bar.set_alternating_placeholder_text(
+                    ["Loading.", "Loading..", "Loading..."], 300)
         if new_state is state.STANDBY:
             self.set_search_bar_stand_by()
         if new_state is state.QUERYING:
-            self.set_search_bar_disabled()
+            self.set_search_bar_querying()
         if new_state is state.ERROR:
             self._handle_error_state()            
 
@@ -427,7 +471,15 @@ class SpotlightSearch(QWidget):
                 </tr>"""
             search_result_text += "</table>"
 
+        ctx = self.alphageist.get_indexing_ctx()
+        if ctx is not None:
+            search_result_text += f"<br><br><i>{_get_coverage_text(ctx)}</i>"
+
         self.update_search_results(search_result_text)
+        self.reset_answer()
+
+    def reset_answer(self) -> None:
+        """Forgets the streamed answer, e.g. of a cancelled query"""
         self.muted = False
         self.raw_response = []
 
@@ -456,12 +508,36 @@ class SpotlightSearch(QWidget):
                 30)
         self.bar_container.search_bar_container.search_bar.setEnabled(True)
 
+    @pyqtSlot()
+    @util.force_main_thread()
+    def set_search_bar_indexing(self)->None:
+        """Search is possible against the files indexed so far"""
+        self.bar_container.search_bar_container.optn_btn.set_error_frame(False)
+        self.bar_container.search_bar_container.search_bar.setEnabled(True)
+
+    @pyqtSlot()
+    @util.force_main_thread()
+    def set_search_bar_querying(self)->None:
+        """A new search replaces the running one"""
+        self.bar_container.search_bar_container.optn_btn.set_error_frame(False)
+        self.bar_container.search_bar_container.search_bar.setEnabled(True)
+
     @pyqtSlot(str)
     @util.force_main_thread()
     def set_search_bar_disabled(self)->None:
         self.bar_container.search_bar_container.optn_btn.set_error_frame(False)
         self.bar_container.search_bar_container.search_bar.setEnabled(False)
     
+    def create_file_result_window(self):
+        self.file_result_window = FileResultWindow()
+        self.file_result_window.setVisible(False)
+        self.file_result_window.anchorClicked.connect(util.open_file_link)
+
+    def update_file_results(self, text: str):
+        if not hasattr(self, "alphageist"):
+            return # Text set before alphageist is created
+        self.file_result_window.set_files(self.alphageist.search_files(text, DESIGN.FILE_RESULTS_MAX))
+
     def create_result_window(self):
         self.result_window = ResultWindow()
         self.result_window.setVisible(False)  # Hide search result initially
@@ -495,11 +571,14 @@ class SpotlightSearch(QWidget):
             self.result_window.setVisible(False)
             return
         try:
+            self.reset_answer() # Of a query replaced by this one
             self.alphageist.start_search(query_string, callbacks=[self.callback])
         except errors.MissingConfigError:
             self.set_search_bar_error_message("No config loaded :/")
         except errors.MissingVectorstoreError:
             self.set_search_bar_error_message("No vectorstore loaded :/")
+        except errors.IndexNotReadyError:
+            self.update_search_results("Nothing has been indexed yet, try again in a moment")
         except ValueError:
             logger.warning("Tried to start query with empty query string")    
         except errors.InvalidStateError as e:
@@ -510,6 +589,22 @@ class SpotlightSearch(QWidget):
         else:
             logger.info(f"starting search for: {query_string}")
 
+    def cancel_search(self):
+        self.alphageist.cancel_search()
+        self.reset_answer()
+
+    def refresh_index(self):
+        try:
+            self.alphageist.start_update_vectorstore()
+        except errors.InvalidStateError as e:
+            logger.warning(f"Unable to refresh index: {e}")
+
+    def rebuild_index(self):
+        try:
+            self.alphageist.start_rebuild_vectorstore()
+        except errors.InvalidStateError as e:
+            logger.warning(f"Unable to rebuild index: {e}")
+
     def show_settings(self):
         # If the settings dialog already exists, show it and don't create a new
         if self.settings_dialog is None:
@@ -526,6 +621,13 @@ class SpotlightSearch(QWidget):
         if config_changed:
            self.alphageist.on_config_changed() 
 
+    def keyPressEvent(self, event):
+        # Escape is not used by the search bar, which passes it on
+        if event.key() == Qt.Key.Key_Escape:
+            self.cancel_search()
+        else:
+            super().keyPressEvent(event)
+
     def mousePressEvent(self, event):
         self.mpos = event.globalPosition().toPoint()
 
@@ -1,25 +1,81 @@
 import logging
 import threading
+import time
 import typing
 from pathlib import Path
 import os 
 import codecs
 import functools
+from collections import OrderedDict
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from alphageist import state as s
 from alphageist import constant
 from alphageist import errors
 
 
 logger = logging.getLogger(constant.LOGGER_NAME)
+
+CANCEL_POLL_S = 0.1 # How often blocking waits check whether loading has been cancelled
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough number of tokens in text, around 4 characters per token for
+    English. Avoids loading a tokenizer, which has to be downloaded."""
+    return len(text) // 4 + 1
+
+TOKENIZER_ENCODING = "cl100k_base" # Used by gpt-4, gpt-3.5-turbo and the ada-002 embeddings
+
+_tokenizer: typing.Any = None # Set once loaded, see load_tokenizer
+_tokenizer_loading = False
+_tokenizer_lock = threading.Lock()
+
+def load_tokenizer() -> bool:
+    """Loads the tokenizer used by count_tokens and returns whether it could
+    be. tiktoken downloads its encoding on first use without a timeout, so 
+    this can block for long when offline, see start_loading_tokenizer."""
+    global _tokenizer
+    if _tokenizer is None:
+        try:
+            import tiktoken
+            _tokenizer = tiktoken.get_encoding(TOKENIZER_ENCODING)
+        except Exception as e:
+            logger.warning(f"Unable to load the {TOKENIZER_ENCODING} tokenizer, estimating tokens instead: {e!r}")
+    return _tokenizer is not None
+
+def start_loading_tokenizer() -> None:
+    """Loads the tokenizer in a background thread, once"""
+    global _tokenizer_loading
+    with _tokenizer_lock:
+        if _tokenizer_loading:
+            return
+        _tokenizer_loading = True
+    threading.Thread(target=load_tokenizer, name="tokenizer", daemon=True).start()
+
+def count_tokens(text: str) -> int:
+    """Number of tokens in text using tiktoken. Never waits for the tokenizer:
+    until it has been loaded, see start_loading_tokenizer, or if it can not 
+    be, the tokens are estimated."""
+    tokenizer = _tokenizer
+    if tokenizer is None:
+        return estimate_tokens(text)
+    return len(tokenizer.encode(text, disallowed_special=()))
+
 class LoadingContext:
     _lock: threading.Lock
-    total_files: typing.Optional[int]
+    total_files: typing.Optional[int] # None while the directory is still being scanned
+    files_found: int
     current_file: typing.Optional[str]
     cancel_event: threading.Event
     def __init__(self):
         self._lock = threading.Lock()
         self.total_files = 1
+        self.files_found = 0
         self.files_loaded = 0
+        self._files_indexed = 0
+        self._chunks_embedded = 0
+        self._tokens_embedded = 0
+        self._embedding_started: typing.Optional[float] = None
         self.current_file = None
         self.cancel_event = threading.Event()
 
@@ -33,12 +89,134 @@ class LoadingContext:
         with self._lock:
             self._files_loaded = value
 
+    @property
+    def files_indexed(self) -> int:
+        """Files whose chunks have all been written to the vectorstore"""
+        with self._lock:
+            return self._files_indexed
+
+    def add_files_indexed(self, n: int = 1):
+        with self._lock:
+            self._files_indexed += n
+
+    def add_embedded(self, n_chunks: int, n_tokens: int):
+        with self._lock:
+            if self._embedding_started is None:
+                self._embedding_started = time.monotonic()
+            self._chunks_embedded += n_chunks
+            self._tokens_embedded += n_tokens
+
+    @property
+    def chunks_embedded(self) -> int:
+        with self._lock:
+            return self._chunks_embedded
+
+    @property
+    def tokens_embedded(self) -> int:
+        """Estimated, see estimate_tokens"""
+        with self._lock:
+            return self._tokens_embedded
+
+    def _rate(self, n: int) -> float:
+        if self._embedding_started is None:
+            return 0.0
+        return n / max(time.monotonic() - self._embedding_started, 1e-3)
+
+    @property
+    def chunks_per_sec(self) -> float:
+        with self._lock:
+            return self._rate(self._chunks_embedded)
+
+    @property
+    def tokens_per_sec(self) -> float:
+        with self._lock:
+            return self._rate(self._tokens_embedded)
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def is_cancelled(self) -> bool:
+        return self.cancel_event.is_set()
+
+def wait_result(future: Future, ctx: typing.Optional[LoadingContext]) -> typing.Any:
+    """Returns the result of future, or raises LoadingCancelled as soon as ctx 
+    is cancelled. The work in flight is abandoned rather than waited for."""
+    if ctx is None:
+        return future.result()
+    while True:
+        try:
+            return future.result(timeout=CANCEL_POLL_S)
+        except FutureTimeoutError:
+            if ctx.is_cancelled():
+                raise errors.LoadingCancelled
+
+class QueryContext:
+    """Handle of a running query, see Alphageist.start_search. Cancelling it
+    cancels the task running the query, which aborts retrieval and closes 
+    the LLM stream wherever it is waiting. Callbacks still to come are 
+    stopped by the cancel event."""
+    query: str
+    cancel_event: threading.Event
+    _future: typing.Optional[Future] # Of the task running the query
+    def __init__(self, query: str):
+        self.query = query
+        self.cancel_event = threading.Event()
+        self._future = None
+
+    def set_future(self, future: Future) -> None:
+        self._future = future
+        if self.is_cancelled():
+            future.cancel()
+
     def cancel(self):
         self.cancel_event.set()
+        if self._future is not None:
+            self._future.cancel()
 
     def is_cancelled(self) -> bool:
         return self.cancel_event.is_set()
 
+    def raise_if_cancelled(self) -> None:
+        if self.is_cancelled():
+            raise errors.QueryCancelled
+
+class LRUCache:
+    """Thread safe mapping keeping the maxsize most recently used items"""
+    maxsize: int
+    _data: OrderedDict
+    _lock: threading.Lock
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: typing.Hashable, default: typing.Any = None) -> typing.Any:
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key: typing.Hashable, value: typing.Any) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key: typing.Hashable) -> bool:
+        with self._lock:
+            return key in self._data
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
+
 def set_logging_level(level: str):
     levels = logging._nameToLevel
     logger = logging.getLogger(constant.LOGGER_NAME)
@@ -49,6 +227,14 @@ def set_logging_level(level: str):
 def string_to_raw_string(s: str)->str:
     return codecs.unicode_escape_encode(s)[0].decode()
 
+def raw_string_to_string(s: str)->str:
+    """Reverses string_to_raw_string. Text with invalid escapes, which 
+    string_to_raw_string never produces, is returned as is."""
+    try:
+        return codecs.unicode_escape_decode(s)[0]
+    except UnicodeDecodeError:
+        return s
+
 def is_temp_file(file_path:str) -> bool:
     """Check if a file might be a temporary file by its prefix."""
     temp_prefixes = ['~', '.~']
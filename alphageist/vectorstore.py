@@ -1,7 +1,17 @@
 import os
+import time
+import asyncio
+import uuid
+import sqlite3
 import threading
 import logging
-from typing import Optional
+from pathlib import Path
+from typing import (
+    Callable,
+    Optional,
+)
+from collections.abc import Iterable
+from concurrent.futures import Future, CancelledError
 from platformdirs import user_config_dir
 
 from langchain.embeddings.base import Embeddings
@@ -9,17 +19,50 @@ from langchain.vectorstores.base import VectorStore as LangchainVectorstore
 from langchain.callbacks.base import BaseCallbackHandler
 from langchain.indexes.vectorstore import VectorStoreIndexWrapper
 from langchain.chains import RetrievalQAWithSourcesChain
+from langchain.schema import LLMResult, Generation
 from langchain_community.vectorstores import Qdrant
 from langchain_openai import OpenAIEmbeddings
 from langchain_openai import ChatOpenAI
+from langchain_core.runnables.config import run_in_executor
 
-from qdrant_client import QdrantClient
+from qdrant_client import QdrantClient, AsyncQdrantClient
 
-from alphageist.doc_generator import get_docs_from_path
-from alphageist.custom_retriever import MultiStoreRetreiver
+from alphageist.doc_generator import (
+    get_supported_file_paths,
+    get_workers,
+)
+from alphageist.manifest import (
+    Checkpoint,
+    Manifest,
+)
+from alphageist.scan_rules import ScanRules
+from alphageist.path_index import PathIndex
+from alphageist.answer_cache import AnswerCache, CachedAnswer
+from alphageist.circuit_breaker import CircuitBreaker
+from alphageist.prompt import LEAN, get_prompt
+from alphageist.callbackhandler import CancelQueryHandler
+from alphageist import indexing
+from alphageist import event_loop
+from alphageist.local_index import (
+    LocalIndex,
+    create_local_index,
+    NUMPY,
+    NO_QUANTIZATION,
+)
+from alphageist.embedding_cache import (
+    CachedEmbeddings,
+    EmbeddingCache,
+)
+from alphageist.custom_retriever import (
+    HYBRID,
+    KEYWORD,
+    MultiStoreRetreiver,
+    QUERY_VECTOR_CACHE_SIZE,
+)
 from alphageist.util import (
     allowed_states,
     LoadingContext,
+    LRUCache,
 )
 from alphageist import util
 from alphageist import state
@@ -30,48 +73,127 @@ import alphageist.config as cfg
 
 logger = logging.getLogger(constant.LOGGER_NAME)
 
-COLLECTION_NAME = "alphageist"
 REMOTE_COLLECTION_NAME = "materials"
+CANCEL_TIMEOUT_S = 5.0 # Max time reset waits for background indexing to stop
+EMBEDDING_REQUEST_TIMEOUT_S = 60.0
+CONTEXT_CANDIDATES = 12 # Chunks retrieved to be packed into the CONTEXT_TOKENS budget
+REMOTE_REQUEST_TIMEOUT_S = 10 # Bounds how long a remote search that is not waited for anymore keeps running
+
+# The query chain is recreated when any of these change
+QUERY_CONFIG_KEYS = (
+    cfg.LLM_MODEL_NAME,
+    cfg.LLM_TEMPERATURE,
+    cfg.API_KEY_OPEN_AI,
+    cfg.RETRIEVAL_TIMEOUT_S,
+    cfg.RETRIEVAL_MODE,
+    cfg.CONTEXT_TOKENS,
+    cfg.PROMPT_TEMPLATE,
+    cfg.REMOTE_STORE_ENABLED,
+    cfg.REMOTE_STORE_LATENCY_BUDGET_S,
+)
+
+# The embeddings are recreated when any of these change
+EMBEDDING_CONFIG_KEYS = (
+    cfg.API_KEY_OPEN_AI,
+    cfg.EMBEDDING_CACHE_SIZE_MB,
+)
+
+# The answer cache is recreated when any of these change
+ANSWER_CACHE_CONFIG_KEYS = (
+    cfg.ANSWER_CACHE_SIZE,
+    cfg.ANSWER_CACHE_MAX_AGE_H,
+)
+
+# Which files are indexed
+SCAN_CONFIG_KEYS = (
+    cfg.SEARCH_DIRS,
+    cfg.EXCLUDE_PATTERNS,
+    cfg.INCLUDE_PATTERNS,
+    cfg.MAX_FILE_SIZE_MB,
+    cfg.MAX_DEPTH,
+)
 
 class VectorStore(util.StateSubscriptionMixin):
     exception: Exception
-    store: Optional[Qdrant]
+    index: Optional[LocalIndex]
+    store: Optional[LangchainVectorstore]
     emb: Embeddings
     loading_ctx: Optional[LoadingContext]
+    manifest: Optional[Manifest]
+    paths: PathIndex
+    answer_cache: Optional[AnswerCache]
     _thread: threading.Thread
+    _update_thread: Optional[threading.Thread]
+    _manifest_path: Optional[Path]
+    _retired_index: Optional[tuple[LocalIndex, bool]] # Replaced index, which queries may still search, and whether to destroy it
+    _query_vector_cache: LRUCache
+    _remote_store: Optional[Qdrant]
+    _remote_breaker: CircuitBreaker
+    _chain: Optional[RetrievalQAWithSourcesChain]
+    _chain_key: Optional[tuple]
 
     def __init__(self):
         super().__init__()
         self._state = state.NEW
         self.loading_ctx = None
+        self.emb = None # type: ignore
+        self.index = None
         self.store = None
+        self.manifest = None
+        self.paths = PathIndex()
+        self.answer_cache = None
         self._thread = None
+        self._update_thread = None
+        self._manifest_path = None
+        self._retired_index = None
+        self._query_vector_cache = LRUCache(QUERY_VECTOR_CACHE_SIZE)
+        self._remote_store = None
+        # Kept when the chain is recreated, so that a failing remote store stays skipped
+        self._remote_breaker = CircuitBreaker("remote store", probe=self._probe_remote_store)
+        self._chain = None
+        self._chain_key = None
+        self._chain_lock = threading.Lock()
         
     def is_created(self)->bool:
-        if self.store is None:
+        """A vectorstore is only created if it has been completely indexed,
+        which is marked by the manifest being saved"""
+        if self.index is None or self.manifest is None:
             return False
-        if not COLLECTION_NAME in [c.name for c in self.store.client.get_collections().collections]:
-            return False
-        if not self.store.client.count(COLLECTION_NAME).count > 0:
-            return False
-        return True
+        return self.index.count() > 0
+
+    def is_searchable(self)->bool:
+        """True if there is anything to query. While the vectorstore is being 
+        created this is the case as soon as the first batch has been upserted"""
+        return self.index is not None and self.index.count() > 0
 
     @allowed_states({state.NEW})
     def start_init_vectorstore(self, config:cfg.Config, emb:Optional[Embeddings]=None):
         self.loading_ctx = LoadingContext()
-        self.emb = get_embeddings(config) if emb is None else emb
-        if self.store is not None: 
-            del self.store
-            self.store = None
-        client = QdrantClient(path=config[cfg.VECTORDB_DIR], prefer_grpc=True)  
-        self.store = Qdrant(client=client, collection_name=COLLECTION_NAME, embeddings=self.emb)  
+        old_emb, self.emb = self.emb, get_embeddings(config) if emb is None else emb
+        if old_emb is not None and old_emb is not self.emb:
+            close_embeddings(old_emb)
+        self._query_vector_cache.clear()
+        self._clear_query_clients()
+        self._set_answer_cache(get_answer_cache(config))
+        self._release_retired_index()
+        if self.index is not None: 
+            self.index.close()
+        self.index = create_local_index(config.get(cfg.LOCAL_INDEX_BACKEND, NUMPY),
+                                        config[cfg.VECTORDB_DIR],
+                                        self.emb,
+                                        config.get(cfg.VECTOR_QUANTIZATION, NO_QUANTIZATION))
+        self.store = self.index.store
+        # Each index version keeps its own manifest so that switching backend triggers a full index
+        self._manifest_path = self.index.manifest_path
+        self.manifest = Manifest.load(self._manifest_path)
+        self.paths = PathIndex(config[cfg.SEARCH_DIRS], self.manifest.files if self.manifest is not None else ())
 
         self.state = state.LOADING
 
-        vector_db_path = config[cfg.VECTORDB_DIR]
-
         if self.is_created():
             self.state = state.LOADED
+            self.start_warm_up(config)
+            self.start_update_vectorstore(config)
         else:
             self._thread = threading.Thread(target=self._create_vectorstore, args = (config,))
             self._thread.daemon = True # Should this really be true?
@@ -79,42 +201,313 @@ class VectorStore(util.StateSubscriptionMixin):
 
     def _create_vectorstore(self, config: cfg.Config) -> None:
         search_dir = config[cfg.SEARCH_DIRS]
+        rules = ScanRules.from_config(config)
+        file_paths = self.paths.track(get_supported_file_paths(search_dir, self.loading_ctx, rules))
+
+        checkpoint = Checkpoint(self._manifest_path) # type: ignore
+        resume = checkpoint.exists() and self.index.exists() # type: ignore
+        logger.info(f"{'Resuming' if resume else 'Creating'} vectorstore for {search_dir} using {self.emb.__class__.__name__}")
         try:
-            docs = get_docs_from_path(search_dir, self.loading_ctx)
+            if resume:
+                file_paths = self._resume_from_checkpoint(checkpoint, file_paths)
+            else:
+                checkpoint.remove()
+            indexing.index_files(file_paths,
+                                 index=self.index,
+                                 emb=self.emb,
+                                 ctx=self.loading_ctx,
+                                 recreate=not resume,
+                                 checkpoint=checkpoint,
+                                 **get_indexing_args(config))
         except errors.LoadingCancelled:
             logger.info("Loading vectorstore cancelled")
             return
-        if not docs:
+        except Exception as e:
+            logger.exception(f"Unable to create vectorstore: {str(e)}")
+            self.exception = e
+            self.state = state.ERROR
+            return
+
+        manifest = checkpoint.manifest
+        n_chunks = sum(len(entry.chunk_ids) for entry in manifest.files.values())
+        if not n_chunks:
+            checkpoint.remove()
             self.exception = errors.NoSupportedFilesInDirectoryError(search_dir)
             self.state = state.ERROR 
             return
 
-        vector_db_dir = config[cfg.VECTORDB_DIR]
+        # Saving the manifest marks the vectorstore as complete
+        manifest.save(self._manifest_path)
+        checkpoint.remove()
+        self.manifest = manifest
 
-        logger.info(f"Creating vectorstore for {len(docs)} documents using {self.emb.__class__.__name__}")
-        del self.store
-        self.store = None
+        logger.info(f"Vectorstore successfully created with {n_chunks} chunks")
+        self.state = state.LOADED
+        self.start_warm_up(config)
+
+    def _resume_from_checkpoint(self, checkpoint: Checkpoint, file_paths: Iterable[str]) -> list[str]:
+        """Removes what the interrupted run upserted without completing and
+        returns the files that still have to be indexed"""
+        done = checkpoint.manifest
+        diff = done.diff(file_paths)
+        stale_ids = checkpoint.orphan_ids() + done.chunk_ids(diff.modified + diff.deleted)
+        if stale_ids:
+            self.index.delete_points(stale_ids) # type: ignore
+        for file_path in diff.modified + diff.deleted:
+            done.remove(file_path)
+        checkpoint.save()
+        to_index = diff.added + diff.modified
+        logger.info(f"Resuming with {len(done)} files already indexed, {len(to_index)} left")
+        self.loading_ctx.total_files = len(done) + len(to_index) # type: ignore
+        self.loading_ctx.add_files_indexed(len(done)) # type: ignore
+        return to_index
+
+    @allowed_states({state.LOADED})
+    def start_update_vectorstore(self, config: cfg.Config) -> None:
+        """Starts indexing added and modified files and removing deleted
+        files in the background. The vectorstore can be queried meanwhile."""
+        if self._update_thread is not None and self._update_thread.is_alive():
+            logger.info("Vectorstore update already in progress")
+            return
+        self.loading_ctx = LoadingContext()
+        self._update_thread = threading.Thread(target=self._update_vectorstore, args=(config,))
+        self._update_thread.daemon = True
+        self._update_thread.start()
+
+    def _restart_background_task(self, target: Callable, *args) -> None:
+        """Cancels the running update or rebuild and runs target(*args) in the
+        background once it has stopped"""
+        previous = self._update_thread
+        if previous is not None and previous.is_alive():
+            self.loading_ctx.cancel() # type: ignore
+        self.loading_ctx = LoadingContext()
+
+        def run():
+            if previous is not None:
+                previous.join()
+            target(*args)
+        self._update_thread = threading.Thread(target=run)
+        self._update_thread.daemon = True
+        self._update_thread.start()
+
+    @allowed_states({state.LOADED})
+    def reconfigure(self, old_config: cfg.Config, new_config: cfg.Config) -> None:
+        """Applies a config change without re-embedding what is already indexed.
+
+        Client settings only recreate the clients. Changed search dirs or scan 
+        rules index the files that are now included and remove those that are 
+        not, in the background while the vectorstore keeps serving queries."""
+        changed = {key for key in set(old_config) | set(new_config) if old_config.get(key) != new_config.get(key)}
+        logger.info(f"Reconfiguring vectorstore, changed: {sorted(changed)}")
+        if changed & set(EMBEDDING_CONFIG_KEYS):
+            emb = get_embeddings(new_config)
+            with self._chain_lock:
+                old_emb, self.emb = self.emb, emb
+                self._chain = None
+            close_embeddings(old_emb)
+        if changed & set(QUERY_CONFIG_KEYS + EMBEDDING_CONFIG_KEYS):
+            self.start_warm_up(new_config)
+        if changed & set(ANSWER_CACHE_CONFIG_KEYS):
+            self._set_answer_cache(get_answer_cache(new_config))
+
+        reopen_index = cfg.VECTOR_QUANTIZATION in changed and \
+            new_config.get(cfg.LOCAL_INDEX_BACKEND, NUMPY) == NUMPY
+        if reopen_index or changed & set(SCAN_CONFIG_KEYS):
+            self._restart_background_task(self._update_vectorstore, new_config, reopen_index)
+
+    def _reopen_index(self, config: cfg.Config) -> None:
+        """Opens the current index again, e.g. to quantize it differently"""
+        index = create_local_index(config.get(cfg.LOCAL_INDEX_BACKEND, NUMPY),
+                                   config[cfg.VECTORDB_DIR],
+                                   self.emb,
+                                   config.get(cfg.VECTOR_QUANTIZATION, NO_QUANTIZATION))
+        with self._chain_lock:
+            old_index = self.index
+            self.index = index
+            self.store = index.store
+            self._chain = None
+        self._retire_index(old_index, destroy=False) # type: ignore
+
+    def _update_vectorstore(self, config: cfg.Config, reopen_index: bool = False) -> None:
+        if reopen_index:
+            self._reopen_index(config)
+        if not self.index.keywords_in_sync(): # type: ignore
+            self.index.rebuild_keywords() # type: ignore
+        ctx = self.loading_ctx
+        search_dir = config[cfg.SEARCH_DIRS]
+        manifest = self.manifest
+        try:
+            file_paths = list(get_supported_file_paths(search_dir, ctx, ScanRules.from_config(config)))
+            self.paths = PathIndex(search_dir, file_paths)
+            diff = manifest.diff(file_paths, ctx)
+        except errors.LoadingCancelled:
+            logger.info("Updating vectorstore cancelled")
+            return
+        if not diff:
+            # Unless reset, which removes the manifest, while comparing
+            if not ctx.is_cancelled() and self.manifest is manifest: # type: ignore
+                logger.info("Vectorstore is up to date")
+                manifest.save(self._manifest_path) # Persist refreshed mtimes
+            return
+
+        logger.info(f"Updating vectorstore: {diff}")
+        to_index = diff.added + diff.modified
+        ctx.total_files = len(to_index) # type: ignore
+        upserted_ids: list[str] = []
+        content_hashes: dict[str, str] = {}
         try:
-            self.store = Qdrant.from_documents(docs, 
-                                           embedding=self.emb,
-                                           collection_name=COLLECTION_NAME, 
-                                           path=vector_db_dir)
-  
+            ids_by_file = indexing.index_files(to_index,
+                                               index=self.index,
+                                               emb=self.emb,
+                                               ctx=ctx,
+                                               recreate=False,
+                                               upserted_ids=upserted_ids,
+                                               content_hashes=content_hashes,
+                                               **get_indexing_args(config))
+            stale_ids = manifest.chunk_ids(diff.modified + diff.deleted)
+            if stale_ids:
+                self.index.delete_points(stale_ids)
+        except errors.LoadingCancelled:
+            logger.info("Updating vectorstore cancelled")
+            self._delete_unrecorded(upserted_ids)
+            return
         except Exception as e:
-            logger.exception(f"Unable to create vectorstore: {str(e)}")
-            self.exception = e
-            self.state = state.ERROR
+            logger.exception(f"Unable to update vectorstore: {str(e)}")
+            self._delete_unrecorded(upserted_ids)
+            return
+
+        if self.manifest is not manifest:
+            return # The vectorstore was reset while updating
+        for file_path in diff.deleted:
+            manifest.remove(file_path)
+        for file_path, ids in ids_by_file.items():
+            manifest.record(file_path, ids, content_hashes.get(file_path))
+        manifest.save(self._manifest_path)
+        self._invalidate_answers(diff.modified + diff.deleted)
+        logger.info("Vectorstore successfully updated")
+
+    def _delete_unrecorded(self, ids: list[str]) -> None:
+        """Deletes chunks of a failed update, which the manifest does not know
+        about. Left in the index they would be duplicates of the chunks of the
+        next update."""
+        if not ids:
+            return
+        try:
+            self.index.delete_points(ids) # type: ignore
+        except Exception:
+            logger.exception(f"Unable to delete {len(ids)} chunks of the failed update")
         else:
-            logger.info("Vectorstore successfully created")
-            self.state = state.LOADED
+            logger.info(f"Deleted {len(ids)} chunks of the failed update")
+
+    @allowed_states({state.LOADED})
+    def start_rebuild_vectorstore(self, config: cfg.Config, emb: Optional[Embeddings] = None) -> None:
+        """Indexes everything into a new version of the index in the background.
+        The current version keeps serving queries until the new one is complete
+        and replaces it. If the rebuild fails the current version is kept."""
+        emb = get_embeddings(config) if emb is None else emb
+        self._restart_background_task(self._rebuild_vectorstore, config, emb)
+
+    def _rebuild_vectorstore(self, config: cfg.Config, emb: Embeddings) -> None:
+        ctx = self.loading_ctx
+        search_dir = config[cfg.SEARCH_DIRS]
+        index = self.index.new_version(emb, config.get(cfg.VECTOR_QUANTIZATION, NO_QUANTIZATION)) # type: ignore
+        paths = PathIndex(search_dir)
+        logger.info(f"Rebuilding vectorstore for {search_dir} as version {index.version}")
+        content_hashes: dict[str, str] = {}
+        try:
+            ids_by_file = indexing.index_files(paths.track(get_supported_file_paths(search_dir, ctx, ScanRules.from_config(config))),
+                                               index=index,
+                                               emb=emb,
+                                               ctx=ctx,
+                                               content_hashes=content_hashes,
+                                               **get_indexing_args(config))
+            if not any(ids_by_file.values()):
+                raise errors.NoSupportedFilesInDirectoryError(search_dir)
+            manifest = Manifest()
+            for file_path, ids in ids_by_file.items():
+                manifest.record(file_path, ids, content_hashes.get(file_path))
+            manifest.save(index.manifest_path)
+        except errors.LoadingCancelled:
+            logger.info("Rebuilding vectorstore cancelled")
+            index.destroy()
+            return
+        except Exception as e:
+            logger.exception(f"Unable to rebuild vectorstore, keeping the current version: {str(e)}")
+            index.destroy()
+            return
+
+        if ctx is not self.loading_ctx or self.state is not state.LOADED:
+            index.destroy() # Reset or replaced by another rebuild meanwhile
+            return
+        self._swap_index(index, emb, manifest)
+        self.paths = paths
+        self.start_warm_up(config)
+        logger.info(f"Vectorstore successfully rebuilt with {sum(len(ids) for ids in ids_by_file.values())} chunks")
+
+    def _swap_index(self, index: LocalIndex, emb: Embeddings, manifest: Manifest) -> None:
+        # Making the new version current on disk is the commit point, if the app
+        # stops before that the old version is used and the new one removed
+        index.make_current()
+        old_index = self.index
+        with self._chain_lock:
+            self.index = index
+            self.store = index.store
+            old_emb, self.emb = self.emb, emb
+            self.manifest = manifest
+            self._manifest_path = index.manifest_path
+            self._chain = None
+        if old_emb is not emb:
+            close_embeddings(old_emb)
+        self._query_vector_cache.clear()
+        self._invalidate_answers()
+        self._retire_index(old_index, destroy=True) # type: ignore
+
+    def _retire_index(self, index: LocalIndex, destroy: bool) -> None:
+        """Closes, or destroys, a replaced index once the next one is replaced
+        or the vectorstore is reset. Queries started before it was replaced 
+        keep searching it meanwhile. Versions left when the app stops are 
+        removed when it starts, see create_local_index."""
+        self._release_retired_index()
+        self._retired_index = (index, destroy)
+
+    def _release_retired_index(self) -> None:
+        if self._retired_index is None:
+            return
+        index, destroy = self._retired_index
+        self._retired_index = None
+        try:
+            if destroy:
+                index.destroy()
+            else:
+                index.close()
+        except Exception:
+            logger.exception(f"Unable to release the replaced index version {index.version}")
+
+    def _join_background_threads(self, timeout: float) -> None:
+        """Waits up to timeout for cancelled background work to stop"""
+        deadline = time.monotonic() + timeout
+        for thread in (self._thread, self._update_thread):
+            if thread is None or thread is threading.current_thread():
+                continue
+            thread.join(max(deadline - time.monotonic(), 0))
+            if thread.is_alive():
+                logger.warning(f"Background indexing did not stop within {timeout}s")
 
     @allowed_states({state.LOADED, state.ERROR, state.NEW, state.LOADING})
     def reset(self):
         if self.loading_ctx is not None:
             self.loading_ctx.cancel() 
+            self._join_background_threads(CANCEL_TIMEOUT_S)
 
-        if self.store is not None:
-            self.store.client.delete_collection(collection_name=COLLECTION_NAME)
+        self._release_retired_index()
+        if self.index is not None:
+            self.index.drop()
+        if self._manifest_path is not None:
+            self._manifest_path.unlink(missing_ok=True)
+            Checkpoint(self._manifest_path).remove()
+        self.manifest = None
+        self.paths = PathIndex()
+        self._invalidate_answers()
         self.exception = None
         self.state = state.NEW
 
@@ -136,50 +529,263 @@ class VectorStore(util.StateSubscriptionMixin):
             self.state = state.ERROR
             raise err
 
-    @allowed_states({state.LOADED})
-    def query(self, 
-             config: cfg.Config, 
-             query_string: str, 
-             callbacks: list[BaseCallbackHandler] = [] ) -> dict:
-        
-        streaming = bool(callbacks)
+    def _get_remote_store(self) -> Qdrant:
+        """The remote client is created once so its gRPC channel is reused between queries"""
+        if self._remote_store is None:
+            client_args = dict(url=constant.QDRANT_CLOUD_URL,
+                               api_key=constant.QDRANT_CLOUD_KEY,
+                               prefer_grpc=True,
+                               timeout=REMOTE_REQUEST_TIMEOUT_S)
+            self._remote_store = Qdrant(
+                client=QdrantClient(**client_args),
+                # Used by queries, which run on the event loop
+                async_client=AsyncQdrantClient(**client_args),
+                collection_name=REMOTE_COLLECTION_NAME,
+                embeddings=self.emb
+            )
+        return self._remote_store
+
+    def _probe_remote_store(self) -> None:
+        self._get_remote_store().client.get_collection(REMOTE_COLLECTION_NAME)
+
+    def _create_chain(self, config: cfg.Config) -> RetrievalQAWithSourcesChain:
         llm = ChatOpenAI(
             temperature=config[cfg.LLM_TEMPERATURE], # type: ignore
             model_name=config[cfg.LLM_MODEL_NAME],
-            streaming=streaming, 
-            callbacks=callbacks, 
+            streaming=True, 
             openai_api_key=config[cfg.API_KEY_OPEN_AI]
         )
-        remote_store = Qdrant(
-            client=QdrantClient(
-                url=constant.QDRANT_CLOUD_URL,
-                api_key=constant.QDRANT_CLOUD_KEY,
-                prefer_grpc=True),
-            collection_name=REMOTE_COLLECTION_NAME,
-            embeddings=self.emb
-        )
-        chain = RetrievalQAWithSourcesChain.from_chain_type(
+        retrieval_mode = config.get(cfg.RETRIEVAL_MODE, HYBRID)
+        vectorstores = [self.store]
+        circuit_breakers: list[Optional[CircuitBreaker]] = [None]
+        if retrieval_mode != KEYWORD and config.get(cfg.REMOTE_STORE_ENABLED, True):
+            self._remote_breaker.latency_budget_s = config.get(cfg.REMOTE_STORE_LATENCY_BUDGET_S, 0) or None
+            vectorstores.append(self._get_remote_store())
+            circuit_breakers.append(self._remote_breaker)
+        context_tokens = config.get(cfg.CONTEXT_TOKENS, 0) or None
+        return RetrievalQAWithSourcesChain.from_chain_type(
             llm, 
             retriever=MultiStoreRetreiver(
-                vectorstores=[
-                    self.store, # type: ignore
-                    remote_store
-                    ],
-                k=4),
-            chain_type="stuff")
+                vectorstores=vectorstores,
+                embeddings=self.emb,
+                query_vector_cache=self._query_vector_cache,
+                store_timeout=config.get(cfg.RETRIEVAL_TIMEOUT_S, 0) or None,
+                keyword_index=self.index.keywords, # type: ignore
+                retrieval_mode=retrieval_mode,
+                circuit_breakers=circuit_breakers,
+                max_context_tokens=context_tokens,
+                k=4 if context_tokens is None else CONTEXT_CANDIDATES),
+            chain_type="stuff",
+            chain_type_kwargs={"prompt": get_prompt(config.get(cfg.PROMPT_TEMPLATE, LEAN))},
+            return_source_documents=True) # Their files invalidate the answer in the cache
+
+    def _get_chain(self, config: cfg.Config) -> RetrievalQAWithSourcesChain:
+        """Returns the chain used for querying. It is only recreated when 
+        one of the QUERY_CONFIG_KEYS has changed since it was created."""
+        key = tuple(config.get(k) for k in QUERY_CONFIG_KEYS)
+        with self._chain_lock:
+            if self._chain is None or self._chain_key != key:
+                logger.debug("Creating query chain")
+                self._chain = self._create_chain(config)
+                self._chain_key = key
+            return self._chain
+
+    def start_warm_up(self, config: cfg.Config) -> Future:
+        """Creates the query chain and opens the connections of its clients 
+        in the background, so that the first query does not pay for them"""
+        return event_loop.get_event_loop().submit(self._awarm_up(config))
 
+    async def _awarm_up(self, config: cfg.Config) -> None:
+        try:
+            chain = self._get_chain(config)
+        except Exception as e:
+            logger.warning(f"Unable to create the query chain: {e!r}")
+            return
+        connects = {}
+        if config.get(cfg.RETRIEVAL_MODE, HYBRID) != KEYWORD and config.get(cfg.REMOTE_STORE_ENABLED, True) and \
+                self._remote_store is not None and self._remote_store.async_client is not None:
+            connects["remote store"] = self._remote_store.async_client.get_collection(REMOTE_COLLECTION_NAME)
+        # The OpenAI client shares its connection pool between the chat and the models endpoints
+        llm_client = getattr(chain.combine_documents_chain.llm_chain.llm, "root_async_client", None) # type: ignore
+        if llm_client is not None:
+            connects["LLM"] = llm_client.models.list()
+        results = await asyncio.gather(*connects.values(), return_exceptions=True)
+        for name, res in zip(connects, results):
+            if isinstance(res, Exception):
+                logger.info(f"Unable to connect to the {name} in advance: {res!r}")
+        logger.debug("Query clients warmed up")
+
+    def _clear_query_clients(self) -> None:
+        with self._chain_lock:
+            self._chain = None
+            self._chain_key = None
+            if self._remote_store is not None:
+                self._remote_store.client.close()
+                if self._remote_store.async_client is not None:
+                    event_loop.get_event_loop().submit(self._remote_store.async_client.close())
+                self._remote_store = None
+
+    @allowed_states({state.LOADED, state.LOADING})
+    def start_query(self, 
+                    config: cfg.Config, 
+                    query_string: str, 
+                    callbacks: list[BaseCallbackHandler] = [],
+                    query_ctx: Optional[util.QueryContext] = None) -> Future:
+        """Starts answering query_string on the shared event loop, see aquery. 
+        Cancelling query_ctx or the returned future cancels the query."""
+        future = event_loop.get_event_loop().submit(self.aquery(config, query_string, callbacks, query_ctx))
+        if query_ctx is not None:
+            query_ctx.set_future(future)
+        return future
+
+    @allowed_states({state.LOADED, state.LOADING})
+    def query(self, 
+             config: cfg.Config, 
+             query_string: str, 
+             callbacks: list[BaseCallbackHandler] = [],
+             query_ctx: Optional[util.QueryContext] = None) -> dict:
+        """Answers query_string and waits for the answer, see aquery"""
+        try:
+            return self.start_query(config, query_string, callbacks, query_ctx).result()
+        except CancelledError:
+            logger.info(f"Query cancelled: {query_string}")
+            return {}
+
+    @allowed_states({state.LOADED, state.LOADING})
+    async def aquery(self, 
+                     config: cfg.Config, 
+                     query_string: str, 
+                     callbacks: list[BaseCallbackHandler] = [],
+                     query_ctx: Optional[util.QueryContext] = None) -> dict:
+        """Answers query_string, streaming the answer to callbacks. If query_ctx
+        is cancelled the query stops and {} is returned.
+
+        Has to run on the shared event loop, which the chain's clients are bound to."""
         logger.info(
-            f"Querying using {config[cfg.LLM_MODEL_NAME]} on temp {config[cfg.LLM_TEMPERATURE]} (streaming: {streaming})")
+            f"Querying using {config[cfg.LLM_MODEL_NAME]} on temp {config[cfg.LLM_TEMPERATURE]}")
+        if query_ctx is not None:
+            callbacks = [CancelQueryHandler(query_ctx), *callbacks]
         try:
-            res = chain.invoke({chain.question_key: query_string})
+            chain = self._get_chain(config)
+            # Answers based on a partially created index are not cached
+            answer_cache = self.answer_cache if self.state is state.LOADED else None
+            if answer_cache is not None:
+                scope = self._get_answer_scope(config)
+                vector = await self._aget_cacheable_query_vector(config, query_string)
+                cached = await run_in_executor(None, self._get_cached_answer, answer_cache, scope, query_string, 
+                                               vector, config.get(cfg.ANSWER_CACHE_SIMILARITY, 1.0))
+                if cached is not None:
+                    logger.info("Answering from the answer cache")
+                    # The callbacks are synchronous, like LangChain they are not run on the loop
+                    return await run_in_executor(None, self._replay_answer, chain, query_string, cached, callbacks)
+            # Callbacks are given per call so that the chain can be reused
+            res = await chain.ainvoke({chain.question_key: query_string}, config={"callbacks": callbacks})
+            if answer_cache is not None and res.get(chain.answer_key):
+                await run_in_executor(None, self._put_cached_answer, answer_cache, scope, query_string, vector, res, chain)
+        except errors.QueryCancelled:
+            logger.info(f"Query cancelled: {query_string}")
+            res = {}
         except Exception as err:
             self.exception = err
             self.state = state.ERROR
             res = {}
         return res
     
+    def _set_answer_cache(self, answer_cache: Optional[AnswerCache]) -> None:
+        if self.answer_cache is not None:
+            self.answer_cache.close()
+        self.answer_cache = answer_cache
+
+    def _invalidate_answers(self, file_paths: Optional[list[str]] = None) -> None:
+        """Removes the cached answers based on file_paths, or all if None"""
+        if self.answer_cache is None or file_paths == []:
+            return
+        try:
+            if file_paths is None:
+                self.answer_cache.clear()
+            else:
+                self.answer_cache.invalidate(file_paths)
+        except sqlite3.Error:
+            logger.exception("Unable to invalidate cached answers")
+
+    def _get_answer_scope(self, config: cfg.Config) -> str:
+        """Answers are only shared between queries to the same index version using the same settings"""
+        return "\0".join(str(v) for v in (self._manifest_path, 
+                                           config[cfg.LLM_MODEL_NAME], 
+                                           config[cfg.LLM_TEMPERATURE], 
+                                           config.get(cfg.RETRIEVAL_MODE, HYBRID),
+                                           config.get(cfg.CONTEXT_TOKENS, 0),
+                                           config.get(cfg.PROMPT_TEMPLATE, LEAN)))
+
+    async def _aget_cacheable_query_vector(self, config: cfg.Config, query_string: str) -> Optional[list[float]]:
+        """The query vector, shared with the retriever through the query vector cache.
+        None in keyword mode, which makes no network calls."""
+        if config.get(cfg.RETRIEVAL_MODE, HYBRID) == KEYWORD:
+            return None
+        vector = self._query_vector_cache.get(query_string)
+        if vector is None:
+            vector = await self.emb.aembed_query(query_string)
+            self._query_vector_cache.put(query_string, vector)
+        return vector
+
+    def _get_cached_answer(self, answer_cache: AnswerCache, scope: str, query_string: str, 
+                           vector: Optional[list[float]], min_similarity: float) -> Optional[CachedAnswer]:
+        try:
+            return answer_cache.get(scope, query_string, vector, min_similarity)
+        except sqlite3.Error:
+            logger.exception("Unable to read from answer cache")
+            return None
+
+    def _put_cached_answer(self, answer_cache: AnswerCache, scope: str, query_string: str, 
+                           vector: Optional[list[float]], res: dict, chain: RetrievalQAWithSourcesChain) -> None:
+        source_files = sorted({doc.metadata["source"] for doc in res.get("source_documents", []) 
+                               if "source" in doc.metadata})
+        try:
+            answer_cache.put(scope, query_string, vector, 
+                             CachedAnswer(res[chain.answer_key], res[chain.sources_answer_key], source_files))
+        except sqlite3.Error:
+            logger.exception("Unable to write to answer cache")
+
+    def _replay_answer(self, chain: RetrievalQAWithSourcesChain, query_string: str, 
+                       answer: CachedAnswer, callbacks: list[BaseCallbackHandler]) -> dict:
+        """Passes a cached answer to the callbacks as if the LLM had streamed it as one token"""
+        text = answer.answer + (f"SOURCES: {answer.sources}" if answer.sources else "")
+        run_id = uuid.uuid4()
+        for callback in callbacks:
+            callback.on_llm_new_token(answer.answer, run_id=run_id)
+            callback.on_llm_end(LLMResult(generations=[[Generation(text=text)]]), run_id=run_id)
+        return {chain.question_key: query_string, 
+                chain.answer_key: answer.answer, 
+                chain.sources_answer_key: answer.sources}
+
+
+def get_indexing_args(config: cfg.Config) -> dict[str, int]:
+    """Keyword arguments to indexing.index_files taken from config"""
+    return {
+        "workers": get_workers(config.get(cfg.LOADING_WORKERS, 1)),
+        "batch_size": config.get(cfg.INDEXING_BATCH_SIZE, indexing.DEFAULT_BATCH_SIZE),
+        "max_batch_tokens": config.get(cfg.EMBEDDING_BATCH_TOKENS, indexing.DEFAULT_BATCH_TOKENS),
+        "concurrency": config.get(cfg.EMBEDDING_CONCURRENCY, indexing.DEFAULT_CONCURRENCY),
+    }
+
+def get_answer_cache(config: cfg.Config) -> Optional[AnswerCache]:
+    max_entries = config.get(cfg.ANSWER_CACHE_SIZE, 0)
+    if max_entries <= 0:
+        return None
+    return AnswerCache(constant.ANSWER_CACHE_PATH, max_entries, config.get(cfg.ANSWER_CACHE_MAX_AGE_H, 0) * 3600)
+
+def close_embeddings(emb: Embeddings) -> None:
+    """Closes the cache of embeddings returned by get_embeddings. It is opened
+    again if the embeddings are still used, e.g. by a running query."""
+    if isinstance(emb, CachedEmbeddings):
+        emb.cache.close()
 
 def get_embeddings(config: cfg.Config) -> Embeddings:
     """This function returns the proper Embeddings according
     to the config"""
-    return OpenAIEmbeddings(openai_api_key=config[cfg.API_KEY_OPEN_AI]) #type: ignore
+    # A bounded request time bounds how long a cancelled indexing run keeps a request open
+    emb = OpenAIEmbeddings(openai_api_key=config[cfg.API_KEY_OPEN_AI], request_timeout=EMBEDDING_REQUEST_TIMEOUT_S) #type: ignore
+    cache_size_mb = config.get(cfg.EMBEDDING_CACHE_SIZE_MB, 0)
+    if cache_size_mb > 0:
+        emb = CachedEmbeddings(emb, EmbeddingCache(constant.EMBEDDING_CACHE_PATH, cache_size_mb))
+    return emb
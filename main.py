@@ -1,4 +1,5 @@
 import logging
+import multiprocessing
 import pathlib
 import shutil
 import threading
@@ -137,5 +138,7 @@ def main():
 
 
 if __name__ == "__main__":
+    # Needed by the file loading process pool in frozen (PyInstaller) builds
+    multiprocessing.freeze_support()
     logger = setup_logging()
     main()
@@ -16,7 +16,7 @@ from unittest.mock import (
     patch,
     create_autospec
 )
-from alphageist.alphageist import Alphageist
+from alphageist.alphageist import Alphageist, get_config
 from alphageist.vectorstore import VectorStore
 from alphageist import (
     state,
@@ -32,7 +32,7 @@ from langchain.chat_models.base import SimpleChatModel
 from langchain.callbacks.manager import CallbackManagerForLLMRun
 from langchain.schema.messages import BaseMessage
 
-from qdrant_client import QdrantClient
+from qdrant_client import QdrantClient, AsyncQdrantClient
 
 class MockLMM(SimpleChatModel):
     @property
@@ -46,14 +46,20 @@ def tmp_user_config_dir(tmp_path):
     """Updates the config path to a tmp_path"""
     # Save the original values
     original_config_path = constant.CONFIG_PATH
+    original_embedding_cache_path = constant.EMBEDDING_CACHE_PATH
+    original_answer_cache_path = constant.ANSWER_CACHE_PATH
 
     # Update CONFIG_PATH based on the new APP_DATA_DIR
     constant.CONFIG_PATH = tmp_path / "config.json"
+    constant.EMBEDDING_CACHE_PATH = tmp_path / "embedding_cache.sqlite"
+    constant.ANSWER_CACHE_PATH = tmp_path / "answer_cache.sqlite"
 
     yield tmp_path
 
     # Restore the original values after the test runs
     constant.CONFIG_PATH = original_config_path
+    constant.EMBEDDING_CACHE_PATH = original_embedding_cache_path
+    constant.ANSWER_CACHE_PATH = original_answer_cache_path
 
 @pytest.fixture
 def tmp_env_factory(tmp_user_config_dir):
@@ -152,7 +158,7 @@ def test_start_init_vectorstore_load_existing(tmp_env_factory):
     a.load_config()
     a.start_init_vectorstore()
     a.vectorstore._thread.join() # Wait for loading to finish
-    del a.vectorstore.store.client
+    a.vectorstore.index.close()
 
     a = Alphageist()
     a.load_config()
@@ -162,8 +168,6 @@ def test_start_init_vectorstore_load_existing(tmp_env_factory):
 @pytest.mark.parametrize("inval_state", {
     state.NEW, 
     state.CONFIGURED,
-    state.LOADING_VECTORSTORE, 
-    state.QUERYING,
     state.ERROR})
 def test_start_search_incorrect_state(inval_state: state.State):
     a = Alphageist()
@@ -186,6 +190,7 @@ def test_start_search_empty_search_string(tmp_env_factory):
 @patch('alphageist.vectorstore.OpenAIEmbeddings', new=MockEmbedding)
 @patch('alphageist.vectorstore.ChatOpenAI', new=MockLMM)
 @patch('alphageist.vectorstore.QdrantClient', new=create_autospec(QdrantClient))
+@patch('alphageist.vectorstore.AsyncQdrantClient', new=create_autospec(AsyncQdrantClient))
 def test_start_search(tmp_env_factory):
     next(tmp_env_factory('valid_tiny.json'))
     a = Alphageist()
@@ -201,6 +206,38 @@ def test_start_search(tmp_env_factory):
     e.wait()
     assert a.state is state.STANDBY
 
+def _loading_alphageist(search_while_indexing: bool, searchable: bool) -> Alphageist:
+    a = Alphageist()
+    a.config = cfg.get_default_config()
+    a.config[cfg.SEARCH_WHILE_INDEXING] = search_while_indexing
+    a.vectorstore = MagicMock(state=state.LOADING)
+    a.vectorstore.is_searchable.return_value = searchable
+    a.state = state.LOADING_VECTORSTORE
+    return a
+
+def test_start_search_while_indexing_disabled():
+    a = _loading_alphageist(search_while_indexing=False, searchable=True)
+    with pytest.raises(errors.InvalidStateError):
+        a.start_search("hej", callbacks=[])
+
+def test_start_search_while_indexing_nothing_indexed():
+    a = _loading_alphageist(search_while_indexing=True, searchable=False)
+    with pytest.raises(errors.IndexNotReadyError):
+        a.start_search("hej", callbacks=[])
+
+def test_start_search_while_indexing_returns_to_loading():
+    a = _loading_alphageist(search_while_indexing=True, searchable=True)
+    def start_query(config, query_string, callbacks, query_ctx):
+        for cb in callbacks:
+            cb.on_llm_end(None)
+    a.vectorstore.start_query.side_effect = start_query
+
+    e = threading.Event()
+    a.subscribe_to_statechange(lambda _, new_state: e.set() if new_state is not state.QUERYING else None)
+    a.start_search("hej", callbacks=[])
+    e.wait(timeout=5)
+    assert a.state is state.LOADING_VECTORSTORE
+
 def test_reset_standby_state(tmp_env_factory):
     next(tmp_env_factory('valid_tiny.json'))
     a = Alphageist()
@@ -227,10 +264,108 @@ def test_reset_loading_state(tmp_env_factory):
     assert a.vectorstore.is_created() == False
 
 
-@pytest.mark.parametrize("inval_state", {
-    state.QUERYING})
-def test_reset_incorrect_state(inval_state:state.State):
+def _querying_alphageist() -> tuple[Alphageist, dict]:
+    """Alphageist whose queries only record their callbacks and query context
+    by query string, leaving it to the test to end them"""
     a = Alphageist()
-    a.state = inval_state
-    with pytest.raises(errors.InvalidStateError):
-        a.reset()
+    a.config = cfg.get_default_config()
+    a.vectorstore = MagicMock(state=state.LOADED)
+    a.state = state.STANDBY
+    queries = {}
+    def start_query(config, query_string, callbacks, query_ctx):
+        queries[query_string] = (callbacks, query_ctx)
+    a.vectorstore.start_query.side_effect = start_query
+    return a, queries
+
+def test_cancel_search():
+    a, queries = _querying_alphageist()
+    a.start_search("hej")
+    callbacks, query_ctx = queries["hej"]
+    assert a.state is state.QUERYING
+
+    a.cancel_search()
+    assert query_ctx.is_cancelled()
+    assert a.state is state.STANDBY
+    a.cancel_search() # Nothing to cancel
+    assert a.state is state.STANDBY
+
+def test_start_search_replaces_running_query():
+    a, queries = _querying_alphageist()
+    states = []
+    a.subscribe_to_statechange(lambda _, new_state: states.append(new_state))
+    a.start_search("hej")
+    a.start_search("hej hej")
+    first_callbacks, first_ctx = queries["hej"]
+    callbacks, query_ctx = queries["hej hej"]
+    assert first_ctx.is_cancelled()
+    assert not query_ctx.is_cancelled()
+    assert a.state is state.QUERYING
+
+    # The end of the replaced query does not end the new one
+    for cb in first_callbacks:
+        cb.on_llm_end(None)
+    assert a.state is state.QUERYING
+    for cb in callbacks:
+        cb.on_llm_end(None)
+    assert a.state is state.STANDBY
+    assert states == [state.QUERYING, state.STANDBY, state.QUERYING, state.STANDBY]
+
+def test_reset_querying_state():
+    a, queries = _querying_alphageist()
+    a.start_search("hej")
+    a.reset()
+
+    assert queries["hej"][1].is_cancelled()
+    assert a.state is state.NEW
+
+def _standby_alphageist(tmp_env_factory) -> Alphageist:
+    next(tmp_env_factory('valid_tiny.json'))
+    a = Alphageist()
+    a.load_config()
+    a.start_init_vectorstore()
+    a.vectorstore._thread.join()
+    assert a.state is state.STANDBY, "Unable to continue with test: wrong state"
+    return a
+
+@patch('alphageist.vectorstore.OpenAIEmbeddings', new=MockEmbedding)
+def test_on_config_changed_llm_settings_keep_index(tmp_env_factory):
+    a = _standby_alphageist(tmp_env_factory)
+    old_index = a.vectorstore.index
+    config = get_config()
+    config[cfg.LLM_TEMPERATURE] = 0.5
+    config[cfg.API_KEY_OPEN_AI] = "sk-other-fake-key"
+    cfg.save_config(constant.CONFIG_PATH, config)
+
+    a.on_config_changed()
+    assert a.state is state.STANDBY
+    assert a.config[cfg.LLM_TEMPERATURE] == 0.5
+    assert a.vectorstore.index is old_index
+    assert a.vectorstore._update_thread is None or not a.vectorstore._update_thread.is_alive()
+
+@patch('alphageist.vectorstore.OpenAIEmbeddings', new=MockEmbedding)
+def test_on_config_changed_search_dir_updates_in_background(tmp_env_factory, tmp_path):
+    a = _standby_alphageist(tmp_env_factory)
+    old_index = a.vectorstore.index
+    search_dir = tmp_path / "search"
+    search_dir.mkdir()
+    shutil.copy(Path("test") / "data" / "code.py", search_dir)
+    config = get_config()
+    config[cfg.SEARCH_DIRS] = str(search_dir)
+    cfg.save_config(constant.CONFIG_PATH, config)
+
+    a.on_config_changed()
+    assert a.state is state.STANDBY
+    a.vectorstore._update_thread.join()
+    assert a.vectorstore.index is old_index
+    assert set(a.vectorstore.manifest.files) == {str(search_dir / "code.py")}
+    assert a.vectorstore.index.count() == 1
+
+@patch('alphageist.vectorstore.OpenAIEmbeddings', new=MockEmbedding)
+def test_on_config_changed_storage_moved_resets(tmp_env_factory, tmp_path):
+    a = _standby_alphageist(tmp_env_factory)
+    config = get_config()
+    config[cfg.VECTORDB_DIR] = str(tmp_path / "moved")
+    cfg.save_config(constant.CONFIG_PATH, config)
+
+    a.on_config_changed()
+    assert a.state is state.NEW
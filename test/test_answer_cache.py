@@ -0,0 +1,83 @@
+import time
+import pytest
+
+from alphageist import answer_cache
+from alphageist.answer_cache import AnswerCache, CachedAnswer
+
+SCOPE = "index_v0"
+
+def _answer(text: str, *source_files: str) -> CachedAnswer:
+    return CachedAnswer(f"{text}\n", ", ".join(source_files), list(source_files))
+
+@pytest.fixture
+def cache(tmp_path):
+    c = AnswerCache(tmp_path / "answers.sqlite", max_entries=100)
+    yield c
+    c.close()
+
+def test_get_same_query_ignoring_case_and_whitespace(cache):
+    cache.put(SCOPE, "What are our core values?", None, _answer("Honesty", "values.txt"))
+    assert cache.get(SCOPE, "what are  our core values? ") == _answer("Honesty", "values.txt")
+    assert cache.get(SCOPE, "What is our net result?") is None
+    assert cache.get("index_v1", "What are our core values?") is None
+
+def test_get_similar_query(cache):
+    cache.put(SCOPE, "core values", [1.0, 0.0, 0.0], _answer("Honesty"))
+    cache.put(SCOPE, "net result", [0.0, 1.0, 0.0], _answer("Profit"))
+
+    assert cache.get(SCOPE, "our core values", [0.99, 0.1, 0.0], min_similarity=0.95) == _answer("Honesty")
+    assert cache.get(SCOPE, "our core values", [0.7, 0.7, 0.0], min_similarity=0.95) is None
+    assert cache.get(SCOPE, "our core values", [0.99, 0.1, 0.0], min_similarity=1.0) is None
+    assert cache.get(SCOPE, "our core values", [1.0, 0.0], min_similarity=0.5) is None # Other model
+
+def test_put_replaces_same_query(cache):
+    cache.put(SCOPE, "core values", [1.0, 0.0], _answer("Old"))
+    cache.put(SCOPE, "Core values", [1.0, 0.0], _answer("New"))
+    assert len(cache) == 1
+    assert cache.get(SCOPE, "values", [1.0, 0.0], min_similarity=0.9) == _answer("New")
+
+def test_persisted(tmp_path):
+    c = AnswerCache(tmp_path / "answers.sqlite", max_entries=10)
+    c.put(SCOPE, "core values", [1.0, 0.0], _answer("Honesty", "values.txt"))
+    c.close()
+    c = AnswerCache(tmp_path / "answers.sqlite", max_entries=10)
+    assert c.get(SCOPE, "values", [1.0, 0.1], min_similarity=0.9) == _answer("Honesty", "values.txt")
+    c.close()
+
+def test_invalidate_by_source_file(cache):
+    cache.put(SCOPE, "core values", [1.0, 0.0], _answer("Honesty", "values.txt", "handbook.pdf"))
+    cache.put(SCOPE, "net result", [0.0, 1.0], _answer("Profit", "report.pdf"))
+
+    assert cache.invalidate(["handbook.pdf", "other.txt"]) == 1
+    assert cache.get(SCOPE, "core values") is None
+    assert cache.get(SCOPE, "values", [1.0, 0.0], min_similarity=0.9) is None
+    assert cache.get(SCOPE, "net result") == _answer("Profit", "report.pdf")
+
+def test_evicts_least_recently_used(tmp_path, monkeypatch):
+    monkeypatch.setattr(answer_cache, "_EVICT_TO", 1.0)
+    c = AnswerCache(tmp_path / "answers.sqlite", max_entries=3)
+    for i in range(3):
+        c.put(SCOPE, f"q{i}", None, _answer(str(i)))
+    c.get(SCOPE, "q0")
+    c.put(SCOPE, "q3", None, _answer("3"))
+
+    assert len(c) == 3
+    assert c.get(SCOPE, "q1") is None
+    assert c.get(SCOPE, "q0") is not None
+    c.close()
+
+def test_expired_answers_not_used(tmp_path):
+    c = AnswerCache(tmp_path / "answers.sqlite", max_entries=10, max_age_s=60)
+    c.put(SCOPE, "core values", [1.0, 0.0], _answer("Honesty"))
+    c.max_age_s = 1e-3
+    time.sleep(0.01)
+    assert c.get(SCOPE, "core values") is None
+    c.put(SCOPE, "net result", None, _answer("Profit"))
+    assert len(c) == 1
+    c.close()
+
+def test_clear(cache):
+    cache.put(SCOPE, "core values", [1.0, 0.0], _answer("Honesty", "values.txt"))
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.get(SCOPE, "core values", [1.0, 0.0], min_similarity=0.9) is None
@@ -0,0 +1,33 @@
+from alphageist import benchmark
+from alphageist import local_index
+from alphageist import prompt
+
+def test_quantization_report():
+    vectors = benchmark.synthetic_vectors(300, 32, n_clusters=5)
+    queries = benchmark.synthetic_queries(vectors, 5)
+    results = benchmark.quantization_report(vectors, queries, k=4)
+
+    assert [r.quantization for r in results] == list(local_index.QUANTIZATIONS)
+    assert results[0].recall == 1.0
+    assert [r.bytes_per_vector for r in results] == [128, 64, 36, 4]
+    assert all(0 <= r.recall <= 1 for r in results)
+    assert "binary" in benchmark.format_quantization_report(results)
+
+def test_prompt_report():
+    from langchain_community.llms.fake import FakeStreamingListLLM
+    docs = benchmark.synthetic_docs(4)
+    llm = FakeStreamingListLLM(responses=["The answer\nSOURCES: document_0.txt"])
+    results = benchmark.prompt_report(docs, "What is the efficiency?", llm=llm, runs=2)
+
+    assert [r.template for r in results] == list(prompt.PROMPT_TEMPLATES)
+    lean, langchain = results
+    # The few-shot examples are gone, the chunks are the same
+    assert lean.prompt_tokens < langchain.prompt_tokens - 500
+    assert all(r.ttft_s is not None and r.ttft_s >= 0 for r in results)
+    assert "lean" in benchmark.format_prompt_report(results)
+
+def test_format_prompt_contains_docs_and_question():
+    docs = benchmark.synthetic_docs(2)
+    text = benchmark.format_prompt(prompt.LEAN, docs, "What is the efficiency?")
+    assert "Source: document_1.txt" in text
+    assert text.endswith("QUESTION: What is the efficiency?\nANSWER:")
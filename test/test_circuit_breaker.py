@@ -0,0 +1,91 @@
+import time
+import threading
+
+from alphageist import circuit_breaker
+from alphageist.circuit_breaker import CircuitBreaker
+
+def _open(breaker: CircuitBreaker) -> None:
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+
+def test_opens_after_failures_in_a_row():
+    breaker = CircuitBreaker("store", failure_threshold=3)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success(0.0)
+    breaker.record_failure()
+    assert breaker.state == circuit_breaker.CLOSED
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == circuit_breaker.OPEN
+    assert not breaker.allow()
+
+def test_slow_call_counts_as_failure():
+    breaker = CircuitBreaker("store", latency_budget_s=0.5, failure_threshold=1)
+    breaker.record_success(0.1)
+    assert breaker.state == circuit_breaker.CLOSED
+    breaker.record_success(1.0)
+    assert breaker.state == circuit_breaker.OPEN
+
+def test_half_open_trial_call():
+    breaker = CircuitBreaker("store", open_s=0.05)
+    _open(breaker)
+    time.sleep(0.1)
+    assert breaker.allow()
+    assert breaker.state == circuit_breaker.HALF_OPEN
+    assert not breaker.allow() # Only one trial at a time
+    breaker.record_failure()
+    assert breaker.state == circuit_breaker.OPEN
+
+    time.sleep(0.1)
+    assert breaker.allow()
+    breaker.record_success(0.0)
+    assert breaker.state == circuit_breaker.CLOSED
+    assert breaker.allow()
+
+def test_cancelled_trial_call():
+    breaker = CircuitBreaker("store", open_s=0.05)
+    _open(breaker)
+    time.sleep(0.1)
+    assert breaker.allow()
+    breaker.record_cancelled()
+    assert breaker.state == circuit_breaker.OPEN
+    assert breaker.allow() # The next call is the trial, without waiting open_s again
+    breaker.record_success(0.0)
+    assert breaker.state == circuit_breaker.CLOSED
+    breaker.record_cancelled()
+    assert breaker.state == circuit_breaker.CLOSED
+
+def test_probe_closes_without_caller_waiting():
+    probed = threading.Event()
+    release = threading.Event()
+    def probe():
+        probed.set()
+        release.wait(5)
+    breaker = CircuitBreaker("store", open_s=0.05, probe=probe)
+    _open(breaker)
+    time.sleep(0.1)
+
+    assert not breaker.allow()
+    assert probed.wait(5)
+    assert breaker.state == circuit_breaker.HALF_OPEN
+    release.set()
+    for _ in range(100):
+        if breaker.state == circuit_breaker.CLOSED:
+            break
+        time.sleep(0.01)
+    assert breaker.allow()
+
+def test_failed_probe_reopens():
+    def probe():
+        raise ConnectionError("unreachable")
+    breaker = CircuitBreaker("store", open_s=0.05, probe=probe)
+    _open(breaker)
+    time.sleep(0.1)
+    assert not breaker.allow()
+    for _ in range(100):
+        if breaker.state == circuit_breaker.OPEN:
+            break
+        time.sleep(0.01)
+    assert breaker.state == circuit_breaker.OPEN
+    assert not breaker.allow()
@@ -63,6 +63,24 @@ def test_required_key_has_missing_value(key):
 
 @pytest.mark.parametrize("key, value", [
     (cfg.LOG_LEVEL, "not a log level"),
+    (cfg.LOADING_WORKERS, -1),
+    (cfg.LOADING_WORKERS, "four"),
+    (cfg.EMBEDDING_CONCURRENCY, 0),
+    (cfg.EMBEDDING_BATCH_TOKENS, 1.5),
+    (cfg.EXCLUDE_PATTERNS, "*.log"),
+    (cfg.MAX_DEPTH, -1),
+    (cfg.ANSWER_CACHE_SIZE, -1),
+    (cfg.REMOTE_STORE_LATENCY_BUDGET_S, -1),
+    (cfg.CONTEXT_TOKENS, 0.5),
+    (cfg.PROMPT_TEMPLATE, "short"),
+    (cfg.PROMPT_TEMPLATE, "Answer {question}"),
+    (cfg.PROMPT_TEMPLATE, "Answer {question} from {summaries} in {language}"),
+    (cfg.PROMPT_TEMPLATE, None),
+    (cfg.ANSWER_CACHE_SIMILARITY, 0),
+    (cfg.ANSWER_CACHE_SIMILARITY, 1.5),
+    (cfg.LOCAL_INDEX_BACKEND, "faiss"),
+    (cfg.RETRIEVAL_MODE, "sparse"),
+    (cfg.VECTOR_QUANTIZATION, "int4"),
 ])
 def test_invalid_value(key:str, value:str):
     config = get_test_cfg_valid()
@@ -0,0 +1,66 @@
+from langchain.docstore.document import Document
+
+from alphageist import util
+from alphageist.context_packing import (
+    DOC_OVERHEAD_TOKENS,
+    clean_text,
+    pack_context,
+)
+
+def _count_words(text: str) -> int:
+    return len(text.split())
+
+def _doc(text: str, source: str = "a.txt", start_index=None) -> Document:
+    metadata = {"source": source}
+    if start_index is not None:
+        metadata["start_index"] = start_index
+    return Document(page_content=text, metadata=metadata)
+
+def _cost(text: str) -> int:
+    return _count_words(text) + 1 + DOC_OVERHEAD_TOKENS
+
+def test_clean_text():
+    assert clean_text("\n\nsome   text\t here  \n\n\n\n    indented    line\n") == "some text here\n\n    indented line"
+
+def test_fills_budget_best_first():
+    docs = [_doc("one two three"), _doc("four five six seven"), _doc("eight")]
+    packed = pack_context(docs, _cost("one two three") + _cost("eight"), _count_words)
+    # The second does not fit, the third still does
+    assert [d.page_content for d in packed] == ["one two three", "eight"]
+
+def test_nothing_fits():
+    assert pack_context([_doc("one two three")], 2, _count_words) == []
+
+def test_drops_near_duplicates():
+    docs = [_doc("the gearbox efficiency is 97 percent"),
+            _doc("The gearbox efficiency is 97 percent.", source="b.txt"),
+            _doc("the gearbox weighs 20 kg")]
+    packed = pack_context(docs, 1000, _count_words)
+    assert [d.page_content for d in packed] == [docs[0].page_content, docs[2].page_content]
+
+def test_merges_adjacent_chunks():
+    first, second = "first part of the file", "second part"
+    docs = [_doc(second, start_index=len(first) + 1),
+            _doc("another file", source="b.txt"),
+            _doc(first, start_index=0)]
+    packed = pack_context(docs, _cost(second) + _cost("another file") + _count_words(first), _count_words)
+
+    assert [d.page_content for d in packed] == [f"{first}\n{second}", "another file"]
+    assert packed[0].metadata == {"source": "a.txt", "start_index": 0}
+
+def test_merges_adjacent_escaped_chunks():
+    # Chunks are escaped after splitting, start_index is a position in the unescaped text
+    first, second = "Mina bostadsköer i Göteborg och Malmö. " * 10, "Sista delen"
+    docs = [_doc(util.string_to_raw_string(first), start_index=0),
+            _doc(util.string_to_raw_string(second), start_index=len(first))]
+    packed = pack_context(docs, 1000, _count_words)
+    assert len(packed) == 1
+
+def test_does_not_merge_distant_or_other_page_chunks():
+    docs = [_doc("x", start_index=0), _doc("y", start_index=500),
+            Document(page_content="z", metadata={"source": "a.txt", "page": 2, "start_index": 2})]
+    assert len(pack_context(docs, 1000, _count_words)) == 3
+
+def test_count_tokens_falls_back_to_estimate(monkeypatch):
+    monkeypatch.setattr(util, "_tokenizer", None)
+    assert util.count_tokens("a" * 40) == util.estimate_tokens("a" * 40)
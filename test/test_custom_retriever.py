@@ -0,0 +1,223 @@
+import asyncio
+import time
+from typing import List
+import pytest
+
+from langchain.docstore.document import Document
+from langchain.vectorstores.base import VectorStore
+from langchain_community.vectorstores import Qdrant
+
+from alphageist.custom_retriever import (
+    HYBRID,
+    KEYWORD,
+    MultiStoreRetreiver,
+    reciprocal_rank_fusion,
+)
+from alphageist.keyword_index import KeywordIndex
+from alphageist.circuit_breaker import CircuitBreaker
+from alphageist import circuit_breaker
+from alphageist import errors
+from alphageist import util
+
+from test.test_vectorstore import MockEmbedding
+
+class CountingEmbedding(MockEmbedding):
+    def __init__(self):
+        super().__init__()
+        self.n_queries = 0
+
+    def embed_query(self, text: str) -> List[float]:
+        self.n_queries += 1
+        return super().embed_query(text)
+
+def _store(emb, texts, collection_name):
+    return Qdrant.from_documents([Document(page_content=t) for t in texts], 
+                                 emb, location=":memory:", collection_name=collection_name)
+
+def test_query_embedded_once_for_all_stores():
+    emb = CountingEmbedding()
+    stores = [_store(emb, ["a", "b", "c"], "one"), _store(emb, ["d", "e"], "two")]
+    emb.n_queries = 0
+    retriever = MultiStoreRetreiver(vectorstores=stores, embeddings=emb, k=4)
+
+    docs = retriever.invoke("hello")
+    assert len(docs) == 4
+    assert emb.n_queries == 1
+
+    retriever.invoke("hello")
+    assert emb.n_queries == 1, "Expected the query vector to be cached"
+
+def test_results_sorted_by_score_across_stores():
+    emb = MockEmbedding()
+    stores = [_store(emb, ["a", "b", "c"], "one"), _store(emb, ["d", "e"], "two")]
+    retriever = MultiStoreRetreiver(vectorstores=stores, embeddings=emb, k=5)
+    query_vector = retriever.get_query_vector("hello")
+
+    expected = sorted((s for vs in stores for s in vs.similarity_search_with_score_by_vector(query_vector, k=5)),
+                      key=lambda x: x[1], reverse=True)
+    assert [d.page_content for d in retriever.invoke("hello")] == [d.page_content for d, _ in expected]
+
+def test_without_embeddings_searches_by_query():
+    emb = CountingEmbedding()
+    stores = [_store(emb, ["a", "b"], "one"), _store(emb, ["c"], "two")]
+    emb.n_queries = 0
+    MultiStoreRetreiver(vectorstores=stores, k=2).invoke("hello")
+    assert emb.n_queries == 2
+
+class SlowStore(VectorStore):
+    def __init__(self, delay: float = 0, fail: bool = False):
+        self.delay = delay
+        self.fail = fail
+
+    def add_texts(self, *args, **kwargs): raise NotImplementedError
+
+    @classmethod
+    def from_texts(cls, *args, **kwargs): raise NotImplementedError
+
+    def similarity_search(self, *args, **kwargs): raise NotImplementedError
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4, **kwargs):
+        time.sleep(self.delay)
+        if self.fail:
+            raise ConnectionError("unreachable")
+        return [(Document(page_content="slow"), 1.0)]
+
+def test_slow_store_is_dropped():
+    emb = MockEmbedding()
+    stores = [_store(emb, ["a", "b"], "one"), SlowStore(delay=2)]
+    retriever = MultiStoreRetreiver(vectorstores=stores, embeddings=emb, k=2, store_timeout=0.2)
+
+    start = time.monotonic()
+    docs = retriever.invoke("hello")
+    assert time.monotonic() - start < 1.5
+    assert "slow" not in [d.page_content for d in docs]
+    assert len(docs) == 2
+
+def test_failing_store_is_dropped():
+    emb = MockEmbedding()
+    stores = [_store(emb, ["a", "b"], "one"), SlowStore(fail=True)]
+    docs = MultiStoreRetreiver(vectorstores=stores, embeddings=emb, k=2).invoke("hello")
+    assert len(docs) == 2
+
+def test_all_stores_failing_raises():
+    retriever = MultiStoreRetreiver(vectorstores=[SlowStore(fail=True)], embeddings=MockEmbedding())
+    with pytest.raises(ConnectionError):
+        retriever.invoke("hello")
+
+def test_async_same_as_sync():
+    emb = MockEmbedding()
+    stores = [_store(emb, ["a", "b", "c"], "one"), _store(emb, ["d", "e"], "two")]
+    retriever = MultiStoreRetreiver(vectorstores=stores, embeddings=emb, k=4)
+    sync_docs = retriever.invoke("hello")
+    async_docs = asyncio.run(retriever.ainvoke("hello"))
+    assert [d.page_content for d in sync_docs] == [d.page_content for d in async_docs]
+
+class CountingSlowStore(SlowStore):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.n_searches = 0
+
+    def similarity_search_with_score_by_vector(self, *args, **kwargs):
+        self.n_searches += 1
+        return super().similarity_search_with_score_by_vector(*args, **kwargs)
+
+    async def asimilarity_search_with_score_by_vector(self, *args, **kwargs):
+        self.n_searches += 1
+        await asyncio.sleep(self.delay)
+        return [(Document(page_content="slow"), 1.0)]
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_open_circuit_skips_slow_store(use_async):
+    emb = MockEmbedding()
+    slow = CountingSlowStore(delay=2)
+    breaker = CircuitBreaker("slow", latency_budget_s=0.1, failure_threshold=2)
+    retriever = MultiStoreRetreiver(vectorstores=[_store(emb, ["a", "b"], "one"), slow], embeddings=emb, k=2,
+                                    store_timeout=5, circuit_breakers=[None, breaker])
+    invoke = (lambda q: asyncio.run(retriever.ainvoke(q))) if use_async else retriever.invoke
+
+    for _ in range(2):
+        start = time.monotonic()
+        assert len(invoke("hello")) == 2
+        assert time.monotonic() - start < 1.5 # The latency budget, not the store timeout
+    assert breaker.state == circuit_breaker.OPEN
+
+    docs = invoke("hello")
+    assert slow.n_searches == 2
+    assert "slow" not in [d.page_content for d in docs]
+
+def test_cancelled_query_releases_trial_call():
+    slow = CountingSlowStore(delay=2)
+    breaker = CircuitBreaker("slow", open_s=0.05)
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+    time.sleep(0.1)
+    retriever = MultiStoreRetreiver(vectorstores=[slow], embeddings=MockEmbedding(), circuit_breakers=[breaker])
+
+    async def cancel_during_trial():
+        task = asyncio.ensure_future(retriever.ainvoke("hello"))
+        while not slow.n_searches:
+            await asyncio.sleep(0.01)
+        assert breaker.state == circuit_breaker.HALF_OPEN
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+    asyncio.run(cancel_during_trial())
+    assert breaker.allow()
+
+def test_all_stores_open_raises():
+    breaker = CircuitBreaker("failing", failure_threshold=1)
+    breaker.record_failure()
+    retriever = MultiStoreRetreiver(vectorstores=[SlowStore()], embeddings=MockEmbedding(), circuit_breakers=[breaker])
+    with pytest.raises(errors.CircuitOpenError):
+        retriever.invoke("hello")
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_max_context_tokens_packs_result(use_async):
+    emb = MockEmbedding()
+    texts = ["word " * 50, "other " * 50, "more " * 50, "last " * 50]
+    retriever = MultiStoreRetreiver(vectorstores=[_store(emb, texts, "one")], embeddings=emb, k=4,
+                                    max_context_tokens=120)
+    docs = asyncio.run(retriever.ainvoke("hello")) if use_async else retriever.invoke("hello")
+    assert 1 <= len(docs) < 4
+    assert sum(util.count_tokens(d.page_content) for d in docs) <= 120
+
+def test_async_slow_store_is_dropped():
+    emb = MockEmbedding()
+    stores = [_store(emb, ["a", "b"], "one"), SlowStore(delay=2)]
+    retriever = MultiStoreRetreiver(vectorstores=stores, embeddings=emb, k=2, store_timeout=0.2)
+    docs = asyncio.run(retriever.ainvoke("hello"))
+    assert "slow" not in [d.page_content for d in docs]
+
+def _keyword_index(tmp_path, texts):
+    idx = KeywordIndex(tmp_path / "keywords.sqlite")
+    idx.upsert([str(i) for i in range(len(texts))], [Document(page_content=t) for t in texts])
+    return idx
+
+def test_reciprocal_rank_fusion():
+    a, b, c = (Document(page_content=t) for t in "abc")
+    fused = reciprocal_rank_fusion([[a, b], [c, Document(page_content="b")]], k=3)
+    assert [d.page_content for d in fused] == ["b", "a", "c"]
+
+def test_hybrid_finds_exact_token(tmp_path):
+    emb = MockEmbedding()
+    texts = ["part GXB5 is discontinued", "unrelated text", "more unrelated text", "even more text", "last text"]
+    store = _store(emb, texts, "one")
+    retriever = MultiStoreRetreiver(vectorstores=[store], embeddings=emb, k=2,
+                                    keyword_index=_keyword_index(tmp_path, texts), retrieval_mode=HYBRID)
+    docs = retriever.invoke("Is GXB5 discontinued?")
+    assert len(docs) == 2
+    # Ranked first by keyword, so it beats the second best vector match whatever the vectors are
+    assert texts[0] in [d.page_content for d in docs]
+
+def test_keyword_mode_makes_no_embedding_or_store_calls(tmp_path):
+    emb = CountingEmbedding()
+    retriever = MultiStoreRetreiver(vectorstores=[SlowStore(fail=True)], embeddings=emb, k=2,
+                                    keyword_index=_keyword_index(tmp_path, ["a GXB5", "b"]), retrieval_mode=KEYWORD)
+    assert [d.page_content for d in retriever.invoke("GXB5")] == ["a GXB5"]
+    assert [d.page_content for d in asyncio.run(retriever.ainvoke("GXB5"))] == ["a GXB5"]
+    assert emb.n_queries == 0
+
+def test_hybrid_falls_back_to_keywords(tmp_path):
+    retriever = MultiStoreRetreiver(vectorstores=[SlowStore(fail=True)], embeddings=MockEmbedding(), k=2,
+                                    keyword_index=_keyword_index(tmp_path, ["a GXB5", "b"]), retrieval_mode=HYBRID)
+    assert [d.page_content for d in retriever.invoke("GXB5")] == ["a GXB5"]
@@ -1,6 +1,15 @@
+import os
 import pytest
 from os import path
+from unittest.mock import patch
 from alphageist.doc_generator import get_docs_from_file
+from alphageist.doc_generator import get_supported_file_paths
+from alphageist.doc_generator import iter_docs_from_files
+from alphageist.doc_generator import scan_files
+from alphageist.manifest import hash_file
+from alphageist.scan_rules import ScanRules
+from alphageist.util import LoadingContext
+from alphageist.errors import LoadingCancelled
 
 @pytest.mark.parametrize("filepath, expected_n_docs", [
     (path.join("test", "data", "ww2", "ww2.txt"), 147), # Works with UTF-8 encoding
@@ -20,3 +29,77 @@ from alphageist.doc_generator import get_docs_from_file
 def test_get_docs_from_file(filepath:str, expected_n_docs:int):
     res = get_docs_from_file(filepath)
     assert len(res) == expected_n_docs
+
+def _get_docs(dir_path, ctx, workers):
+    files = get_supported_file_paths(dir_path, ctx)
+    return [doc for _, docs, _ in iter_docs_from_files(files, ctx, workers) for doc in docs]
+
+def test_iter_docs_from_files_parallel_same_as_serial():
+    dir_path = path.join("test", "data")
+    assert _get_docs(dir_path, None, workers=1) == _get_docs(dir_path, None, workers=3)
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_iter_docs_from_files_hashes_files(workers):
+    files = list(get_supported_file_paths(path.join("test", "data")))
+    hashes = {file_path: content_hash for file_path, _, content_hash in iter_docs_from_files(files, None, workers)}
+    assert hashes == {file_path: hash_file(file_path) for file_path in files}
+
+def test_iter_docs_from_files_parallel_updates_ctx():
+    dir_path = path.join("test", "data")
+    ctx = LoadingContext()
+    _get_docs(dir_path, ctx, workers=2)
+    assert ctx.files_loaded == ctx.total_files
+
+def test_iter_docs_from_files_parallel_cancelled():
+    ctx = LoadingContext()
+    ctx.cancel()
+    with pytest.raises(LoadingCancelled):
+        _get_docs(path.join("test", "data"), ctx, workers=2)
+
+def test_scan_files_finds_same_files_as_os_walk():
+    dir_path = path.join("test", "data")
+    expected = {path.join(root, f) for root, _, files in os.walk(dir_path) for f in files}
+    assert set(scan_files(dir_path)) == expected
+
+def test_scan_files_same_order_as_sorted_os_walk(tmp_path):
+    for d in ("b", "a/z", "a/c/d", "c"):
+        (tmp_path / d).mkdir(parents=True)
+        for name in ("2.txt", "1.txt"):
+            (tmp_path / d / name).write_text("x")
+    (tmp_path / "0.txt").write_text("x")
+    expected = []
+    for root, dirs, files in os.walk(tmp_path):
+        dirs.sort()
+        expected.extend(path.join(root, f) for f in sorted(files))
+    for _ in range(5):
+        assert list(scan_files(tmp_path, workers=4)) == expected
+
+def test_scan_files_updates_ctx(tmp_path):
+    for d in ("a", "a/b", "c"):
+        (tmp_path / d).mkdir()
+        (tmp_path / d / "file.txt").write_text("x")
+    ctx = LoadingContext()
+    it = scan_files(tmp_path, ctx)
+    next(it)
+    assert ctx.total_files is None
+    assert ctx.files_found == 1
+    list(it)
+    assert ctx.total_files == ctx.files_found == 3
+
+def test_scan_files_filter(tmp_path):
+    (tmp_path / "a.txt").write_text("x")
+    (tmp_path / "b.jpeg").write_text("x")
+    assert list(scan_files(tmp_path, file_filter=lambda p: p.endswith(".txt"))) == [str(tmp_path / "a.txt")]
+
+def test_scan_files_prunes_excluded_dirs(tmp_path):
+    for d in ("keep", "node_modules", "node_modules/deep", "a/b/c"):
+        (tmp_path / d).mkdir(parents=True)
+        (tmp_path / d / "file.txt").write_text("x")
+    rules = ScanRules(exclude=["node_modules/"], max_depth=2)
+    with patch("alphageist.doc_generator.os.scandir", wraps=os.scandir) as scandir:
+        found = set(scan_files(tmp_path, rules=rules))
+
+    scanned = {str(c.args[0]) for c in scandir.call_args_list}
+    assert str(tmp_path / "node_modules") not in scanned
+    assert str(tmp_path / "a" / "b" / "c") not in scanned
+    assert found == {str(tmp_path / "keep" / "file.txt")}
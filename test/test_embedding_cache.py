@@ -0,0 +1,68 @@
+from typing import List
+import pytest
+
+from alphageist.embedding_cache import (
+    CachedEmbeddings,
+    EmbeddingCache,
+    get_cache_key,
+)
+
+from test.test_vectorstore import MockEmbedding
+
+class CountingEmbedding(MockEmbedding):
+    model = "mock-model"
+
+    def __init__(self):
+        super().__init__()
+        self.n_embedded = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.n_embedded += len(texts)
+        return super().embed_documents(texts)
+
+@pytest.fixture
+def cache(tmp_path):
+    c = EmbeddingCache(tmp_path / "cache.sqlite", max_size_mb=1)
+    yield c
+    c.close()
+
+def test_cache_key_ignores_whitespace_formatting():
+    assert get_cache_key("m", "hello   world\n") == get_cache_key("m", " hello world")
+
+def test_cache_key_depends_on_model():
+    assert get_cache_key("a", "hello") != get_cache_key("b", "hello")
+
+def test_put_get(cache):
+    cache.put_many({"a": [0.5, 1.0], "b": [2.0, 3.0]})
+    assert cache.get_many(["a", "b", "c"]) == {"a": [0.5, 1.0], "b": [2.0, 3.0]}
+
+def test_persisted(tmp_path):
+    c = EmbeddingCache(tmp_path / "cache.sqlite", max_size_mb=1)
+    c.put_many({"a": [0.5, 1.0]})
+    c.close()
+    c = EmbeddingCache(tmp_path / "cache.sqlite", max_size_mb=1)
+    assert c.get_many(["a"]) == {"a": [0.5, 1.0]}
+    c.close()
+
+def test_lru_eviction(cache):
+    vector = [0.0] * 1024 # 4 kB per entry, 256 entries fit in 1 MB
+    cache.put_many({"first": vector})
+    for i in range(300):
+        if i % 10 == 0:
+            cache.get_many(["first"]) # Keep it recently used
+        cache.put_many({str(i): vector})
+
+    assert cache.total_size <= cache.max_size
+    assert "first" in cache.get_many(["first"])
+    assert cache.get_many(["0"]) == {}
+
+def test_cached_embeddings_only_embeds_missing(cache):
+    emb = CountingEmbedding()
+    cached = CachedEmbeddings(emb, cache)
+    first = cached.embed_documents(["a", "b"])
+    second = cached.embed_documents(["b", "c", "a", "c"])
+
+    assert emb.n_embedded == 3
+    assert second[0] == first[1]
+    assert second[2] == first[0]
+    assert second[1] == second[3]
@@ -0,0 +1,48 @@
+import asyncio
+import threading
+from concurrent.futures import CancelledError
+
+import pytest
+
+from alphageist.event_loop import EventLoopThread, get_event_loop
+
+@pytest.fixture
+def loop_thread():
+    loop_thread = EventLoopThread()
+    yield loop_thread
+    loop_thread.stop()
+
+def test_submit_runs_on_loop_thread(loop_thread):
+    async def thread_name():
+        return threading.current_thread().name
+    assert loop_thread.run(thread_name()) == "alphageist-event-loop"
+    assert not loop_thread.in_loop()
+
+def test_cancel_future_cancels_task(loop_thread):
+    started = threading.Event()
+    cancelled = threading.Event()
+    async def wait_forever():
+        started.set()
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+    future = loop_thread.submit(wait_forever())
+    assert started.wait(timeout=5)
+    future.cancel()
+    assert cancelled.wait(timeout=5)
+    with pytest.raises(CancelledError):
+        future.result()
+
+def test_run_from_loop_raises(loop_thread):
+    async def nested():
+        async def inner():
+            return 1
+        loop_thread.run(inner())
+    with pytest.raises(RuntimeError):
+        loop_thread.run(nested())
+
+def test_shared_event_loop():
+    assert get_event_loop() is get_event_loop()
+    assert get_event_loop().run(asyncio.sleep(0, result=1)) == 1
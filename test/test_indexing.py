@@ -0,0 +1,229 @@
+import threading
+import time
+from os import path
+from typing import List
+import pytest
+
+from langchain.docstore.document import Document
+
+from alphageist import indexing
+from alphageist import local_index
+from alphageist import manifest
+from alphageist.doc_generator import (
+    iter_docs_from_files,
+    scan_files,
+)
+from alphageist.errors import LoadingCancelled
+from alphageist.manifest import Checkpoint
+from alphageist.util import (
+    LoadingContext,
+    estimate_tokens,
+)
+
+from test.test_vectorstore import (
+    BlockingEmbedding,
+    MockEmbedding,
+)
+
+data_dir = path.join("test", "data")
+
+@pytest.fixture(params=[local_index.NUMPY, local_index.QDRANT])
+def index(request, tmp_path):
+    idx = local_index.create_local_index(request.param, str(tmp_path / "db"), MockEmbedding())
+    yield idx
+    idx.close()
+
+class RecordingEmbedding(MockEmbedding):
+    def __init__(self):
+        super().__init__()
+        self.batch_sizes = []
+        self.batch_tokens = []
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.batch_sizes.append(len(texts))
+        self.batch_tokens.append(sum(estimate_tokens(t) for t in texts))
+        return super().embed_documents(texts)
+
+def _count_chunks(dir_path) -> int:
+    return sum(len(docs) for _, docs, _ in iter_docs_from_files(scan_files(dir_path), None))
+
+def test_threaded_yields_all_items():
+    assert list(indexing.threaded(range(100), maxsize=2)) == list(range(100))
+
+def test_threaded_reraises_exception():
+    def fail():
+        yield 1
+        raise ValueError("boom")
+    with pytest.raises(ValueError):
+        list(indexing.threaded(fail()))
+
+def test_batched():
+    assert list(indexing.batched(range(5), 2)) == [[0, 1], [2, 3], [4]]
+
+def test_index_files_same_chunks_as_iter_docs_from_files(index):
+    ids_by_file = indexing.index_files(scan_files(data_dir), index, MockEmbedding())
+    n_chunks = sum(len(ids) for ids in ids_by_file.values())
+
+    assert n_chunks == _count_chunks(data_dir)
+    assert index.count() == n_chunks
+    assert set(ids_by_file) == set(scan_files(data_dir))
+
+def test_index_files_embeds_in_batches(index):
+    emb = RecordingEmbedding()
+    ids_by_file = indexing.index_files(scan_files(data_dir), index, emb, batch_size=16)
+
+    assert max(emb.batch_sizes) <= 16
+    assert sum(emb.batch_sizes) == sum(len(ids) for ids in ids_by_file.values())
+
+def test_index_files_appends_without_recreate(index):
+    ww2 = path.join(data_dir, "ww2", "ww2.txt")
+    csv = path.join(data_dir, "Employees_list.csv")
+    indexing.index_files([ww2], index, MockEmbedding())
+    indexing.index_files([csv], index, MockEmbedding(), recreate=False)
+
+    assert index.count() == 147 + 26
+
+def test_index_files_no_supported_files(index, tmp_path):
+    empty_dir = tmp_path / "empty"
+    empty_dir.mkdir()
+    ids_by_file = indexing.index_files(scan_files(empty_dir), index, MockEmbedding())
+
+    assert ids_by_file == {}
+    assert not index.exists()
+
+def test_index_files_cancelled(index):
+    ctx = LoadingContext()
+    ctx.cancel()
+    with pytest.raises(LoadingCancelled):
+        indexing.index_files(scan_files(data_dir), index, MockEmbedding(), ctx=ctx)
+
+def test_index_files_counts_files_indexed(index):
+    ctx = LoadingContext()
+    file_paths = list(scan_files(data_dir))
+    indexing.index_files(file_paths, index, MockEmbedding(), ctx=ctx, batch_size=16)
+    assert ctx.files_indexed == len(file_paths)
+
+def test_index_files_records_from_calling_thread(index, tmp_path):
+    """Checkpoint records may save the manifest, which must not happen 
+    while another thread records a file"""
+    class RecordingCheckpoint(Checkpoint):
+        def record(self, file_path, chunk_ids, content_hash=None):
+            threads.add(threading.current_thread())
+            super().record(file_path, chunk_ids, content_hash)
+    threads = set()
+    docs_dir = tmp_path / "docs"
+    docs_dir.mkdir()
+    for n in range(20):
+        (docs_dir / f"{n:02}.txt").write_text("" if n % 2 else f"file {n}")
+    file_paths = list(scan_files(docs_dir))
+    checkpoint = RecordingCheckpoint(tmp_path / "manifest.json")
+    ctx = LoadingContext()
+    indexing.index_files(file_paths, index, MockEmbedding(), ctx=ctx, batch_size=2, checkpoint=checkpoint)
+
+    assert threads == {threading.current_thread()}
+    assert set(checkpoint.manifest.files) == set(file_paths)
+    assert ctx.files_indexed == len(file_paths)
+
+def test_index_files_hashes_when_parsing(index, tmp_path, monkeypatch):
+    file_paths = list(scan_files(path.join(data_dir, "ww2")))
+    content_hashes = {}
+    checkpoint = Checkpoint(tmp_path / "manifest.json")
+    def no_hashing(file_path):
+        raise AssertionError("Files are hashed in the parse workers")
+    monkeypatch.setattr(manifest, "hash_file", no_hashing)
+    indexing.index_files(file_paths, index, MockEmbedding(), workers=2, checkpoint=checkpoint, content_hashes=content_hashes)
+
+    assert content_hashes.keys() == checkpoint.manifest.files.keys() == set(file_paths)
+    assert all(checkpoint.manifest.files[f].content_hash == content_hashes[f] for f in file_paths)
+
+class RateLimitError(Exception):
+    status_code = 429
+
+class RateLimitedEmbedding(RecordingEmbedding):
+    """Rate limits every other request"""
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        if self.calls % 2:
+            raise RateLimitError()
+        return super().embed_documents(texts)
+
+def test_index_files_batches_within_token_budget(index, monkeypatch):
+    monkeypatch.setattr(indexing, "MIN_BATCH_TOKENS", 1)
+    emb = RecordingEmbedding()
+    max_tokens = 2000
+    indexing.index_files(scan_files(data_dir), index, emb, max_batch_tokens=max_tokens)
+    assert len(emb.batch_sizes) > 1
+    assert all(tokens <= max_tokens for tokens in emb.batch_tokens)
+
+def test_token_batcher():
+    docs = [("f", Document(page_content="x" * 400, metadata={}), False) for _ in range(5)] # 101 tokens each
+    batcher = indexing._TokenBatcher(docs)
+    assert len(batcher.take(250, 10)) == 2
+    assert len(batcher.take(50, 10)) == 1 # Chunks larger than the budget are sent alone
+    assert len(batcher.take(1000, 1)) == 1
+    assert len(batcher.take(1000, 10)) == 1
+    assert batcher.take(1000, 10) == []
+
+def test_index_files_concurrent_same_chunks(index):
+    ctx = LoadingContext()
+    file_paths = list(scan_files(data_dir))
+    ids_by_file = indexing.index_files(file_paths, index, MockEmbedding(), ctx=ctx, batch_size=8, concurrency=4)
+
+    assert sum(len(ids) for ids in ids_by_file.values()) == _count_chunks(data_dir)
+    assert ctx.files_indexed == len(file_paths)
+    assert ctx.chunks_embedded == index.count()
+    assert ctx.tokens_embedded > ctx.chunks_embedded
+    assert ctx.chunks_per_sec > 0
+
+def test_index_files_retries_rate_limited(index, monkeypatch):
+    monkeypatch.setattr(indexing, "BACKOFF_BASE_S", 0.001)
+    emb = RateLimitedEmbedding()
+    ids_by_file = indexing.index_files(scan_files(data_dir), index, emb, batch_size=64, concurrency=2)
+    assert index.count() == sum(len(ids) for ids in ids_by_file.values()) == sum(emb.batch_sizes)
+
+def test_index_files_gives_up_after_max_retries(index, monkeypatch):
+    monkeypatch.setattr(indexing, "BACKOFF_BASE_S", 0.001)
+    monkeypatch.setattr(indexing, "MAX_RETRIES", 2)
+    class AlwaysRateLimited(MockEmbedding):
+        def embed_documents(self, texts):
+            raise RateLimitError()
+    with pytest.raises(RateLimitError):
+        indexing.index_files(scan_files(data_dir), index, AlwaysRateLimited())
+
+def test_adaptive_limit():
+    limit = indexing.AdaptiveLimit(8, 10000)
+    limit.on_rate_limited(0)
+    assert (limit.concurrency, limit.batch_tokens) == (4, 5000)
+    assert limit.on_rate_limited(0, retry_after=3) == 3
+    assert (limit.concurrency, limit.batch_tokens) == (2, 2500)
+    for _ in range(20):
+        limit.on_success()
+    assert (limit.concurrency, limit.batch_tokens) == (8, 10000)
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_index_files_cancel_abandons_in_flight_requests(index, workers):
+    ctx = LoadingContext()
+    emb = BlockingEmbedding()
+    errors = []
+    def run():
+        try:
+            indexing.index_files(scan_files(data_dir), index, emb, ctx=ctx, workers=workers)
+        except Exception as e:
+            errors.append(e)
+    t = threading.Thread(target=run)
+    t.start()
+    assert emb.started.wait(10)
+    start = time.monotonic()
+    ctx.cancel()
+    t.join(2)
+    try:
+        assert not t.is_alive()
+        assert time.monotonic() - start < 2
+        assert len(errors) == 1 and isinstance(errors[0], LoadingCancelled)
+        assert index.count() == 0
+    finally:
+        emb.release.set()
@@ -0,0 +1,82 @@
+from langchain.docstore.document import Document
+
+from alphageist.doc_generator import escape_unicode
+from alphageist.util import string_to_raw_string
+
+from alphageist.keyword_index import (
+    KeywordIndex,
+    to_match_query,
+)
+
+TEXTS = [
+    "The GXB5 valve is rated for 10 bar",
+    "Valves of the GXA series are rated for 6 bar",
+    "Anna Svensson is responsible for procurement",
+    "Pumps and valves are inspected every year",
+]
+
+def _index(tmp_path) -> KeywordIndex:
+    idx = KeywordIndex(tmp_path / "keywords.sqlite")
+    idx.upsert([f"id{i}" for i in range(len(TEXTS))],
+               [Document(page_content=t, metadata={"source": f"file_{i}.txt"}) for i, t in enumerate(TEXTS)])
+    return idx
+
+def test_to_match_query():
+    assert to_match_query('What is "GXB5" AND NOT x*?') == '"what" OR "is" OR "gxb5" OR "and" OR "not" OR "x"'
+    assert to_match_query("?!") is None
+
+def test_search_exact_token(tmp_path):
+    idx = _index(tmp_path)
+    doc, score = idx.search("what pressure is gxb5 rated for?", k=2)[0]
+    assert doc.page_content == TEXTS[0]
+    assert doc.metadata == {"source": "file_0.txt"}
+    assert score > 0
+
+def test_search_ranks_by_bm25(tmp_path):
+    idx = _index(tmp_path)
+    assert [d.page_content for d, _ in idx.search("Svensson procurement", k=4)] == [TEXTS[2]]
+    scores = [score for _, score in idx.search("valve bar", k=4)]
+    assert scores == sorted(scores, reverse=True)
+
+def test_search_no_words(tmp_path):
+    assert _index(tmp_path).search("?", k=4) == []
+
+def test_upsert_replaces_and_delete(tmp_path):
+    idx = _index(tmp_path)
+    idx.upsert(["id0"], [Document(page_content="replaced", metadata={})])
+    assert idx.count() == len(TEXTS)
+    assert idx.search("GXB5") == []
+    idx.delete(["id0", "id1"])
+    assert idx.count() == len(TEXTS) - 2
+    assert idx.search("replaced") == []
+
+def test_drop_and_reopen(tmp_path):
+    idx = _index(tmp_path)
+    idx.close()
+    reopened = KeywordIndex(tmp_path / "keywords.sqlite")
+    assert reopened.count() == len(TEXTS)
+    reopened.drop()
+    assert reopened.count() == 0
+    assert reopened.search("valves") == []
+    reopened.destroy()
+    assert not (tmp_path / "keywords.sqlite").exists()
+
+def test_search_escaped_unicode(tmp_path):
+    # Chunks are indexed after doc_generator.escape_unicode
+    idx = KeywordIndex(tmp_path / "keywords.sqlite")
+    texts = ["Mina bostadsköer i Göteborg", "Ett kontor i Malmö"]
+    idx.upsert(["a", "b"], escape_unicode([Document(page_content=t, metadata={}) for t in texts]))
+    assert [d.page_content for d, _ in idx.search("bostadsköer")] == [string_to_raw_string(texts[0])]
+    assert [d.page_content for d, _ in idx.search("Goteborg")] == [string_to_raw_string(texts[0])]
+    assert [d.page_content for d, _ in idx.search("malmö")] == [string_to_raw_string(texts[1])]
+
+def test_upsert_lone_surrogate(tmp_path):
+    idx = KeywordIndex(tmp_path / "keywords.sqlite")
+    content = string_to_raw_string("broken \ud835 text")
+    idx.upsert(["a"], [Document(page_content=content, metadata={})])
+    assert [d.page_content for d, _ in idx.search("broken")] == [content]
+
+def test_search_when_closed(tmp_path):
+    idx = _index(tmp_path)
+    idx.close()
+    assert idx.search("GXB5") == []
@@ -0,0 +1,245 @@
+import uuid
+import numpy as np
+import pytest
+
+from langchain.docstore.document import Document
+
+from alphageist import local_index
+from alphageist.local_index import NumpyIndex
+
+from test.test_vectorstore import MockEmbedding
+
+DIM = 8
+
+def _docs(n: int, offset: int = 0) -> list[Document]:
+    return [Document(page_content=f"chunk {i}", metadata={"source": f"file_{i}.txt"}) for i in range(offset, offset + n)]
+
+def _ids(n: int, offset: int = 0) -> list[str]:
+    return [f"id{i}" for i in range(offset, offset + n)]
+
+@pytest.fixture
+def vectors():
+    return np.random.default_rng(0).normal(size=(200, DIM)).astype(np.float32)
+
+@pytest.fixture
+def index(tmp_path, vectors):
+    idx = NumpyIndex(str(tmp_path), MockEmbedding())
+    idx.create(DIM)
+    idx.upsert(_ids(len(vectors)), vectors.tolist(), _docs(len(vectors)))
+    yield idx
+    idx.close()
+
+def _expected_top_k(vectors: np.ndarray, query: np.ndarray, k: int) -> list[str]:
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    scores = normalized @ (query / np.linalg.norm(query))
+    return [f"id{i}" for i in np.argsort(-scores)[:k]]
+
+def test_top_k():
+    idx, values = local_index.top_k(np.array([[0.1, 0.9, 0.5, 0.7]]), 2)
+    assert set(idx[0]) == {1, 3}
+    assert set(values[0]) == {0.9, 0.7}
+
+def test_search_matches_brute_force(index, vectors, monkeypatch):
+    monkeypatch.setattr(local_index, "SEARCH_BLOCK_ROWS", 32)
+    queries = np.random.default_rng(1).normal(size=(5, DIM)).astype(np.float32)
+    results = index.search(queries.tolist(), k=7)
+
+    for query, res in zip(queries, results):
+        assert [i for i, _, _ in res] == _expected_top_k(vectors, query, 7)
+        scores = [score for _, _, score in res]
+        assert scores == sorted(scores, reverse=True)
+
+def test_similarity_search_with_score_by_vector(index, vectors):
+    res = index.similarity_search_with_score_by_vector(vectors[3].tolist(), k=4)
+    doc, score = res[0]
+    assert doc.page_content == "chunk 3"
+    assert doc.metadata == {"source": "file_3.txt"}
+    assert score == pytest.approx(1.0)
+    assert len(res) == 4
+
+def test_search_fewer_points_than_k(tmp_path):
+    idx = NumpyIndex(str(tmp_path), MockEmbedding())
+    idx.create(DIM)
+    idx.upsert(_ids(2), np.eye(DIM)[:2].tolist(), _docs(2))
+    assert len(idx.search([np.eye(DIM)[0].tolist()], k=4)[0]) == 2
+
+def test_search_empty_index(tmp_path):
+    idx = NumpyIndex(str(tmp_path), MockEmbedding())
+    assert idx.search([[1.0] * DIM], k=4) == [[]]
+    assert not idx.exists()
+    assert idx.count() == 0
+
+def test_delete_points(index, vectors):
+    index.delete_points(["id3"])
+    assert index.count() == len(vectors) - 1
+    res = index.search([vectors[3].tolist()], k=len(vectors))[0]
+    assert "id3" not in [i for i, _, _ in res]
+
+def test_upsert_replaces_existing_id(index, vectors):
+    index.upsert(["id3"], [vectors[4].tolist()], [Document(page_content="new", metadata={})])
+    assert index.count() == len(vectors)
+    res = index.search([vectors[4].tolist()], k=2)[0]
+    assert {i for i, _, _ in res} == {"id3", "id4"}
+
+def test_compact(index, vectors, monkeypatch):
+    monkeypatch.setattr(local_index, "COMPACT_MIN_DEAD_ROWS", 10)
+    deleted = _ids(150)
+    index.delete_points(deleted)
+
+    assert len(list(index.path.glob("vectors.*.f32"))) == 1
+    assert index.count() == 50
+    query = vectors[160]
+    res = index.search([query.tolist()], k=5)[0]
+    assert [i for i, _, _ in res] == [f"id{150 + int(i[2:])}" for i in _expected_top_k(vectors[150:], query, 5)]
+
+def test_reopen(index, vectors, tmp_path):
+    index.delete_points(["id0"])
+    index.close()
+
+    reopened = NumpyIndex(str(tmp_path), MockEmbedding())
+    assert reopened.exists()
+    assert reopened.count() == len(vectors) - 1
+    query = vectors[10]
+    assert [i for i, _, _ in reopened.search([query.tolist()], k=3)[0]] == [i for i in _expected_top_k(vectors, query, 4) if i != "id0"][:3]
+    reopened.close()
+
+def test_reopen_truncates_partial_row(index, vectors, tmp_path):
+    index.close()
+    vectors_path = next(tmp_path.glob("vectors.*.f32"))
+    with open(vectors_path, 'ab') as f:
+        f.write(b"\0" * 5)
+
+    reopened = NumpyIndex(str(tmp_path), MockEmbedding())
+    reopened.upsert(["new"], [vectors[0].tolist()], _docs(1))
+    res = reopened.search([vectors[0].tolist()], k=2)[0]
+    assert {i for i, _, _ in res} == {"id0", "new"}
+    reopened.close()
+
+def test_drop(index):
+    index.drop()
+    assert not index.exists()
+    assert index.count() == 0
+    index.create(DIM)
+    assert index.count() == 0
+
+def test_add_texts_and_similarity_search(tmp_path):
+    idx = NumpyIndex(str(tmp_path), MockEmbedding())
+    idx.add_texts(["hello", "world"], metadatas=[{"source": "a"}, {"source": "b"}])
+    assert idx.count() == 2
+    assert len(idx.similarity_search("hello", k=1)) == 1
+
+@pytest.mark.parametrize("quantization", [local_index.FLOAT16, local_index.INT8, local_index.BINARY])
+def test_quantized_search_rescores(tmp_path, quantization):
+    vectors = np.random.default_rng(0).normal(size=(500, 64)).astype(np.float32)
+    idx = NumpyIndex(str(tmp_path), MockEmbedding(), quantization)
+    idx.create(64)
+    idx.upsert(_ids(len(vectors)), vectors.tolist(), _docs(len(vectors)))
+
+    query = vectors[7] + 0.1
+    res = idx.search([query.tolist()], k=4)[0]
+    expected = _expected_top_k(vectors, query, 4)
+    assert len({i for i, _, _ in res} & set(expected)) >= 3
+    assert res[0][0] == "id7"
+    # Scores come from the original vectors
+    assert res[0][2] == pytest.approx(float(vectors[7] @ query / np.linalg.norm(vectors[7]) / np.linalg.norm(query)), abs=1e-5)
+    idx.close()
+
+def test_int8_codec_round_trip():
+    codec = local_index.CODECS[local_index.INT8]
+    vectors = local_index._normalize(np.random.default_rng(0).normal(size=(10, 32)).astype(np.float32))
+    scores = codec.scores(codec.encode(vectors), vectors)
+    assert np.allclose(np.diag(scores), 1, atol=0.02)
+
+def test_binary_codec_pads_to_uint16():
+    codec = local_index.CODECS[local_index.BINARY]
+    assert codec.encode(np.ones((2, 20), dtype=np.float32)).shape == (2, 4)
+
+def test_changing_quantization_requantizes(index, vectors, tmp_path):
+    index.close()
+    quantized = NumpyIndex(str(tmp_path), MockEmbedding(), local_index.INT8)
+    assert [i for i, _, _ in quantized.search([vectors[5].tolist()], k=1)[0]] == ["id5"]
+    quantized.delete_points(["id5"])
+    quantized.close()
+
+    reopened = NumpyIndex(str(tmp_path), MockEmbedding())
+    assert list(tmp_path.glob("vectors.*")) == [reopened._vectors_path(reopened._generation)]
+    assert reopened.count() == len(vectors) - 1
+    reopened.close()
+
+def test_quantized_compact(tmp_path, vectors, monkeypatch):
+    monkeypatch.setattr(local_index, "COMPACT_MIN_DEAD_ROWS", 10)
+    idx = NumpyIndex(str(tmp_path), MockEmbedding(), local_index.BINARY)
+    idx.create(DIM)
+    idx.upsert(_ids(len(vectors)), vectors.tolist(), _docs(len(vectors)))
+    idx.delete_points(_ids(150))
+
+    assert len(list(tmp_path.glob("vectors.*"))) == 2
+    assert [i for i, _, _ in idx.search([vectors[170].tolist()], k=1)[0]] == ["id170"]
+    idx.close()
+
+@pytest.mark.parametrize("backend", [local_index.NUMPY, local_index.QDRANT])
+def test_new_version_made_current(tmp_path, backend):
+    idx = local_index.create_local_index(backend, str(tmp_path), MockEmbedding())
+    idx.create(DIM)
+    idx.upsert([uuid.uuid4().hex], [[1.0] * DIM], _docs(1))
+    new = idx.new_version(MockEmbedding())
+    new.create(DIM)
+    new.upsert([uuid.uuid4().hex for _ in range(2)], np.eye(DIM)[:2].tolist(), _docs(2))
+
+    assert new.version == idx.version + 1
+    assert new.manifest_path != idx.manifest_path
+    assert sorted(idx.versions()) == [0, 1]
+    new.make_current()
+    idx.destroy()
+    assert new.versions() == [1]
+    new.close()
+
+    reopened = local_index.create_local_index(backend, str(tmp_path), MockEmbedding())
+    assert reopened.version == 1
+    assert reopened.count() == 2
+    reopened.close()
+
+@pytest.mark.parametrize("backend", [local_index.NUMPY, local_index.QDRANT])
+def test_create_local_index_removes_unfinished_versions(tmp_path, backend):
+    idx = local_index.create_local_index(backend, str(tmp_path), MockEmbedding())
+    idx.create(DIM)
+    unfinished = idx.new_version(MockEmbedding())
+    unfinished.create(DIM)
+    idx.close()
+    if backend == local_index.NUMPY:
+        unfinished.close()
+
+    reopened = local_index.create_local_index(backend, str(tmp_path), MockEmbedding())
+    assert reopened.version == 0
+    assert reopened.versions() == [0]
+    reopened.close()
+
+@pytest.mark.parametrize("backend", [local_index.NUMPY, local_index.QDRANT])
+def test_keywords_follow_collection(tmp_path, backend):
+    idx = local_index.create_local_index(backend, str(tmp_path), MockEmbedding())
+    idx.create(DIM)
+    ids = [uuid.uuid4().hex for _ in range(3)]
+    idx.upsert(ids, np.eye(DIM)[:3].tolist(), _docs(3))
+    assert idx.keywords.count() == 3
+    assert idx.keywords.search("chunk 1", k=3)[0][0].page_content == "chunk 1"
+
+    idx.delete_points(ids[:1])
+    assert idx.keywords.count() == 2
+    idx.drop()
+    assert idx.keywords.count() == 0
+    idx.close()
+
+@pytest.mark.parametrize("backend", [local_index.NUMPY, local_index.QDRANT])
+def test_rebuild_keywords(tmp_path, backend):
+    idx = local_index.create_local_index(backend, str(tmp_path), MockEmbedding())
+    idx.create(DIM)
+    idx.upsert([uuid.uuid4().hex for _ in range(5)], np.eye(DIM)[:5].tolist(), _docs(5))
+    idx.keywords.drop()
+    assert not idx.keywords_in_sync()
+
+    idx.rebuild_keywords()
+    assert idx.keywords_in_sync()
+    doc, _ = idx.keywords.search("4", k=1)[0]
+    assert doc.page_content == "chunk 4"
+    assert doc.metadata == {"source": "file_4.txt"}
+    idx.close()
@@ -0,0 +1,96 @@
+import os
+import pytest
+
+from alphageist.manifest import (
+    Checkpoint,
+    Manifest,
+    get_manifest_path,
+)
+from alphageist.errors import LoadingCancelled
+from alphageist.util import LoadingContext
+
+@pytest.fixture
+def files(tmp_path):
+    paths = []
+    for name in ("a.txt", "b.txt", "c.txt"):
+        p = tmp_path / name
+        p.write_text(f"content of {name}")
+        paths.append(str(p))
+    return paths
+
+@pytest.fixture
+def manifest(files):
+    m = Manifest()
+    for n, file_path in enumerate(files):
+        m.record(file_path, [f"id{n}"])
+    return m
+
+def test_diff_unchanged(manifest, files):
+    assert not manifest.diff(files)
+
+def test_diff_cancelled(manifest, files):
+    ctx = LoadingContext()
+    ctx.cancel()
+    with pytest.raises(LoadingCancelled):
+        manifest.diff(files, ctx)
+
+def test_diff_added(manifest, files, tmp_path):
+    new_file = tmp_path / "d.txt"
+    new_file.write_text("new")
+    diff = manifest.diff(files + [str(new_file)])
+    assert diff.added == [str(new_file)]
+    assert diff.modified == [] and diff.deleted == []
+
+def test_diff_modified(manifest, files):
+    with open(files[1], 'a') as f:
+        f.write(" and more")
+    diff = manifest.diff(files)
+    assert diff.modified == [files[1]]
+    assert diff.added == [] and diff.deleted == []
+
+def test_diff_touched_is_not_modified(manifest, files):
+    st = os.stat(files[0])
+    os.utime(files[0], (st.st_atime, st.st_mtime + 10))
+    assert not manifest.diff(files)
+    assert manifest.files[files[0]].mtime == st.st_mtime + 10
+
+def test_diff_deleted(manifest, files):
+    os.remove(files[2])
+    diff = manifest.diff(files[:2])
+    assert diff.deleted == [files[2]]
+
+def test_chunk_ids_and_remove(manifest, files):
+    assert manifest.chunk_ids(files[:2]) == ["id0", "id1"]
+    assert manifest.remove(files[0]) == ["id0"]
+    assert files[0] not in manifest
+
+def test_save_load(manifest, files, tmp_path):
+    manifest_path = get_manifest_path(str(tmp_path))
+    manifest.save(manifest_path)
+    loaded = Manifest.load(manifest_path)
+    assert loaded is not None
+    assert {p: e.to_dict() for p, e in loaded.files.items()} == \
+           {p: e.to_dict() for p, e in manifest.files.items()}
+
+def test_load_missing(tmp_path):
+    assert Manifest.load(get_manifest_path(str(tmp_path))) is None
+
+def test_load_corrupt(tmp_path):
+    manifest_path = get_manifest_path(str(tmp_path))
+    manifest_path.write_text("{not json")
+    assert Manifest.load(manifest_path) is None
+
+def test_checkpoint_orphan_ids(files, tmp_path):
+    checkpoint = Checkpoint(get_manifest_path(str(tmp_path)))
+    assert not checkpoint.exists()
+    checkpoint.log_ids(["id0", "id1"])
+    checkpoint.record(files[0], ["id0"])
+    checkpoint.log_ids(["id2"])
+    checkpoint.save()
+
+    reloaded = Checkpoint(get_manifest_path(str(tmp_path)))
+    assert reloaded.exists()
+    assert files[0] in reloaded.manifest
+    assert sorted(reloaded.orphan_ids()) == ["id1", "id2"]
+    reloaded.remove()
+    assert not reloaded.exists()
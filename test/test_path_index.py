@@ -0,0 +1,66 @@
+import os
+
+from alphageist import path_index
+from alphageist.path_index import PathIndex
+
+ROOT = os.path.join(os.sep, "home", "docs")
+
+def _path(*parts: str) -> str:
+    return os.path.join(ROOT, *parts)
+
+def test_search_substring_ignoring_case():
+    idx = PathIndex(ROOT, [_path("Reports", "Q3.pdf"), _path("notes.txt")])
+    assert idx.search("report") == [_path("Reports", "Q3.pdf")]
+    assert idx.search("NOTES") == [_path("notes.txt")]
+    assert idx.search("missing") == []
+    assert idx.search("  ") == []
+
+def test_search_requires_every_word():
+    idx = PathIndex(ROOT, [_path("sales", "budget.xlsx"), _path("hr", "budget.xlsx")])
+    assert idx.search("budget sales") == [_path("sales", "budget.xlsx")]
+
+def test_search_does_not_match_root():
+    idx = PathIndex(ROOT, [_path("a.txt")])
+    assert idx.search("home") == []
+
+def test_file_name_matches_rank_first():
+    paths = [_path("gearbox", "a_long_report_name.txt"), _path("x", "gearbox_specs.pdf"), _path("gearbox.txt")]
+    idx = PathIndex(ROOT, paths)
+    assert idx.search("gearbox") == [_path("gearbox.txt"), _path("x", "gearbox_specs.pdf"), paths[0]]
+    assert idx.search("gearbox", limit=1) == [_path("gearbox.txt")]
+
+def test_add_remove_replace():
+    idx = PathIndex(ROOT)
+    idx.add(_path("a.txt"))
+    idx.add(_path("a.txt"))
+    idx.add(_path("b.txt"))
+    assert len(idx) == 2
+    assert idx.search("a.txt") == [_path("a.txt")]
+
+    idx.remove(_path("a.txt"))
+    idx.remove(_path("missing.txt"))
+    assert idx.search("a.txt") == []
+    idx.add(_path("c.txt"))
+    assert idx.search("c.txt") == [_path("c.txt")]
+
+    idx.replace([_path("d.txt")])
+    assert idx.search(".txt") == [_path("d.txt")]
+
+def test_paths_differing_in_case():
+    idx = PathIndex(ROOT, [_path("A.txt"), _path("a.txt")])
+    assert sorted(idx.search("a.txt")) == [_path("A.txt"), _path("a.txt")]
+    idx.remove(_path("a.txt"))
+    assert idx.search("a.txt") == [_path("A.txt")]
+
+def test_track_adds_while_iterating():
+    idx = PathIndex(ROOT)
+    tracked = idx.track(iter([_path("a.txt"), _path("b.txt")]))
+    assert next(tracked) == _path("a.txt")
+    assert idx.search("txt") == [_path("a.txt")]
+    assert list(tracked) == [_path("b.txt")]
+    assert len(idx.search("txt")) == 2
+
+def test_broad_query_scans_bounded_number_of_paths(monkeypatch):
+    monkeypatch.setattr(path_index, "MAX_CANDIDATES", 5)
+    idx = PathIndex(ROOT, [_path(f"file{i}.txt") for i in range(20)])
+    assert len(idx.search("file", limit=100)) == 5
@@ -0,0 +1,30 @@
+import pytest
+
+from langchain.chains.qa_with_sources import stuff_prompt
+
+from alphageist import prompt
+from alphageist.query import get_sources_from_answer
+
+def test_lean_prompt_asks_for_parsed_sources_format():
+    text = prompt.get_prompt(prompt.LEAN).format(summaries="Content: x\nSource: a.txt", question="q?")
+    assert '"SOURCES: "' in text
+    assert get_sources_from_answer("An answer\nSOURCES: a.txt,b.txt") == ["a.txt", "b.txt"]
+
+def test_get_prompt():
+    assert prompt.get_prompt(None).template == prompt.LEAN_TEMPLATE
+    assert prompt.get_prompt(prompt.LANGCHAIN) is stuff_prompt.PROMPT
+    custom = prompt.get_prompt("Q: {question}\n{summaries}\nA:")
+    assert custom.format(question="q", summaries="s") == "Q: q\ns\nA:"
+    with pytest.raises(ValueError):
+        prompt.get_prompt("Q: {question}")
+
+@pytest.mark.parametrize("template, expected", [
+    ("{summaries} {question}", True),
+    ("{summaries}", False),
+    ("{summaries} {question} {context}", False),
+    ("{summaries} {question} {", False),
+    ("{summaries} {question} {{literal}}", True),
+    (prompt.LEAN, False),
+])
+def test_is_custom_template(template, expected):
+    assert prompt.is_custom_template(template) == expected
@@ -0,0 +1,53 @@
+import pytest
+
+from alphageist.scan_rules import ScanRules
+from alphageist import config as cfg
+
+@pytest.mark.parametrize("pattern, rel_path, is_dir, expected", [
+    ("*.log", "a.log", False, True),
+    ("*.log", "dir/sub/a.log", False, True),
+    ("*.log", "a.log.txt", False, False),
+    (".git/", ".git", True, True),
+    (".git/", "project/.git", True, True),
+    (".git/", ".git", False, False), # Only matches directories
+    ("backup/*.pdf", "backup/a.pdf", False, True),
+    ("backup/*.pdf", "other/backup/a.pdf", False, False), # Anchored to the root
+    ("backup/*.pdf", "backup/sub/a.pdf", False, False),
+    ("backup/**/*.pdf", "backup/sub/deeper/a.pdf", False, True),
+    ("**/archive", "x/y/archive", True, True),
+    ("report_?.docx", "report_1.docx", False, True),
+    ("report_[0-9].docx", "report_a.docx", False, False),
+])
+def test_exclude_pattern(pattern, rel_path, is_dir, expected):
+    rules = ScanRules(exclude=[pattern])
+    if is_dir:
+        assert rules.walk_dir(rel_path, 1) is not expected
+    else:
+        assert rules.include_file(rel_path) is not expected
+
+def test_negated_pattern_reincludes():
+    rules = ScanRules(exclude=["*.csv", "!keep.csv"])
+    assert not rules.include_file("a.csv")
+    assert rules.include_file("dir/keep.csv")
+
+def test_include_patterns():
+    rules = ScanRules(include=["*.pdf", "docs/**"])
+    assert rules.include_file("a/b.pdf")
+    assert rules.include_file("docs/notes.txt")
+    assert not rules.include_file("notes.txt")
+
+def test_max_file_size():
+    rules = ScanRules(max_file_size_mb=1)
+    assert rules.include_file("a.pdf", 1024)
+    assert not rules.include_file("a.pdf", 2 * 1024 * 1024)
+
+def test_max_depth():
+    rules = ScanRules(max_depth=2)
+    assert rules.walk_dir("a/b", 2)
+    assert not rules.walk_dir("a/b/c", 3)
+
+def test_from_config_defaults():
+    rules = ScanRules.from_config(cfg.get_default_config())
+    assert not rules.walk_dir("project/node_modules", 2)
+    assert rules.walk_dir("project/src", 2)
+    assert rules.max_file_size is None and rules.max_depth is None
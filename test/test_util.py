@@ -1,5 +1,9 @@
+import time
+import threading
+from concurrent.futures import Future
 from unittest.mock import Mock
 import pytest
+import tiktoken
 from alphageist import util
 from alphageist import state
 from alphageist import errors
@@ -10,6 +14,13 @@ def test_string_to_raw_string():
     rs = r"\ud835"
     assert util.string_to_raw_string(s) == rs
 
+@pytest.mark.parametrize("s", ["Mina bostadsköer", "C:\\new\n\t😀", "plain"])
+def test_raw_string_to_string(s):
+    assert util.raw_string_to_string(util.string_to_raw_string(s)) == s
+
+def test_raw_string_to_string_invalid_escape():
+    assert util.raw_string_to_string("C:\\x") == "C:\\x"
+
 class A(util.StateSubscriptionMixin):
         def __init__(self, initial_state):
             super().__init__()
@@ -68,3 +79,56 @@ def test_allowed_states_decorator_incorrect_state():
     assert exec_info.value.allowed_states == {state.STANDBY, state.LOADING}
 
 
+
+def test_lru_cache_evicts_least_recently_used():
+    c = util.LRUCache(2)
+    c.put("a", 1)
+    c.put("b", 2)
+    c.get("a")
+    c.put("c", 3)
+    assert "a" in c and "c" in c
+    assert "b" not in c
+    assert len(c) == 2
+
+def test_lru_cache_default():
+    assert util.LRUCache(1).get("missing", 5) == 5
+
+def test_estimate_tokens():
+    assert util.estimate_tokens("") == 1
+    assert util.estimate_tokens("x" * 400) == 101
+
+def test_loading_context_embedding_rates():
+    ctx = util.LoadingContext()
+    assert ctx.chunks_per_sec == 0
+    ctx.add_embedded(10, 500)
+    ctx.add_embedded(5, 100)
+    assert ctx.chunks_embedded == 15
+    assert ctx.tokens_embedded == 600
+    assert ctx.tokens_per_sec > ctx.chunks_per_sec > 0
+
+def test_wait_result_cancelled():
+    ctx = util.LoadingContext()
+    future = Future()
+    ctx.cancel()
+    with pytest.raises(errors.LoadingCancelled):
+        util.wait_result(future, ctx)
+    future.set_result(1)
+    assert util.wait_result(future, None) == 1
+
+def test_count_tokens_does_not_wait_for_tokenizer(monkeypatch):
+    release = threading.Event()
+    def get_encoding(name):
+        release.wait(timeout=5) # Like a download that does not answer
+        return Mock(encode=lambda text, **kwargs: text.split())
+    monkeypatch.setattr(tiktoken, "get_encoding", get_encoding)
+    monkeypatch.setattr(util, "_tokenizer", None)
+    monkeypatch.setattr(util, "_tokenizer_loading", False)
+
+    util.start_loading_tokenizer()
+    assert util.count_tokens("a b c d e f g h") == util.estimate_tokens("a b c d e f g h")
+    release.set()
+    for _ in range(500):
+        if util._tokenizer is not None:
+            break
+        time.sleep(0.01)
+    assert util.count_tokens("a b c d e f g h") == 8
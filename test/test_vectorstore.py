@@ -1,11 +1,24 @@
+import os
+import time
+import asyncio
+import socket
+import shutil
+import functools
+import threading
 from os import path
-from typing import List
+from typing import List, Optional
 import pytest
-from unittest.mock import MagicMock
+from concurrent.futures import CancelledError
+from unittest.mock import AsyncMock, MagicMock, patch, create_autospec
 
 from random import random
 
 from langchain.embeddings.base import Embeddings
+from langchain.docstore.document import Document
+from langchain.callbacks.base import BaseCallbackHandler
+from langchain.chat_models.base import SimpleChatModel
+from langchain.schema.messages import AIMessageChunk
+from langchain.schema.output import ChatGenerationChunk
 
 from alphageist.vectorstore import VectorStore
 from alphageist.vectorstore import get_embeddings
@@ -13,10 +26,16 @@ from alphageist import errors
 from alphageist import config as cfg
 from alphageist import state
 from alphageist import vectorstore
+from alphageist import manifest
+from alphageist import constant
+from alphageist import circuit_breaker
+from alphageist import util
+from alphageist.manifest import get_manifest_path
+from alphageist.embedding_cache import CachedEmbeddings, EmbeddingCache
 
 from test.test_config import get_test_cfg_valid
 
-from qdrant_client import QdrantClient
+from qdrant_client import QdrantClient, AsyncQdrantClient
 from qdrant_client.http.models import Distance, VectorParams
 
 empty_dir_path = path.join("test", "data", "empty_folder")
@@ -63,7 +82,18 @@ def test_start_init_vectorstore_clean_state(tmp_path):
     assert v.state == state.LOADED
     assert path.exists(config[cfg.VECTORDB_DIR]) == True, "Expected vector DB directory to exist, but it does not"
     assert v.is_created() == True, "Expected vectorstore to be created and populated, but it is not"
-    assert v.store.client.count(collection_name=vectorstore.COLLECTION_NAME).count > 0
+    assert v.index.count() > 0
+
+@pytest.mark.parametrize("backend", ["numpy", "qdrant"])
+def test_start_init_vectorstore_backend(tmp_path, backend):
+    config = get_test_cfg_valid(tmp_path)
+    config[cfg.LOCAL_INDEX_BACKEND] = backend
+    v = VectorStore()
+    v.start_init_vectorstore(config, emb=MockEmbedding())
+    v._thread.join()
+
+    assert v.state == state.LOADED
+    assert len(v.store.similarity_search_with_score_by_vector(MockEmbedding().embed_query("hej"), k=4)) == 4
 
 def test_start_init_vectorstore_already_created(tmp_path):
     config = get_test_cfg_valid(tmp_path)
@@ -72,7 +102,7 @@ def test_start_init_vectorstore_already_created(tmp_path):
     v.start_init_vectorstore(config, emb = MockEmbedding())
     v._thread.join()
 
-    del v.store.client
+    v.index.close()
     v = VectorStore()
     v.start_init_vectorstore(config, emb = MockEmbedding())
 
@@ -80,7 +110,7 @@ def test_start_init_vectorstore_already_created(tmp_path):
     assert v.state == state.LOADED
     assert path.exists(config[cfg.VECTORDB_DIR]) == True, "Expected vector DB directory to exist, but it does not"
     assert v.is_created() == True, "Expected vectorstore to be created and populated, but it is not"
-    assert v.store.client.count(collection_name=vectorstore.COLLECTION_NAME).count > 0
+    assert v.index.count() > 0
 
 def test_start_init_vectorstore_empty_search_dir(tmp_path):
     config = get_test_cfg_valid(tmp_path)
@@ -94,12 +124,12 @@ def test_start_init_vectorstore_empty_search_dir(tmp_path):
 
 def test_reset_mocked():
     v = VectorStore()
-    mock_qdrantwrapper = MagicMock()
-    v.store = mock_qdrantwrapper
+    mock_index = MagicMock()
+    v.index = mock_index
     v.state = state.ERROR
     v.reset()
 
-    mock_qdrantwrapper.client.delete_collection.called_once_with(collection_name=vectorstore.COLLECTION_NAME)
+    mock_index.drop.assert_called_once()
     assert v.state == state.NEW
 
 def test_reset(tmp_path):
@@ -121,7 +151,7 @@ def test_reset_recreate(tmp_path):
     v._thread.join()
     
     assert v.state == state.LOADED
-    assert v.store.client.count(collection_name=vectorstore.COLLECTION_NAME).count > 0
+    assert v.index.count() > 0
 
 def test_is_created_no_collection():
     v = VectorStore()
@@ -131,10 +161,681 @@ def test_get_embeddings_correct_type():
     e = get_embeddings(test_cfg_with_api_key)
     assert isinstance(e, Embeddings)
 
-@pytest.mark.parametrize("inval_state", {state.NEW, state.LOADING, state.ERROR})
+@pytest.mark.parametrize("inval_state", {state.NEW, state.ERROR})
 def test_query_incrorect_state(inval_state:state.State):
     v = VectorStore()
     v.state = inval_state
     with pytest.raises(errors.InvalidStateError):
         v.query(get_test_cfg_valid(), "blabla")
 
+
+def test_update_vectorstore_added_modified_deleted(tmp_path):
+    search_dir = tmp_path / "search"
+    search_dir.mkdir()
+    shutil.copy(path.join("test", "data", "ww2", "ww2.txt"), search_dir)
+    shutil.copy(path.join("test", "data", "Employees_list.csv"), search_dir)
+    config = get_test_cfg_valid(str(tmp_path / "db"))
+    config[cfg.SEARCH_DIRS] = str(search_dir)
+
+    v = VectorStore()
+    v.start_init_vectorstore(config, emb=MockEmbedding())
+    v._thread.join()
+    assert v.index.count() == 147 + 26
+
+    os.remove(search_dir / "Employees_list.csv")
+    shutil.copy(path.join("test", "data", "code.py"), search_dir)
+    v.start_update_vectorstore(config)
+    v._update_thread.join()
+
+    assert v.index.count() == 147 + 1
+    assert set(v.manifest.files) == {str(search_dir / "ww2.txt"), str(search_dir / "code.py")}
+
+def test_update_vectorstore_on_startup(tmp_path):
+    search_dir = tmp_path / "search"
+    search_dir.mkdir()
+    shutil.copy(path.join("test", "data", "code.py"), search_dir)
+    config = get_test_cfg_valid(str(tmp_path / "db"))
+    config[cfg.SEARCH_DIRS] = str(search_dir)
+
+    v = VectorStore()
+    v.start_init_vectorstore(config, emb=MockEmbedding())
+    v._thread.join()
+    v.index.close()
+
+    shutil.copy(path.join("test", "data", "Employees_list.csv"), search_dir)
+    v = VectorStore()
+    v.start_init_vectorstore(config, emb=MockEmbedding())
+    assert v.state == state.LOADED
+    v._update_thread.join()
+
+    assert v.index.count() == 1 + 26
+
+def test_reset_removes_manifest(tmp_path):
+    config = get_test_cfg_valid(tmp_path)
+    config[cfg.SEARCH_DIRS] = path.join("test", "data", "ww2")
+    v = VectorStore()
+    v.start_init_vectorstore(config, emb=MockEmbedding())
+    v._thread.join()
+    assert get_manifest_path(v.index.path).exists()
+    v.reset()
+
+    assert not get_manifest_path(v.index.path).exists()
+
+def test_reset_cancels_update_scan(tmp_path):
+    config = get_test_cfg_valid(tmp_path)
+    config[cfg.SEARCH_DIRS] = path.join("test", "data", "ww2")
+    v = VectorStore()
+    v.start_init_vectorstore(config, emb=MockEmbedding())
+    v._thread.join()
+
+    scanning, release = threading.Event(), threading.Event()
+    scandir = os.scandir
+    def blocking_scandir(dir_path):
+        if str(dir_path) == config[cfg.SEARCH_DIRS]:
+            scanning.set()
+            release.wait(10)
+        return scandir(dir_path)
+    try:
+        with patch("alphageist.doc_generator.os.scandir", new=blocking_scandir):
+            v.start_update_vectorstore(config)
+            assert scanning.wait(10)
+            start = time.monotonic()
+            v.reset()
+            assert time.monotonic() - start < vectorstore.CANCEL_TIMEOUT_S
+            assert not v._update_thread.is_alive()
+    finally:
+        release.set()
+    assert not get_manifest_path(v.index.path).exists()
+
+def test_is_searchable_while_loading(tmp_path):
+    config = get_test_cfg_valid(tmp_path)
+    config[cfg.INDEXING_BATCH_SIZE] = 16
+    emb = BlockingEmbedding(block_after=1)
+    v = VectorStore()
+    assert not v.is_searchable()
+    v.start_init_vectorstore(config, emb=emb)
+    try:
+        assert emb.started.wait(10)
+        assert v.state == state.LOADING
+        assert _wait_for(v.is_searchable)
+    finally:
+        emb.release.set()
+    v._thread.join()
+    assert v.state == state.LOADED
+    assert v.is_searchable()
+
+def _get_test_query_cfg(work_dir) -> cfg.Config:
+    config = get_test_cfg_valid(work_dir)
+    config[cfg.LLM_MODEL_NAME] = "gpt-3.5-turbo"
+    config[cfg.LLM_TEMPERATURE] = 0.0
+    return config
+
+@pytest.fixture
+def no_warm_up(monkeypatch):
+    """For tests of the chain creation, which the warm up would otherwise race"""
+    monkeypatch.setattr(VectorStore, "start_warm_up", lambda self, config: None)
+
+def _loaded_vectorstore(config, emb: Optional[Embeddings] = None) -> VectorStore:
+    v = VectorStore()
+    v.start_init_vectorstore(config, emb=MockEmbedding() if emb is None else emb)
+    v._thread.join()
+    return v
+
+@patch('alphageist.vectorstore.ChatOpenAI', new=MagicMock())
+@patch('alphageist.vectorstore.RetrievalQAWithSourcesChain', new=MagicMock())
+def test_get_chain_reused_between_queries(tmp_path, no_warm_up):
+    config = _get_test_query_cfg(tmp_path)
+    v = _loaded_vectorstore(config)
+    with patch('alphageist.vectorstore.QdrantClient', new=create_autospec(QdrantClient)) as remote_client:
+        chain = v._get_chain(config)
+        assert v._get_chain(dict(config)) is chain
+        assert remote_client.call_count == 1
+
+@patch('alphageist.vectorstore.ChatOpenAI', new=MagicMock())
+def test_get_chain_recreated_on_config_change(tmp_path, no_warm_up):
+    config = _get_test_query_cfg(tmp_path)
+    v = _loaded_vectorstore(config)
+    with patch('alphageist.vectorstore.QdrantClient', new=create_autospec(QdrantClient)) as remote_client, \
+         patch('alphageist.vectorstore.RetrievalQAWithSourcesChain') as chain_cls:
+        chain_cls.from_chain_type.side_effect = lambda *args, **kwargs: MagicMock()
+        chain = v._get_chain(config)
+        config[cfg.LLM_TEMPERATURE] = 0.5
+        assert v._get_chain(config) is not chain
+        # The remote client is kept even though the chain is recreated
+        assert remote_client.call_count == 1
+
+def test_rebuild_vectorstore_swaps_when_complete(tmp_path):
+    search_dir = tmp_path / "search"
+    search_dir.mkdir()
+    shutil.copy(path.join("test", "data", "code.py"), search_dir)
+    config = get_test_cfg_valid(str(tmp_path / "db"))
+    config[cfg.SEARCH_DIRS] = str(search_dir)
+    v = _loaded_vectorstore(config)
+    old_index = v.index
+
+    shutil.copy(path.join("test", "data", "Employees_list.csv"), search_dir)
+    v.start_rebuild_vectorstore(config, emb=MockEmbedding())
+    assert v.state == state.LOADED
+    v._update_thread.join()
+
+    assert v.index is not old_index
+    assert v.store is v.index.store
+    assert v.index.count() == 1 + 26
+    assert set(v.manifest.files) == {str(search_dir / "code.py"), str(search_dir / "Employees_list.csv")}
+    # The replaced version is removed when the app starts next time
+    assert sorted(v.index.versions()) == [old_index.version, v.index.version]
+    v.index.close()
+
+    v = VectorStore()
+    v.start_init_vectorstore(config, emb=MockEmbedding())
+    assert v.state == state.LOADED
+    assert v.index.count() == 1 + 26
+    assert v.index.versions() == [v.index.version]
+
+def test_rebuild_vectorstore_keeps_replaced_index_for_running_queries(tmp_path):
+    config = get_test_cfg_valid(tmp_path)
+    config[cfg.SEARCH_DIRS] = path.join("test", "data", "ww2")
+    v = _loaded_vectorstore(config)
+    old_index = v.index
+    v.start_rebuild_vectorstore(config, emb=MockEmbedding())
+    v._update_thread.join()
+
+    # A query started before the swap still searches the replaced index
+    assert v.index is not old_index
+    assert old_index.search([MockEmbedding().embed_query("war")], k=2)[0]
+    assert old_index.keywords.search("war", k=2)
+
+    replaced_index = v.index
+    v.start_rebuild_vectorstore(config, emb=MockEmbedding())
+    v._update_thread.join()
+    assert sorted(v.index.versions()) == [replaced_index.version, v.index.version]
+    v.reset()
+    assert replaced_index.keywords.search("war") == []
+    assert v.index.versions() == [v.index.version]
+
+def test_rebuild_vectorstore_failed_keeps_current(tmp_path):
+    config = get_test_cfg_valid(tmp_path)
+    v = _loaded_vectorstore(config)
+    old_index = v.index
+    n_points = v.index.count()
+
+    config[cfg.SEARCH_DIRS] = empty_dir_path
+    v.start_rebuild_vectorstore(config, emb=MockEmbedding())
+    v._update_thread.join()
+
+    assert v.index is old_index
+    assert v.index.count() == n_points
+    assert v.index.versions() == [v.index.version]
+    assert v.state == state.LOADED
+
+def test_reset_cancels_rebuild(tmp_path):
+    config = get_test_cfg_valid(tmp_path)
+    v = _loaded_vectorstore(config)
+    v.start_rebuild_vectorstore(config, emb=MockEmbedding())
+    v.reset()
+    v._update_thread.join()
+
+    assert v.state == state.NEW
+    assert v.index.versions() in ([], [v.index.version])
+
+def test_reconfigure_api_key_recreates_embeddings_only(tmp_path):
+    config = get_test_cfg_valid(tmp_path)
+    v = _loaded_vectorstore(config)
+    old_index, old_emb = v.index, v.emb
+    new_config = config.deepcopy()
+    new_config[cfg.API_KEY_OPEN_AI] = "sk-other-fake-key"
+    with patch('alphageist.vectorstore.get_embeddings', return_value=MockEmbedding()) as get_emb:
+        v.reconfigure(config, new_config)
+
+    get_emb.assert_called_once_with(new_config)
+    assert v.emb is not old_emb
+    assert v.index is old_index
+    assert v._update_thread is None
+
+def test_reconfigure_closes_replaced_embedding_cache(tmp_path):
+    config = get_test_cfg_valid(tmp_path)
+    cache = EmbeddingCache(tmp_path / "embeddings.sqlite", 1)
+    v = _loaded_vectorstore(config, emb=CachedEmbeddings(MockEmbedding(), cache))
+    assert len(cache) > 0
+    new_config = config.deepcopy()
+    new_config[cfg.EMBEDDING_CACHE_SIZE_MB] = 2
+    with patch('alphageist.vectorstore.get_embeddings', return_value=MockEmbedding()):
+        v.reconfigure(config, new_config)
+
+    assert cache._conn is None
+
+def test_reconfigure_search_dir_keeps_unchanged_files(tmp_path):
+    old_dir, new_dir = tmp_path / "search" / "old", tmp_path / "search" / "new"
+    for d in (old_dir, new_dir):
+        d.mkdir(parents=True)
+        shutil.copy(path.join("test", "data", "ww2", "ww2.txt"), d)
+    shutil.copy(path.join("test", "data", "code.py"), new_dir)
+    config = get_test_cfg_valid(str(tmp_path / "db"))
+    config[cfg.SEARCH_DIRS] = str(tmp_path / "search")
+    v = _loaded_vectorstore(config)
+    ww2_ids = v.manifest.files[str(old_dir / "ww2.txt")].chunk_ids
+
+    new_config = config.deepcopy()
+    new_config[cfg.SEARCH_DIRS] = str(old_dir)
+    v.reconfigure(config, new_config)
+    v._update_thread.join()
+
+    assert set(v.manifest.files) == {str(old_dir / "ww2.txt")}
+    assert v.manifest.files[str(old_dir / "ww2.txt")].chunk_ids == ww2_ids
+    assert v.index.count() == 147
+
+def test_reconfigure_quantization_reopens_index(tmp_path):
+    config = get_test_cfg_valid(tmp_path)
+    v = _loaded_vectorstore(config)
+    old_index = v.index
+    n_points = v.index.count()
+    new_config = config.deepcopy()
+    new_config[cfg.VECTOR_QUANTIZATION] = "binary"
+    v.reconfigure(config, new_config)
+    v._update_thread.join()
+
+    assert v.index._codec.name == "binary"
+    assert v.index.count() == n_points
+    assert v.store is v.index
+    # Queries started before reopening can still search the previous index
+    assert old_index.search([MockEmbedding().embed_query("x")], k=2)[0]
+
+class BlockingEmbedding(MockEmbedding):
+    """Blocks every request after the first block_after until released"""
+    def __init__(self, block_after: int = 0):
+        super().__init__()
+        self.block_after = block_after
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.block_after > 0:
+            self.block_after -= 1
+        else:
+            self.started.set()
+            self.release.wait()
+        return super().embed_documents(texts)
+
+class FailingEmbedding(MockEmbedding):
+    """Fails after embedding fail_after batches"""
+    def __init__(self, fail_after: int):
+        super().__init__()
+        self.fail_after = fail_after
+        self.n_chunks = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.fail_after == 0:
+            raise RuntimeError("Connection lost")
+        self.fail_after -= 1
+        self.n_chunks += len(texts)
+        return super().embed_documents(texts)
+
+def test_failed_update_leaves_no_orphans(tmp_path):
+    search_dir = tmp_path / "search"
+    search_dir.mkdir()
+    shutil.copy(path.join("test", "data", "code.py"), search_dir)
+    config = get_test_cfg_valid(str(tmp_path / "db"))
+    config[cfg.SEARCH_DIRS] = str(search_dir)
+    config[cfg.INDEXING_BATCH_SIZE] = 16
+    v = VectorStore()
+    v.start_init_vectorstore(config, emb=MockEmbedding())
+    v._thread.join()
+
+    shutil.copy(path.join("test", "data", "ww2", "ww2.txt"), search_dir)
+    v.emb = FailingEmbedding(fail_after=2)
+    v.start_update_vectorstore(config)
+    v._update_thread.join()
+    assert v.emb.n_chunks > 0, "Unable to continue with test: nothing upserted before failing"
+    assert v.index.count() == 1
+    assert set(v.manifest.files) == {str(search_dir / "code.py")}
+
+    v.emb = MockEmbedding()
+    v.start_update_vectorstore(config)
+    v._update_thread.join()
+    assert v.index.count() == 1 + 147
+
+def test_interrupted_create_resumes(tmp_path, monkeypatch):
+    monkeypatch.setattr(manifest, "CHECKPOINT_INTERVAL_S", 0)
+    search_dir = tmp_path / "search"
+    search_dir.mkdir()
+    for f in ("code.py", "Employees_list.csv", path.join("ww2", "ww2.txt")):
+        shutil.copy(path.join("test", "data", f), search_dir)
+    config = get_test_cfg_valid(str(tmp_path / "db"))
+    config[cfg.SEARCH_DIRS] = str(search_dir)
+    config[cfg.INDEXING_BATCH_SIZE] = 16
+    config[cfg.EMBEDDING_CONCURRENCY] = 1
+
+    v = VectorStore()
+    v.start_init_vectorstore(config, emb=FailingEmbedding(fail_after=5))
+    v._thread.join()
+    assert v.state == state.ERROR
+    assert v.index.count() > 0
+    v.index.close()
+
+    emb = FailingEmbedding(fail_after=-1)
+    v = VectorStore()
+    v.start_init_vectorstore(config, emb=emb)
+    assert v.state == state.LOADING # A partial index is not complete
+    v._thread.join()
+
+    assert v.state == state.LOADED
+    assert v.index.count() == 1 + 26 + 147
+    assert emb.n_chunks < 1 + 26 + 147
+    assert sorted(len(e.chunk_ids) for e in v.manifest.files.values()) == [1, 26, 147]
+    assert not manifest.Checkpoint(v._manifest_path).exists()
+
+def test_reset_removes_checkpoint(tmp_path):
+    config = get_test_cfg_valid(tmp_path)
+    config[cfg.SEARCH_DIRS] = path.join("test", "data", "ww2")
+    config[cfg.INDEXING_BATCH_SIZE] = 16
+    v = VectorStore()
+    v.start_init_vectorstore(config, emb=FailingEmbedding(fail_after=1))
+    v._thread.join()
+    assert manifest.Checkpoint(v._manifest_path).exists()
+    v.reset()
+
+    assert not manifest.Checkpoint(v._manifest_path).exists()
+
+def test_reset_stops_indexing_in_flight(tmp_path):
+    config = get_test_cfg_valid(tmp_path)
+    emb = BlockingEmbedding()
+    v = VectorStore()
+    v.start_init_vectorstore(config, emb=emb)
+    assert emb.started.wait(10)
+    try:
+        v.reset()
+        assert not v._thread.is_alive()
+        assert v.state == state.NEW
+    finally:
+        emb.release.set()
+
+@patch('alphageist.vectorstore.ChatOpenAI', new=MagicMock())
+def test_keyword_mode_retrieves_without_network(tmp_path):
+    config = _get_test_query_cfg(tmp_path)
+    config[cfg.RETRIEVAL_MODE] = "keyword"
+    v = _loaded_vectorstore(config)
+    with patch('alphageist.vectorstore.QdrantClient', new=create_autospec(QdrantClient)) as remote_client, \
+         patch('alphageist.vectorstore.RetrievalQAWithSourcesChain') as chain_cls:
+        v._get_chain(config)
+        retriever = chain_cls.from_chain_type.call_args.kwargs["retriever"]
+    assert remote_client.call_count == 0
+    assert retriever.keyword_index is v.index.keywords
+    assert len(retriever.invoke("Stalingrad")) == 4
+
+def test_update_rebuilds_missing_keywords(tmp_path):
+    config = get_test_cfg_valid(tmp_path)
+    v = _loaded_vectorstore(config)
+    n_chunks = v.index.count()
+    v.index.keywords.drop()
+    v.start_update_vectorstore(config)
+    v._update_thread.join()
+    assert v.index.keywords.count() == n_chunks
+
+def test_paths_searchable_after_create_and_update(tmp_path):
+    search_dir = tmp_path / "search"
+    search_dir.mkdir()
+    shutil.copy(path.join("test", "data", "ww2", "ww2.txt"), search_dir)
+    shutil.copy(path.join("test", "data", "Employees_list.csv"), search_dir)
+    config = get_test_cfg_valid(str(tmp_path / "db"))
+    config[cfg.SEARCH_DIRS] = str(search_dir)
+
+    v = VectorStore()
+    v.start_init_vectorstore(config, emb=MockEmbedding())
+    v._thread.join()
+    assert v.paths.search("employees") == [str(search_dir / "Employees_list.csv")]
+
+    os.remove(search_dir / "Employees_list.csv")
+    v.start_update_vectorstore(config)
+    v._update_thread.join()
+    assert v.paths.search("employees") == []
+    assert v.paths.search("WW2") == [str(search_dir / "ww2.txt")]
+
+    v.reset()
+    assert len(v.paths) == 0
+
+class FixedEmbedding(MockEmbedding):
+    """Embeds queries that start with the same word to the same vector"""
+    def embed_query(self, text: str) -> List[float]:
+        return [1.0 if i == hash(text.split()[0]) % 10 else 0.0 for i in range(10)]
+
+def _answering_chain(answer: str, source: str) -> MagicMock:
+    chain = MagicMock(question_key="question", answer_key="answer", sources_answer_key="sources")
+    chain.ainvoke = AsyncMock()
+    chain.ainvoke.return_value = {"answer": f"{answer}\n", "sources": source,
+                                 "source_documents": [Document(page_content="", metadata={"source": source})]}
+    return chain
+
+def test_query_answer_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(constant, "ANSWER_CACHE_PATH", tmp_path / "answers.sqlite")
+    search_dir = tmp_path / "search"
+    search_dir.mkdir()
+    shutil.copy(path.join("test", "data", "ww2", "ww2.txt"), search_dir)
+    shutil.copy(path.join("test", "data", "code.py"), search_dir)
+    config = _get_test_query_cfg(str(tmp_path / "db"))
+    config[cfg.SEARCH_DIRS] = str(search_dir)
+    config[cfg.ANSWER_CACHE_SIZE] = 10
+    config[cfg.ANSWER_CACHE_SIMILARITY] = 0.9
+    v = VectorStore()
+    v.start_init_vectorstore(config, emb=FixedEmbedding())
+    v._thread.join()
+    chain = _answering_chain("1939", str(search_dir / "ww2.txt"))
+    v._get_chain = lambda config: chain
+
+    assert v.query(config, "When did WW2 start?")["answer"] == "1939\n"
+    callback = MagicMock()
+    res = v.query(config, "When did the war start?", callbacks=[callback])
+    assert res["answer"] == "1939\n"
+    assert chain.ainvoke.call_count == 1
+    callback.on_llm_new_token.assert_called_once()
+    llm_result = callback.on_llm_end.call_args.args[0]
+    assert llm_result.generations[0][0].text == f"1939\nSOURCES: {search_dir / 'ww2.txt'}"
+
+    # Answers based on a changed file are not reused
+    (search_dir / "code.py").write_text("print('changed')")
+    v.start_update_vectorstore(config)
+    v._update_thread.join()
+    v.query(config, "When did WW2 start?")
+    assert chain.ainvoke.call_count == 1
+    (search_dir / "ww2.txt").write_text("changed")
+    v.start_update_vectorstore(config)
+    v._update_thread.join()
+    v.query(config, "When did WW2 start?")
+    assert chain.ainvoke.call_count == 2
+    v.answer_cache.close()
+
+def test_remote_store_disabled(tmp_path, no_warm_up):
+    config = _get_test_query_cfg(tmp_path)
+    config[cfg.REMOTE_STORE_ENABLED] = False
+    v = _loaded_vectorstore(config)
+    with patch('alphageist.vectorstore.QdrantClient', new=create_autospec(QdrantClient)) as remote_client, \
+         patch('alphageist.vectorstore.RetrievalQAWithSourcesChain') as chain_cls:
+        v._get_chain(config)
+        retriever = chain_cls.from_chain_type.call_args.kwargs["retriever"]
+    assert remote_client.call_count == 0
+    assert retriever.vectorstores == [v.store]
+
+@pytest.fixture
+def unresponsive_server():
+    """Local stand-in for the remote store that accepts connections but never answers"""
+    server = socket.create_server(("127.0.0.1", 0))
+    connections = []
+    def accept():
+        while True:
+            try:
+                connections.append(server.accept()[0])
+            except OSError:
+                return
+    threading.Thread(target=accept, daemon=True).start()
+    yield server.getsockname()[1]
+    server.close()
+    for conn in connections:
+        conn.close()
+
+def test_unresponsive_remote_store_circuit_opens(tmp_path, monkeypatch, unresponsive_server, no_warm_up):
+    port = unresponsive_server
+    monkeypatch.setattr(constant, "QDRANT_CLOUD_URL", f"http://127.0.0.1:{port}")
+    monkeypatch.setattr(vectorstore, "QdrantClient", functools.partial(QdrantClient, grpc_port=port))
+    config = _get_test_query_cfg(tmp_path)
+    config[cfg.RETRIEVAL_MODE] = "dense"
+    config[cfg.REMOTE_STORE_LATENCY_BUDGET_S] = 0.2
+    v = _loaded_vectorstore(config)
+    with patch('alphageist.vectorstore.RetrievalQAWithSourcesChain') as chain_cls:
+        v._get_chain(config)
+        retriever = chain_cls.from_chain_type.call_args.kwargs["retriever"]
+
+    for _ in range(v._remote_breaker.failure_threshold):
+        start = time.monotonic()
+        assert len(retriever.invoke("Stalingrad")) == 4
+        assert time.monotonic() - start < 2
+    assert v._remote_breaker.state == circuit_breaker.OPEN
+
+    start = time.monotonic()
+    assert len(retriever.invoke("Stalingrad")) == 4
+    assert time.monotonic() - start < 0.2
+
+def _wait_for(condition, timeout: float = 5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+closed_streams = []
+
+class StreamingLLM(SimpleChatModel):
+    """Streams a long answer word by word, recording in closed_streams when the stream is closed"""
+
+    @property
+    def _llm_type(self) -> str: return "StreamingLLM"
+
+    def _call(self, *args, **kwargs) -> str:
+        return "".join(chunk.text for chunk in self._stream(*args, **kwargs))
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        try:
+            for i in range(1000):
+                chunk = ChatGenerationChunk(message=AIMessageChunk(content=f"word{i} "))
+                if run_manager is not None:
+                    run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+                yield chunk
+        finally:
+            closed_streams.append(True)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        try:
+            for i in range(1000):
+                chunk = ChatGenerationChunk(message=AIMessageChunk(content=f"word{i} "))
+                if run_manager is not None:
+                    await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+                yield chunk
+                await asyncio.sleep(0.01)
+        finally:
+            closed_streams.append(True)
+
+class RecordingHandler(BaseCallbackHandler):
+    """Records the callback events and cancels query_ctx on cancel_on"""
+    def __init__(self, query_ctx: util.QueryContext, cancel_on: str):
+        self.query_ctx = query_ctx
+        self.cancel_on = cancel_on
+        self.events = []
+
+    def _record(self, event: str):
+        self.events.append(event)
+        if event == self.cancel_on:
+            self.query_ctx.cancel()
+
+    def on_retriever_start(self, *args, **kwargs): self._record("retriever_start")
+    def on_llm_start(self, *args, **kwargs): self._record("llm_start")
+    def on_llm_new_token(self, *args, **kwargs): self._record("token")
+    def on_llm_end(self, *args, **kwargs): self._record("llm_end")
+
+@patch('alphageist.vectorstore.ChatOpenAI', new=StreamingLLM)
+def test_query_cancelled_while_streaming(tmp_path):
+    config = _get_test_query_cfg(tmp_path)
+    config[cfg.REMOTE_STORE_ENABLED] = False
+    v = _loaded_vectorstore(config)
+    query_ctx = util.QueryContext("Stalingrad")
+    handler = RecordingHandler(query_ctx, cancel_on="token")
+    closed_streams.clear()
+
+    assert v.query(config, "Stalingrad", callbacks=[handler], query_ctx=query_ctx) == {}
+    assert handler.events == ["retriever_start", "llm_start", "token"]
+    assert _wait_for(lambda: closed_streams == [True])
+    assert v.state is state.LOADED
+
+@patch('alphageist.vectorstore.ChatOpenAI', new=StreamingLLM)
+def test_query_cancelled_before_llm(tmp_path):
+    config = _get_test_query_cfg(tmp_path)
+    config[cfg.REMOTE_STORE_ENABLED] = False
+    v = _loaded_vectorstore(config)
+    query_ctx = util.QueryContext("Stalingrad")
+    handler = RecordingHandler(query_ctx, cancel_on="retriever_start")
+
+    assert v.query(config, "Stalingrad", callbacks=[handler], query_ctx=query_ctx) == {}
+    assert handler.events == ["retriever_start"]
+    assert v.state is state.LOADED
+
+@patch('alphageist.vectorstore.ChatOpenAI', new=StreamingLLM)
+def test_start_query_cancelled_while_streaming(tmp_path):
+    config = _get_test_query_cfg(tmp_path)
+    config[cfg.REMOTE_STORE_ENABLED] = False
+    v = _loaded_vectorstore(config)
+    query_ctx = util.QueryContext("Stalingrad")
+    handler = RecordingHandler(query_ctx, cancel_on="")
+    closed_streams.clear()
+
+    future = v.start_query(config, "Stalingrad", callbacks=[handler], query_ctx=query_ctx)
+    assert _wait_for(lambda: "token" in handler.events)
+    query_ctx.cancel()
+    with pytest.raises(CancelledError):
+        future.result(timeout=5)
+    # The task is cancelled where it waits for the stream, which is closed
+    assert _wait_for(lambda: closed_streams == [True])
+    assert handler.events.count("token") < 1000
+    assert "llm_end" not in handler.events
+    assert v.state is state.LOADED
+
+@patch('alphageist.vectorstore.ChatOpenAI', new=StreamingLLM)
+def test_warm_up_when_loaded(tmp_path):
+    config = _get_test_query_cfg(tmp_path)
+    with patch('alphageist.vectorstore.QdrantClient', new=create_autospec(QdrantClient)), \
+         patch('alphageist.vectorstore.AsyncQdrantClient', new=create_autospec(AsyncQdrantClient)) as async_client:
+        v = VectorStore()
+        v.start_init_vectorstore(config, emb=MockEmbedding())
+        v._thread.join()
+        get_collection = async_client.return_value.get_collection
+        assert _wait_for(lambda: get_collection.await_count == 1)
+    assert v._chain is not None
+    assert v._get_chain(config) is v._chain
+
+class AnsweringLLM(SimpleChatModel):
+    @property
+    def _llm_type(self) -> str: return "AnsweringLLM"
+
+    def _call(self, *args, **kwargs) -> str:
+        return "In 1942\nSOURCES: ww2.txt"
+
+@patch('alphageist.vectorstore.ChatOpenAI', new=AnsweringLLM)
+def test_query_partial_index_while_loading(tmp_path):
+    config = _get_test_query_cfg(tmp_path)
+    config[cfg.REMOTE_STORE_ENABLED] = False
+    config[cfg.INDEXING_BATCH_SIZE] = 16
+    emb = BlockingEmbedding(block_after=1)
+    v = VectorStore()
+    v.start_init_vectorstore(config, emb=emb)
+    try:
+        assert emb.started.wait(10)
+        assert _wait_for(v.is_searchable)
+        assert v.state == state.LOADING
+        n_indexed = v.index.count()
+        assert n_indexed < 147
+
+        res = v.query(config, "Stalingrad")
+        assert res["answer"] == "In 1942\n"
+        assert 0 < len(res["source_documents"]) <= n_indexed
+        assert v.state == state.LOADING
+    finally:
+        emb.release.set()
+    v._thread.join()
+    assert v.state == state.LOADED